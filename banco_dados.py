@@ -0,0 +1,412 @@
+# banco_dados.py
+
+import sqlite3
+import json
+import zlib
+import os
+import socket
+import time
+from functools import lru_cache
+from configuracao import obter, parametro
+
+# Módulo compartilhado de acesso ao SQLite usado pelos três scripts.
+#    - conectar_db(): abre conexões com o perfil de desempenho (WAL, synchronous=NORMAL,
+#      mmap, cache) e um busy timeout, para que criação, status e limpeza possam rodar
+#      ao mesmo tempo sem "database is locked".
+#    - setup_database(): aplica, em ordem, as migrações ainda não aplicadas ao banco,
+#      controladas por PRAGMA user_version.
+#    - iterar_lotes(): percorre uma tabela em páginas por keyset (chave > última chave
+#      da página anterior), com uma consulta curta por página e memória limitada.
+#    - reservar_pedidos(): reserva (lease) atômica de um lote de pedidos para um worker,
+#      para que várias cópias das etapas de status dividam o mesmo banco sem processar
+#      o mesmo pedido duas vezes; também avança por keyset.
+
+# ==============================================================================
+# --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
+# ==============================================================================
+db_busy_timeout_ms = parametro('DB_BUSY_TIMEOUT_MS', '30000', int)
+db_mmap_bytes = parametro('DB_MMAP_BYTES', str(256 * 1024 * 1024), int)
+db_cache_kib = parametro('DB_CACHE_KIB', str(64 * 1024), int)
+
+# Armazenamento da resposta completa do shipment_order: 'zlib' (tabela pedidos_resposta,
+# comprimida) ou 'nenhum' (não guarda). Os campos usados pelas etapas ficam em colunas de pedidos.
+resposta_completa_modo = parametro('RESPOSTA_COMPLETA_MODO', 'zlib')
+resposta_completa_nivel_zlib = parametro('RESPOSTA_COMPLETA_NIVEL_ZLIB', '6', int)
+
+# UPDATE ... RETURNING (reservas) exige SQLite 3.35; colunas geradas, 3.31
+SQLITE_VERSAO_MINIMA = (3, 35, 0)
+
+# Duração da reserva de um lote de pedidos; reservas vencidas voltam a ficar disponíveis.
+# Deve ser maior que o tempo de processamento de um lote.
+reserva_duracao_segundos = parametro('RESERVA_DURACAO_SEGUNDOS', '300', float)
+
+# Data do próximo evento de tracking de um pedido 'CONSULTADO', conforme o estado atual
+SQL_NEXT_ACTION_DATE = """CASE latest_volume_state
+        WHEN 'SHIPPED' THEN update_date_in_transit
+        WHEN 'IN_TRANSIT' THEN CASE WHEN late_delivery_flag = 1 THEN update_date_to_be_delivered ELSE update_date_delivered END
+        WHEN 'TO_BE_DELIVERED' THEN update_date_delivered
+    END"""
+
+# Ordem das transições com a mesma data devida na ETAPA 3: primeiro as que concluem a entrega
+SQL_PRIORIDADE_TRANSICAO = """CASE latest_volume_state
+        WHEN 'TO_BE_DELIVERED' THEN 0
+        WHEN 'IN_TRANSIT' THEN 1
+        ELSE 2
+    END"""
+
+# ==============================================================================
+# --- CONEXÃO ---
+# ==============================================================================
+def conectar_db(db_file, compartilhada=False):
+    """Abre uma conexão configurada; `compartilhada` permite usá-la de várias threads (com lock próprio)."""
+    db_dir = os.path.dirname(db_file)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    conn = sqlite3.connect(db_file, timeout=db_busy_timeout_ms() / 1000, check_same_thread=not compartilhada)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {db_busy_timeout_ms()}")
+    # Só tem efeito em bancos novos (antes do WAL e das tabelas); bancos existentes são
+    # convertidos pelo VACUUM da limpeza
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA mmap_size = {db_mmap_bytes()}")
+    conn.execute(f"PRAGMA cache_size = -{db_cache_kib()}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+# ==============================================================================
+# --- RESPOSTA COMPLETA DOS PEDIDOS (TABELA LATERAL COMPRIMIDA) ---
+# ==============================================================================
+def comprimir_resposta(conteudo):
+    """Comprime o corpo bruto (bytes) da resposta; retorna None se o modo for 'nenhum'."""
+    if resposta_completa_modo() == 'nenhum':
+        return None
+    return zlib.compress(conteudo, resposta_completa_nivel_zlib())
+
+def gravar_respostas(cursor, respostas):
+    """Grava uma lista de (order_number, payload_zlib); itens com payload None são ignorados."""
+    cursor.executemany(
+        "INSERT OR REPLACE INTO pedidos_resposta (order_number, payload_zlib) VALUES (?, ?)",
+        [(order_number, payload) for order_number, payload in respostas if payload is not None]
+    )
+
+def carregar_resposta_completa(conn, order_number):
+    """Carrega e descomprime sob demanda a resposta completa do pedido, ou None se não houver."""
+    row = conn.execute("SELECT payload_zlib FROM pedidos_resposta WHERE order_number = ?", (order_number,)).fetchone()
+    return json.loads(zlib.decompress(row[0])) if row else None
+
+# ==============================================================================
+# --- PAGINAÇÃO POR KEYSET ---
+# ==============================================================================
+def _condicao_apos(chave, apos):
+    """Condição '(colunas da chave) > (apos)' e seus parâmetros; sem `apos`, não restringe."""
+    if apos is None:
+        return "1", {}
+    parametros = {f"apos_{i}": valor for i, valor in enumerate(apos)}
+    return f"({', '.join(chave)}) > ({', '.join(':' + nome for nome in parametros)})", parametros
+
+def ultima_chave(linhas, chave):
+    """Valor da `chave` da última linha de uma página (ponto de partida da seguinte)."""
+    return tuple(linhas[-1][coluna] for coluna in chave)
+
+def iterar_lotes(conn, condicao, parametros, colunas, tamanho_lote, chave=("order_number",), tabela="pedidos", apos=None):
+    """
+    Gera as linhas de `tabela` que atendem `condicao` em páginas de até `tamanho_lote`,
+    ordenadas por `chave` (colunas não nulas e, juntas, únicas). Cada página é uma consulta
+    própria que começa depois da última chave da anterior, então o consumidor pode alterar
+    ou remover as linhas entre uma página e outra; `apos` retoma de uma chave conhecida.
+    Os parâmetros :limite e :apos_N são usados internamente.
+    """
+    while True:
+        condicao_apos, parametros_apos = _condicao_apos(chave, apos)
+        pagina = conn.execute(
+            f"SELECT {colunas} FROM {tabela} WHERE ({condicao}) AND {condicao_apos} ORDER BY {', '.join(chave)} LIMIT :limite",
+            {**parametros, **parametros_apos, "limite": tamanho_lote}
+        ).fetchall()
+        if not pagina:
+            return
+        yield pagina
+        if len(pagina) < tamanho_lote:
+            return
+        apos = ultima_chave(pagina, chave)
+
+# ==============================================================================
+# --- RESERVA DE PEDIDOS (LEASES) ---
+# ==============================================================================
+@lru_cache(maxsize=None)
+def identificador_worker():
+    """Identifica o processo nas reservas: WORKER_ID ou '<host>:<pid>'."""
+    return obter('WORKER_ID') or f"{socket.gethostname()}:{os.getpid()}"
+
+def reservar_pedidos(conn, condicao, parametros, colunas, limite, chave=("order_number",), apos=None, duracao=None, tabela="pedidos"):
+    """
+    Reserva para este worker até `limite` linhas de `tabela` (pedidos ou pedidos_intencao)
+    que atendem `condicao` (SQL com parâmetros nomeados) e não têm reserva válida, e retorna
+    `colunas` de cada uma (que devem incluir a `chave`), em ordem de `chave`. Seleção e reserva são um único
+    UPDATE ... RETURNING, atômico entre processos. Passando em `apos` a ultima_chave do lote
+    anterior, a busca recomeça dali em vez de percorrer de novo os pedidos já reservados.
+    Os parâmetros :limite, :apos_N, :worker, :agora e :expira_em são usados internamente.
+    """
+    agora = time.time()
+    condicao_apos, parametros_apos = _condicao_apos(chave, apos)
+    with conn:
+        linhas = conn.execute(
+            f"""UPDATE {tabela} SET reservado_por = :worker, reserva_expira_em = :expira_em
+                WHERE order_number IN (
+                    SELECT order_number FROM {tabela}
+                    WHERE ({condicao}) AND {condicao_apos} AND (reserva_expira_em IS NULL OR reserva_expira_em < :agora)
+                    ORDER BY {', '.join(chave)}
+                    LIMIT :limite
+                )
+                RETURNING {colunas}""",
+            {**parametros, **parametros_apos, "worker": identificador_worker(), "agora": agora,
+             "expira_em": agora + (duracao or reserva_duracao_segundos()), "limite": limite}
+        ).fetchall()
+    # A ordem do RETURNING não é garantida
+    return sorted(linhas, key=lambda linha: tuple(linha[coluna] for coluna in chave))
+
+def renovar_reservas(conn, order_numbers, duracao=None, tabela="pedidos"):
+    """
+    Estende as reservas deste worker sobre `order_numbers` (em `tabela`, pedidos ou
+    pedidos_intencao) e retorna quantas foram renovadas.
+    As que já passaram a outro worker ou foram desfeitas não são tocadas: esses pedidos não
+    devem mais ser processados por este worker.
+    """
+    expira_em = time.time() + (duracao or reserva_duracao_segundos())
+    with conn:
+        cursor = conn.executemany(
+            f"UPDATE {tabela} SET reserva_expira_em = ? WHERE order_number = ? AND reservado_por = ?",
+            [(expira_em, order_number, identificador_worker()) for order_number in order_numbers]
+        )
+        return cursor.rowcount
+
+def liberar_pedidos(conn, order_numbers):
+    """Desfaz as reservas deste worker sobre `order_numbers` (pedidos com falha ou pulados)."""
+    with conn:
+        conn.executemany(
+            "UPDATE pedidos SET reservado_por = NULL, reserva_expira_em = NULL WHERE order_number = ? AND reservado_por = ?",
+            [(order_number, identificador_worker()) for order_number in order_numbers]
+        )
+
+# ==============================================================================
+# --- MIGRAÇÕES DE SCHEMA ---
+# ==============================================================================
+def _migracao_1_tabela_pedidos(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pedidos (
+            order_number TEXT PRIMARY KEY,
+            status_processo TEXT NOT NULL,
+            latest_volume_state TEXT,
+            created_iso TEXT,
+            estimated_delivery_date_iso TEXT,
+            delivery_method_id TEXT,
+            full_response_json TEXT,
+            late_delivery_flag INTEGER NOT NULL DEFAULT 0,
+            data_criacao_db TEXT,
+            data_atualizacao_db TEXT,
+            update_date_in_transit TEXT,
+            update_date_to_be_delivered TEXT,
+            update_date_delivered TEXT
+        )
+    ''')
+
+def _migracao_2_next_action_date(cursor):
+    colunas = {row[1] for row in cursor.execute("PRAGMA table_info(pedidos)")}
+    if 'next_action_date' not in colunas:
+        cursor.execute("ALTER TABLE pedidos ADD COLUMN next_action_date TEXT")
+        cursor.execute(f"UPDATE pedidos SET next_action_date = {SQL_NEXT_ACTION_DATE} WHERE status_processo = 'CONSULTADO'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_status_next_action ON pedidos (status_processo, next_action_date)")
+
+def _migracao_3_tabelas_auxiliares(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cache_cep (
+            cep TEXT PRIMARY KEY,
+            endereco_json TEXT,
+            encontrado INTEGER NOT NULL,
+            expira_em REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cache_cotacao (
+            chave TEXT PRIMARY KEY,
+            cotacao_json TEXT NOT NULL,
+            expira_em REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS gerador_ids_nos (
+            registro_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            host TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            registrado_em TEXT NOT NULL
+        )
+    ''')
+
+def _migracao_4_indices_etapas(cursor):
+    # ETAPA 1 (status_processo = 'CRIADO'), ETAPA 2 (contagens e candidatos por late_delivery_flag)
+    # e limpeza (status_processo = 'COMPLETO' por update_date_delivered)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_status_late ON pedidos (status_processo, late_delivery_flag)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_status_delivered ON pedidos (status_processo, update_date_delivered)")
+
+def _migracao_5_respostas_comprimidas(cursor):
+    # A remoção de um pedido remove sua resposta (PRAGMA foreign_keys = ON em conectar_db)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pedidos_resposta (
+            order_number TEXT PRIMARY KEY REFERENCES pedidos(order_number) ON DELETE CASCADE,
+            payload_zlib BLOB NOT NULL
+        )
+    ''')
+    # Move as respostas já gravadas como texto; a coluna full_response_json fica vazia (legado)
+    leitura = cursor.connection.cursor()
+    leitura.execute("SELECT order_number, full_response_json FROM pedidos WHERE full_response_json IS NOT NULL")
+    while lote := leitura.fetchmany(1000):
+        cursor.executemany(
+            "INSERT OR REPLACE INTO pedidos_resposta (order_number, payload_zlib) VALUES (?, ?)",
+            [(order_number, zlib.compress(texto.encode('utf-8'), resposta_completa_nivel_zlib())) for order_number, texto in lote]
+        )
+    cursor.execute("UPDATE pedidos SET full_response_json = NULL WHERE full_response_json IS NOT NULL")
+
+def _migracao_6_limites_taxa(cursor):
+    # Baldes do limitador de taxa (limitador_taxa.py); chave = hash da API key
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS limites_taxa (
+            chave TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            taxa REAL NOT NULL,
+            atualizado_em REAL NOT NULL
+        )
+    ''')
+
+def _migracao_7_intencoes_de_criacao(cursor):
+    # Outbox da criação: a intenção é gravada antes do POST e removida quando o pedido
+    # entra em pedidos; as PENDENTES são reconciliadas por GET na execução seguinte
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pedidos_intencao (
+            order_number TEXT PRIMARY KEY,
+            estado TEXT NOT NULL,
+            dados_json TEXT NOT NULL,
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            criado_em TEXT,
+            atualizado_em TEXT,
+            ultimo_erro TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_intencao_estado ON pedidos_intencao (estado)")
+
+def _migracao_8_dados_sinteticos(cursor):
+    # Pools de clientes e notas fiscais (dados_sinteticos.py), em JSON comprimido com zlib
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dados_sinteticos (
+            chave TEXT PRIMARY KEY,
+            dados_zlib BLOB NOT NULL,
+            gerado_em REAL NOT NULL
+        )
+    ''')
+
+def _migracao_9_reservas(cursor):
+    colunas = {row[1] for row in cursor.execute("PRAGMA table_info(pedidos)")}
+    if 'reservado_por' not in colunas:
+        cursor.execute("ALTER TABLE pedidos ADD COLUMN reservado_por TEXT")
+        cursor.execute("ALTER TABLE pedidos ADD COLUMN reserva_expira_em REAL")
+
+def _migracao_10_indices_keyset(cursor):
+    # order_number no fim dos índices das etapas: a paginação por keyset de (data, order_number)
+    # da ETAPA 3 e da limpeza percorre o índice sem ordenação adicional
+    cursor.execute("DROP INDEX IF EXISTS idx_pedidos_status_next_action")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_status_next_action ON pedidos (status_processo, next_action_date, order_number)")
+    cursor.execute("DROP INDEX IF EXISTS idx_pedidos_status_delivered")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_status_delivered ON pedidos (status_processo, update_date_delivered, order_number)")
+
+def _migracao_11_prioridade_transicao(cursor):
+    # Coluna gerada (VIRTUAL: calculada na leitura, só o índice a armazena) usada na ordem de
+    # despacho da ETAPA 3: mais atrasados primeiro e, na mesma data, por transição
+    colunas = {row[1] for row in cursor.execute("PRAGMA table_xinfo(pedidos)")}
+    if 'prioridade_transicao' not in colunas:
+        cursor.execute(f"ALTER TABLE pedidos ADD COLUMN prioridade_transicao INTEGER GENERATED ALWAYS AS ({SQL_PRIORIDADE_TRANSICAO}) VIRTUAL")
+    cursor.execute("DROP INDEX IF EXISTS idx_pedidos_status_next_action")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_status_next_action ON pedidos (status_processo, next_action_date, prioridade_transicao, order_number)")
+
+def _migracao_12_reservas_ids_de_no(cursor):
+    # Ids de nó do gerador_ids reservados por tempo limitado e reaproveitados depois de
+    # vencidos; substitui o registro sem fim de gerador_ids_nos (um id por início de processo)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS gerador_ids_nos_reservas (
+            no_id INTEGER PRIMARY KEY,
+            dono TEXT NOT NULL,
+            host TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            reservado_em TEXT NOT NULL,
+            expira_em REAL NOT NULL
+        )
+    ''')
+    cursor.execute("DROP TABLE IF EXISTS gerador_ids_nos")
+
+def _migracao_13_remove_limites_taxa(cursor):
+    # Os baldes do limitador de taxa passaram para um SQLite próprio (limitador_taxa.py)
+    cursor.execute("DROP TABLE IF EXISTS limites_taxa")
+
+def _migracao_14_reservas_intencoes(cursor):
+    # Intenções reservadas por quem as envia ou reconcilia (ver criar_pedidos_db): uma
+    # intenção em andamento noutro processo não é reconciliada enquanto a reserva vale
+    colunas = {row[1] for row in cursor.execute("PRAGMA table_info(pedidos_intencao)")}
+    if 'reservado_por' not in colunas:
+        cursor.execute("ALTER TABLE pedidos_intencao ADD COLUMN reservado_por TEXT")
+        cursor.execute("ALTER TABLE pedidos_intencao ADD COLUMN reserva_expira_em REAL")
+
+# Lista ordenada de (versão, descrição, função). Novas migrações entram sempre no fim.
+MIGRACOES = [
+    (1, "tabela pedidos", _migracao_1_tabela_pedidos),
+    (2, "coluna e índice next_action_date", _migracao_2_next_action_date),
+    (3, "tabelas de cache e do gerador de ids", _migracao_3_tabelas_auxiliares),
+    (4, "índices compostos das etapas", _migracao_4_indices_etapas),
+    (5, "respostas completas comprimidas em pedidos_resposta", _migracao_5_respostas_comprimidas),
+    (6, "tabela limites_taxa", _migracao_6_limites_taxa),
+    (7, "tabela pedidos_intencao (outbox da criação)", _migracao_7_intencoes_de_criacao),
+    (8, "tabela dados_sinteticos", _migracao_8_dados_sinteticos),
+    (9, "colunas de reserva (lease) em pedidos", _migracao_9_reservas),
+    (10, "índices das etapas com order_number (keyset)", _migracao_10_indices_keyset),
+    (11, "coluna gerada prioridade_transicao", _migracao_11_prioridade_transicao),
+    (12, "reservas dos ids de nó do gerador de números de pedido", _migracao_12_reservas_ids_de_no),
+    (13, "limites_taxa sai do banco dos pedidos", _migracao_13_remove_limites_taxa),
+    (14, "colunas de reserva (lease) em pedidos_intencao", _migracao_14_reservas_intencoes),
+]
+
+def aplicar_migracoes(conn):
+    """Aplica as migrações pendentes; cada uma roda numa transação IMMEDIATE própria."""
+    aplicadas = []
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        for versao, descricao, migracao in MIGRACOES:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                # Relido dentro do lock: outro processo pode ter migrado enquanto esperávamos
+                if cursor.execute("PRAGMA user_version").fetchone()[0] >= versao:
+                    cursor.execute("COMMIT")
+                    continue
+                migracao(cursor)
+                cursor.execute(f"PRAGMA user_version = {versao}")
+                cursor.execute("COMMIT")
+                aplicadas.append(f"{versao} ({descricao})")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+    finally:
+        conn.isolation_level = isolation_level
+    return aplicadas
+
+def setup_database(db_file):
+    """Cria ou atualiza o schema do banco para a versão mais recente."""
+    if sqlite3.sqlite_version_info < SQLITE_VERSAO_MINIMA:
+        raise RuntimeError(f"Erro: SQLite {sqlite3.sqlite_version} encontrado; os scripts exigem SQLite >= {'.'.join(map(str, SQLITE_VERSAO_MINIMA))}.")
+    conn = conectar_db(db_file)
+    try:
+        aplicadas = aplicar_migracoes(conn)
+    finally:
+        conn.close()
+    if aplicadas:
+        print(f"INFO: Migrações aplicadas ao banco de dados: {', '.join(aplicadas)}.")
+    print("Banco de dados inicializado com sucesso.")
@@ -0,0 +1,86 @@
+# benchmark_inicializacao.py
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import time
+
+# Mede o tempo de início a frio dos scripts: cada medição é um processo Python novo que
+# importa o módulo (ou executa '<script> --help'). Também confere quais módulos pesados
+# cada script carrega no import: nenhum lê o .env (dotenv) no import, e os scripts de status
+# e de limpeza não podem carregar o Faker.
+# As variáveis obrigatórias não precisam estar definidas: o import não as exige.
+
+# ==============================================================================
+# --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
+# ==============================================================================
+DIR_SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPTS = ["criar_pedidos_db", "gerenciar_status_pedidos_db", "limpeza_base", "servico_pipeline"]
+MODULOS_PESADOS = ["faker", "holidays", "requests", "dotenv"]
+# Módulos que cada script não pode carregar no import
+PROIBIDOS = {
+    "criar_pedidos_db": {"dotenv"},
+    "gerenciar_status_pedidos_db": {"faker", "dotenv"},
+    "limpeza_base": {"faker", "holidays", "requests", "dotenv"},
+    "servico_pipeline": {"dotenv"},
+}
+
+CODIGO_IMPORT = "import {modulo}"
+CODIGO_MODULOS = "import sys, json; import {modulo}; print(json.dumps(sorted(m for m in {pesados!r} if m in sys.modules)))"
+
+# ==============================================================================
+# --- MEDIÇÃO ---
+# ==============================================================================
+def _executar(argumentos):
+    inicio = time.perf_counter()
+    subprocess.run([sys.executable, *argumentos], cwd=DIR_SCRIPTS, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - inicio) * 1000
+
+def medir(argumentos, repeticoes):
+    """Mediana e mínimo, em ms, de `repeticoes` execuções de um processo novo."""
+    tempos = [_executar(argumentos) for _ in range(repeticoes)]
+    return statistics.median(tempos), min(tempos)
+
+def modulos_carregados(modulo):
+    codigo = CODIGO_MODULOS.format(modulo=modulo, pesados=MODULOS_PESADOS)
+    saida = subprocess.run([sys.executable, "-c", codigo], cwd=DIR_SCRIPTS, check=True, capture_output=True, text=True).stdout
+    return json.loads(saida.strip().splitlines()[-1])
+
+def executar_benchmark(repeticoes, limite_ms=None):
+    """Imprime o relatório e retorna True se nenhum limite foi violado."""
+    base_mediana, _ = medir(["-c", "pass"], repeticoes)
+    print(f"INFO: Interpretador vazio: {base_mediana:.1f} ms (mediana de {repeticoes}).")
+    print(f"{'script':<30} {'import med':>10} {'import min':>10} {'--help med':>10}  módulos pesados")
+    ok = True
+    for script in SCRIPTS:
+        import_mediana, import_minimo = medir(["-c", CODIGO_IMPORT.format(modulo=script)], repeticoes)
+        # O serviço não tem argparse: '--help' o iniciaria de fato
+        ajuda = f"{medir([f'{script}.py', '--help'], repeticoes)[0]:.1f}" if script != "servico_pipeline" else "-"
+        carregados = modulos_carregados(script)
+        print(f"{script:<30} {import_mediana:>10.1f} {import_minimo:>10.1f} {ajuda:>10}  {', '.join(carregados) or '-'}")
+
+        proibidos = PROIBIDOS.get(script, set()) & set(carregados)
+        if proibidos:
+            print(f"ERRO: '{script}' carrega {', '.join(sorted(proibidos))} no import.")
+            ok = False
+        if limite_ms is not None and import_mediana - base_mediana > limite_ms:
+            print(f"ERRO: Import de '{script}' levou {import_mediana - base_mediana:.1f} ms além do interpretador (limite {limite_ms:g} ms).")
+            ok = False
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mede o tempo de início a frio dos scripts do pipeline.")
+    parser.add_argument("--repeticoes", type=int, default=10, help="Processos medidos por script (padrão: 10).")
+    parser.add_argument("--limite-ms", type=float, help="Falha (código 1) se o import de algum script passar deste tempo além do interpretador vazio.")
+    args = parser.parse_args()
+
+    print("======================================================================")
+    print("====== BENCHMARK DE INICIALIZAÇÃO DOS SCRIPTS ======")
+    print("======================================================================")
+    sucesso = executar_benchmark(args.repeticoes, args.limite_ms)
+    print("\n==================== EXECUÇÃO CONCLUÍDA ====================")
+    sys.exit(0 if sucesso else 1)
@@ -0,0 +1,167 @@
+# benchmark_pipeline.py
+
+import os
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import io
+import servidor_simulado
+import criar_pedidos_db
+import gerenciar_status_pedidos_db
+from cliente_http import fechar_sessoes
+
+# Benchmark de ponta a ponta contra o servidor_simulado: cria um volume fixo de pedidos
+# num banco temporário e executa as três etapas de status, medindo a vazão de cada etapa
+# (pedidos/s e eventos/s), os percentis de latência por endpoint vistos pelo simulador
+# e o tamanho final do banco. O relatório pode ser salvo em JSON (--saida) para comparar
+# execuções e deixar regressões visíveis. O limitador de taxa dos scripts fica desligado
+# (--limite-taxa-rps 0, padrão) para que a vazão medida seja a do pipeline, não a do limite.
+
+# ==============================================================================
+# --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
+# ==============================================================================
+CARRIERS = ["32", "4", "177", "51", "3363", "23"]
+
+# ==============================================================================
+# --- PREPARAÇÃO DO AMBIENTE ---
+# ==============================================================================
+def preparar_ambiente(urls, db_file, planejamento_inline=False, limite_taxa_rps=0):
+    """Aponta os scripts para o simulador e para o banco temporário, antes do primeiro uso da configuração."""
+    os.environ.update(urls)
+    os.environ["DB_FILE_PATH"] = db_file
+    os.environ["PLANEJAMENTO_INLINE"] = "1" if planejamento_inline else "0"
+    for variavel in ("LIMITE_TAXA_INTELIPOST_RPS", "LIMITE_TAXA_CARRIER_RPS", "LIMITE_TAXA_BRASILAPI_RPS"):
+        os.environ[variavel] = f"{limite_taxa_rps:g}"
+    os.environ.setdefault("INTELIPOST_API_KEY", "chave-benchmark")
+    os.environ.setdefault("DADOS_SINTETICOS_SEMENTE", "42")
+    for carrier_id in CARRIERS:
+        os.environ.setdefault(f"CARRIER_{carrier_id}_API_KEY", f"chave-benchmark-{carrier_id}")
+
+def tamanho_banco(db_file):
+    return sum(os.path.getsize(db_file + sufixo) for sufixo in ("", "-wal", "-shm") if os.path.exists(db_file + sufixo))
+
+# ==============================================================================
+# --- EXECUÇÃO DAS ETAPAS ---
+# ==============================================================================
+def medir_etapa(nome, funcao, servidor, contar_itens, verboso):
+    """Executa `funcao()`, retornando duração, itens processados, eventos e latências do simulador."""
+    servidor.estado.zerar()
+    saida = contextlib.nullcontext() if verboso else contextlib.redirect_stdout(io.StringIO())
+    inicio = time.perf_counter()
+    with saida:
+        funcao()
+    duracao = time.perf_counter() - inicio
+    estatisticas = servidor.estado.estatisticas()
+    itens = contar_itens()
+    return {
+        "etapa": nome,
+        "duracao_s": round(duracao, 3),
+        "itens": itens,
+        "itens_por_s": round(itens / duracao, 1) if duracao > 0 else 0.0,
+        "eventos": estatisticas["eventos"],
+        "eventos_por_s": round(estatisticas["eventos"] / duracao, 1) if duracao > 0 else 0.0,
+        "endpoints": estatisticas["endpoints"],
+    }
+
+def executar_benchmark(numero_de_pedidos, config, max_workers=None, verboso=False, planejamento_inline=False, limite_taxa_rps=0):
+    servidor, urls = servidor_simulado.iniciar_em_thread(config, semente=42)
+    dir_temporario = tempfile.TemporaryDirectory(prefix="benchmark_pipeline_")
+    db_file = os.path.join(dir_temporario.name, "pedidos.db")
+    preparar_ambiente(urls, db_file, planejamento_inline, limite_taxa_rps)
+
+    def contar(where):
+        return conn.execute(f"SELECT COUNT(*) FROM pedidos WHERE {where}").fetchone()[0]
+
+    def estados():
+        return {row[0]: (row[1], row[2]) for row in conn.execute("SELECT order_number, status_processo, latest_volume_state FROM pedidos")}
+
+    criar_pedidos_db.setup_database()
+    # Gerados fora da medição; a semente fixa torna os payloads iguais entre execuções
+    criar_pedidos_db.dados_sinteticos.carregar()
+    conn = criar_pedidos_db.conectar_db()
+    resultados = []
+    try:
+        resultados.append(medir_etapa(
+            "criacao", lambda: criar_pedidos_db.criar_novos_pedidos(conn, numero_de_pedidos=numero_de_pedidos, max_workers=max_workers),
+            servidor, lambda: contar("1"), verboso))
+        resultados.append(medir_etapa(
+            "consulta", lambda: gerenciar_status_pedidos_db.consultar_pedidos_criados(conn, max_workers=max_workers),
+            servidor, lambda: contar("status_processo = 'CONSULTADO'"), verboso))
+        resultados.append(medir_etapa(
+            "atraso", lambda: gerenciar_status_pedidos_db.marcar_pedidos_para_atraso(conn),
+            servidor, lambda: contar("late_delivery_flag = 1"), verboso))
+        # Na ETAPA 3 contam os pedidos cujo estado avançou
+        antes = estados()
+        resultados.append(medir_etapa(
+            "tracking", lambda: gerenciar_status_pedidos_db.enviar_atualizacoes_de_status(conn),
+            servidor, lambda: sum(1 for item in estados().items() if item not in antes.items()), verboso))
+    finally:
+        conn.close()
+        fechar_sessoes()
+        servidor.shutdown()
+        servidor.server_close()
+
+    relatorio = {
+        "pedidos": numero_de_pedidos,
+        "planejamento_inline": planejamento_inline,
+        "limite_taxa_rps": limite_taxa_rps,
+        "simulador": vars(config),
+        "banco_bytes": tamanho_banco(db_file),
+        "etapas": resultados,
+    }
+    dir_temporario.cleanup()
+    return relatorio
+
+# ==============================================================================
+# --- RELATÓRIO ---
+# ==============================================================================
+def imprimir_relatorio(relatorio):
+    print(f"\n{'etapa':<10} {'duração s':>10} {'itens':>7} {'itens/s':>9} {'eventos':>8} {'eventos/s':>10}")
+    for etapa in relatorio["etapas"]:
+        print(f"{etapa['etapa']:<10} {etapa['duracao_s']:>10.2f} {etapa['itens']:>7} {etapa['itens_por_s']:>9.1f} {etapa['eventos']:>8} {etapa['eventos_por_s']:>10.1f}")
+
+    print(f"\n{'etapa':<10} {'endpoint':<20} {'req':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  status")
+    for etapa in relatorio["etapas"]:
+        for endpoint, dados in etapa["endpoints"].items():
+            status = ', '.join(f"{codigo}: {n}" for codigo, n in dados["status"].items())
+            print(f"{etapa['etapa']:<10} {endpoint:<20} {dados['requisicoes']:>6} {dados['p50_ms']:>8.1f} {dados['p95_ms']:>8.1f} {dados['p99_ms']:>8.1f}  {status}")
+
+    print(f"\nINFO: Tamanho final do banco: {relatorio['banco_bytes'] / 1024:.0f} KiB para {relatorio['pedidos']} pedidos solicitados.")
+    limite = relatorio['limite_taxa_rps']
+    print(f"INFO: Limitador de taxa dos scripts: {f'{limite:g} req/s por API key' if limite > 0 else 'desligado'}.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mede a vazão do pipeline de pedidos contra o servidor simulado.")
+    parser.add_argument("--pedidos", type=int, default=200, help="Pedidos criados (padrão: 200).")
+    parser.add_argument("--max-workers", type=int, help="Workers da criação e da consulta (padrão: configuração dos scripts).")
+    parser.add_argument("--latencia-ms", type=float, default=50)
+    parser.add_argument("--distribuicao", choices=servidor_simulado.DISTRIBUICOES, default="lognormal")
+    parser.add_argument("--taxa-erro", type=float, default=0.0)
+    parser.add_argument("--taxa-429", type=float, default=0.0)
+    parser.add_argument("--limite-rps", type=float, default=0.0, help="Limite de requisições/s imposto pelo simulador (padrão: sem limite).")
+    parser.add_argument("--limite-taxa-rps", type=float, default=0.0,
+                        help="LIMITE_TAXA_*_RPS dos scripts (padrão: 0, limitador desligado, para medir a vazão do pipeline).")
+    parser.add_argument("--planejamento-inline", action="store_true",
+                        help="Cria os pedidos já planejados (sem o GET da ETAPA 1). As datas ficam no calendário real, então a ETAPA 3 não tem eventos devidos.")
+    parser.add_argument("--saida", help="Grava o relatório em JSON neste arquivo.")
+    parser.add_argument("--verboso", action="store_true", help="Mostra a saída dos scripts durante as etapas.")
+    args = parser.parse_args()
+
+    # Datas deslocadas 30 dias para trás na consulta: todos os eventos de tracking ficam devidos na ETAPA 3
+    config = servidor_simulado.ConfiguracaoSimulador(
+        latencia_ms=args.latencia_ms, distribuicao=args.distribuicao, taxa_erro=args.taxa_erro,
+        taxa_429=args.taxa_429, limite_rps=args.limite_rps, deslocamento_dias=30)
+
+    print("======================================================================")
+    print("====== BENCHMARK DO PIPELINE CONTRA O SERVIDOR SIMULADO ======")
+    print("======================================================================")
+    relatorio = executar_benchmark(args.pedidos, config, max_workers=args.max_workers, verboso=args.verboso,
+                                   planejamento_inline=args.planejamento_inline, limite_taxa_rps=args.limite_taxa_rps)
+    imprimir_relatorio(relatorio)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+        print(f"INFO: Relatório gravado em '{args.saida}'.")
+    print("\n==================== EXECUÇÃO CONCLUÍDA ====================")
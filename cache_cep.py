@@ -0,0 +1,101 @@
+# cache_cep.py
+
+import json
+import time
+import threading
+import configuracao
+from banco_dados import conectar_db
+
+# Cache persistente das consultas de CEP, guardado no mesmo SQLite dos pedidos.
+#    - Respostas válidas expiram após CEP_CACHE_TTL_DIAS.
+#    - CEPs inexistentes (4xx da BrasilAPI) também são guardados (cache negativo)
+#      e expiram após CEP_CACHE_TTL_NEGATIVO_HORAS.
+#    - Falhas transitórias (timeout, 5xx) não são guardadas.
+
+# ==============================================================================
+# --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
+# ==============================================================================
+cep_cache_ttl_segundos = configuracao.parametro('CEP_CACHE_TTL_DIAS', '30', lambda dias: int(dias) * 24 * 3600)
+cep_cache_ttl_negativo_segundos = configuracao.parametro('CEP_CACHE_TTL_NEGATIVO_HORAS', '6', lambda horas: int(horas) * 3600)
+
+def normalizar_cep(cep):
+    return cep.replace('-', '').strip()
+
+# ==============================================================================
+# --- CACHE DE CEP (MEMÓRIA + SQLite) ---
+# ==============================================================================
+class CacheCep:
+    """
+    Cache de endereços por CEP. A tabela é carregada para memória na primeira
+    consulta; cada nova resposta é gravada no SQLite com uma conexão própria,
+    de modo que o cache pode ser usado a partir de várias threads.
+    """
+
+    def __init__(self, db_file=None, ttl=None, ttl_negativo=None):
+        self.db_file = db_file
+        self._ttl = ttl
+        self._ttl_negativo = ttl_negativo
+        self._memoria = None
+        self._lock = threading.Lock()
+
+    # Sem valor explícito, os TTLs são lidos da configuração no primeiro uso
+    @property
+    def ttl(self):
+        return self._ttl if self._ttl is not None else cep_cache_ttl_segundos()
+
+    @property
+    def ttl_negativo(self):
+        return self._ttl_negativo if self._ttl_negativo is not None else cep_cache_ttl_negativo_segundos()
+
+    def _carregar(self):
+        if self._memoria is not None:
+            return
+        memoria = {}
+        conn = conectar_db(self.db_file or configuracao.db_file())
+        try:
+            for cep, endereco_json, encontrado, expira_em in conn.execute("SELECT cep, endereco_json, encontrado, expira_em FROM cache_cep"):
+                memoria[cep] = (json.loads(endereco_json) if encontrado else None, expira_em)
+        finally:
+            conn.close()
+        self._memoria = memoria
+
+    def _gravar(self, cep, endereco):
+        expira_em = time.time() + (self.ttl if endereco is not None else self.ttl_negativo)
+        conn = conectar_db(self.db_file or configuracao.db_file())
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_cep (cep, endereco_json, encontrado, expira_em) VALUES (?, ?, ?, ?)",
+                (cep, json.dumps(endereco) if endereco is not None else None, 1 if endereco is not None else 0, expira_em)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self._memoria[cep] = (endereco, expira_em)
+
+    def consultar(self, cep):
+        """Retorna (encontrado_no_cache, endereco). O endereço é None para CEPs em cache negativo."""
+        chave = normalizar_cep(cep)
+        with self._lock:
+            self._carregar()
+            item = self._memoria.get(chave)
+        if item is None or item[1] < time.time():
+            return False, None
+        endereco = item[0]
+        return True, (dict(endereco) if endereco is not None else None)
+
+    def obter(self, cep, buscar):
+        """
+        Retorna o endereço do CEP a partir do cache ou, se ausente/expirado, de
+        `buscar(cep)`. `buscar` deve retornar o endereço, None para um CEP
+        inexistente, ou lançar exceção em falhas transitórias (não cacheadas).
+        """
+        em_cache, endereco = self.consultar(cep)
+        if em_cache:
+            return endereco
+        try:
+            endereco = buscar(cep)
+        except Exception:
+            return None
+        self._gravar(normalizar_cep(cep), endereco)
+        return dict(endereco) if endereco is not None else None
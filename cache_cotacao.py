@@ -0,0 +1,96 @@
+# cache_cotacao.py
+
+import json
+import time
+import threading
+import bisect
+import configuracao
+from banco_dados import conectar_db
+
+# Cache das cotações de frete, guardado no mesmo SQLite dos pedidos.
+# A chave é (CEP de origem, CEP de destino, faixa de peso, faixa de tamanho): como
+# as dimensões dos pacotes são aleatórias, pacotes da mesma faixa reaproveitam a
+# cotação mais barata já obtida para a rota dentro da janela de validade.
+
+# ==============================================================================
+# --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
+# ==============================================================================
+# Janela de reaproveitamento de uma cotação. 0 desativa o cache.
+cotacao_cache_janela_segundos = configuracao.parametro('COTACAO_CACHE_JANELA_MINUTOS', '60', lambda minutos: int(minutos) * 60)
+
+# Limites superiores das faixas de peso (kg) e da maior dimensão do pacote (cm)
+FAIXAS_PESO_KG = [0.3, 1, 2, 5, 10, 20, 30, 50]
+FAIXAS_TAMANHO_CM = [20, 40, 60, 80, 100]
+
+def chave_cotacao(origin_zip_code, cep_destino, peso, largura, altura, comprimento):
+    faixa_peso = bisect.bisect_left(FAIXAS_PESO_KG, peso)
+    faixa_tamanho = bisect.bisect_left(FAIXAS_TAMANHO_CM, max(largura, altura, comprimento))
+    return f"{origin_zip_code}|{cep_destino.replace('-', '')}|{faixa_peso}|{faixa_tamanho}"
+
+# ==============================================================================
+# --- CACHE DE COTAÇÕES (MEMÓRIA + SQLite) ---
+# ==============================================================================
+class CacheCotacao:
+    """
+    Cache das cotações por rota e faixa de pacote. Guarda o id da cotação, o
+    delivery_method_id mais barato, o prazo em dias úteis e o custo do frete.
+    """
+
+    def __init__(self, db_file=None, janela=None):
+        self.db_file = db_file
+        self._janela = janela
+        self._memoria = None
+        self._lock = threading.Lock()
+
+    # Sem valor explícito, a janela é lida da configuração no primeiro uso
+    @property
+    def janela(self):
+        return self._janela if self._janela is not None else cotacao_cache_janela_segundos()
+
+    def _carregar(self):
+        if self._memoria is not None:
+            return
+        memoria = {}
+        conn = conectar_db(self.db_file or configuracao.db_file())
+        try:
+            for chave, cotacao_json, expira_em in conn.execute("SELECT chave, cotacao_json, expira_em FROM cache_cotacao WHERE expira_em >= ?", (time.time(),)):
+                memoria[chave] = (json.loads(cotacao_json), expira_em)
+        finally:
+            conn.close()
+        self._memoria = memoria
+
+    def consultar(self, chave):
+        """Retorna uma cópia da cotação em cache para a chave, ou None se ausente/expirada."""
+        if self.janela <= 0:
+            return None
+        with self._lock:
+            self._carregar()
+            item = self._memoria.get(chave)
+        if item is None or item[1] < time.time():
+            return None
+        return dict(item[0])
+
+    def gravar(self, chave, cotacao):
+        if self.janela <= 0:
+            return
+        expira_em = time.time() + self.janela
+        conn = conectar_db(self.db_file or configuracao.db_file())
+        try:
+            conn.execute("INSERT OR REPLACE INTO cache_cotacao (chave, cotacao_json, expira_em) VALUES (?, ?, ?)", (chave, json.dumps(cotacao), expira_em))
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self._carregar()
+            self._memoria[chave] = (dict(cotacao), expira_em)
+
+    def invalidar(self, chave):
+        conn = conectar_db(self.db_file or configuracao.db_file())
+        try:
+            conn.execute("DELETE FROM cache_cotacao WHERE chave = ?", (chave,))
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            if self._memoria is not None:
+                self._memoria.pop(chave, None)
@@ -0,0 +1,97 @@
+# calendario_uteis.py
+
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from configuracao import parametro
+
+# Calendário de dias úteis (segunda a sexta, exceto feriados nacionais) pré-calculado
+# para um intervalo de anos. Para cada dia do intervalo guarda quantos dias úteis
+# existem até ele (índice acumulado), o que torna as consultas O(1):
+#    - data + N dias úteis
+#    - quantidade de dias úteis entre duas datas
+# Datas fora do intervalo caem no cálculo dia a dia.
+
+# ==============================================================================
+# --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
+# ==============================================================================
+calendario_anos_antes = parametro('CALENDARIO_ANOS_ANTES', '2', int)
+calendario_anos_depois = parametro('CALENDARIO_ANOS_DEPOIS', '5', int)
+
+# ==============================================================================
+# --- CALENDÁRIO ---
+# ==============================================================================
+class CalendarioDiasUteis:
+    def __init__(self, ano_inicial, ano_final, feriados=None):
+        if feriados is None:
+            import holidays  # importado sob demanda: só quem usa o calendário paga a carga
+            feriados = holidays.BR(years=range(ano_inicial, ano_final + 1))
+        self.feriados = feriados
+        self._ordinal_inicial = date(ano_inicial, 1, 1).toordinal()
+        self._ordinal_final = date(ano_final, 12, 31).toordinal()
+
+        # _acumulado[i]: dias úteis entre o início do intervalo e o dia i (inclusive)
+        # _dias_uteis[k]: ordinal do (k+1)-ésimo dia útil do intervalo
+        self._acumulado = []
+        self._dias_uteis = []
+        for ordinal in range(self._ordinal_inicial, self._ordinal_final + 1):
+            if self._eh_dia_util(date.fromordinal(ordinal)):
+                self._dias_uteis.append(ordinal)
+            self._acumulado.append(len(self._dias_uteis))
+
+    def _eh_dia_util(self, dia):
+        return dia.weekday() < 5 and dia not in self.feriados
+
+    def eh_dia_util(self, dia):
+        if isinstance(dia, datetime):
+            dia = dia.date()
+        ordinal = dia.toordinal()
+        if self._ordinal_inicial <= ordinal <= self._ordinal_final:
+            i = ordinal - self._ordinal_inicial
+            return self._acumulado[i] != (self._acumulado[i - 1] if i else 0)
+        return self._eh_dia_util(dia)
+
+    def adicionar_dias_uteis(self, data_inicial, dias_uteis):
+        """
+        Retorna a data `dias_uteis` dias úteis depois de `data_inicial` (que não é
+        contada). Aceita date ou datetime; para datetime o horário é preservado.
+        """
+        dia = data_inicial.date() if isinstance(data_inicial, datetime) else data_inicial
+        ordinal = dia.toordinal()
+        indice = None
+        if self._ordinal_inicial <= ordinal <= self._ordinal_final:
+            indice = self._acumulado[ordinal - self._ordinal_inicial] + dias_uteis - 1
+        if indice is not None and 0 <= indice < len(self._dias_uteis) and dias_uteis > 0:
+            dia_final = date.fromordinal(self._dias_uteis[indice])
+        else:
+            dia_final = dia
+            dias_adicionados = 0
+            while dias_adicionados < dias_uteis:
+                dia_final += timedelta(days=1)
+                if self._eh_dia_util(dia_final):
+                    dias_adicionados += 1
+        return data_inicial + timedelta(days=(dia_final - dia).days)
+
+    def dias_uteis_entre(self, data_inicial, data_final):
+        """Quantidade de dias úteis no intervalo (data_inicial, data_final]; negativa se data_final < data_inicial."""
+        inicio = data_inicial.date() if isinstance(data_inicial, datetime) else data_inicial
+        fim = data_final.date() if isinstance(data_final, datetime) else data_final
+        if fim < inicio:
+            return -self.dias_uteis_entre(fim, inicio)
+        if self._ordinal_inicial <= inicio.toordinal() and fim.toordinal() <= self._ordinal_final:
+            return self._acumulado[fim.toordinal() - self._ordinal_inicial] - self._acumulado[inicio.toordinal() - self._ordinal_inicial]
+        return sum(1 for n in range(1, (fim - inicio).days + 1) if self._eh_dia_util(inicio + timedelta(days=n)))
+
+    def adicionar_dias_uteis_lote(self, datas, dias_uteis):
+        """Versão em lote de adicionar_dias_uteis; `dias_uteis` pode ser um inteiro ou uma sequência."""
+        if isinstance(dias_uteis, int):
+            return [self.adicionar_dias_uteis(d, dias_uteis) for d in datas]
+        return [self.adicionar_dias_uteis(d, n) for d, n in zip(datas, dias_uteis)]
+
+    def dias_uteis_entre_lote(self, datas_iniciais, datas_finais):
+        return [self.dias_uteis_entre(a, b) for a, b in zip(datas_iniciais, datas_finais)]
+
+@lru_cache(maxsize=None)
+def calendario_padrao():
+    """Calendário compartilhado, construído na primeira chamada, em torno do ano corrente."""
+    ano_atual = date.today().year
+    return CalendarioDiasUteis(ano_atual - calendario_anos_antes(), ano_atual + calendario_anos_depois())
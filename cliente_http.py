@@ -0,0 +1,136 @@
+# cliente_http.py
+
+import threading
+from functools import lru_cache
+import metricas
+from configuracao import parametro
+from limitador_taxa import limitador_padrao
+
+# Sessões HTTP compartilhadas pelos scripts. Cada sessão mantém um pool de conexões
+# keep-alive por host (evitando um novo handshake TCP/TLS a cada chamada) e repete
+# automaticamente respostas 429/5xx com backoff exponencial e jitter, respeitando o
+# cabeçalho Retry-After. Depois da última tentativa a resposta é devolvida como veio,
+# para que o chamador decida com raise_for_status(). Cada repetição automática passa de
+# novo pelo limitador de taxa da chamada original (ver RetryComLimite).
+
+# ==============================================================================
+# --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
+# ==============================================================================
+http_pool_hosts = parametro('HTTP_POOL_HOSTS', '4', int)
+http_pool_tamanho = parametro('HTTP_POOL_TAMANHO', '32', int)
+http_tentativas = parametro('HTTP_TENTATIVAS', '3', int)
+http_backoff_segundos = parametro('HTTP_BACKOFF_SEGUNDOS', '0.5', float)
+http_backoff_jitter_segundos = parametro('HTTP_BACKOFF_JITTER_SEGUNDOS', '0.5', float)
+
+STATUS_PARA_REPETIR = frozenset({429, 500, 502, 503, 504})
+# Para chamadas que não podem ser repetidas com segurança após um 5xx (ex.: criação
+# de pedido, que pode ter sido aceita antes do erro), só o 429 é repetido.
+STATUS_PARA_REPETIR_NAO_IDEMPOTENTE = frozenset({429})
+
+_sessoes = {}
+_lock_sessoes = threading.Lock()
+# (limite, endpoint) da requisição em andamento nesta thread, para o Retry das sessões
+_requisicao_atual = threading.local()
+
+# ==============================================================================
+# --- SESSÕES ---
+# ==============================================================================
+def _aguardar_limite(limite, endpoint):
+    espera = limitador_padrao().aguardar(*limite)
+    if espera:
+        metricas.LIMITE_ESPERA.observar(espera, endpoint=endpoint)
+
+def _segundos_retry_after(response):
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    return float(retry_after) if retry_after and retry_after.isdigit() else None
+
+@lru_cache(maxsize=None)
+def _classe_retry():
+    """
+    Retry do urllib3 que, antes de cada repetição, avisa o limitador de um 429 recebido
+    e reserva um novo token do balde da requisição em andamento nesta thread.
+    """
+    from urllib3.util.retry import Retry
+
+    class RetryComLimite(Retry):
+        def sleep(self, response=None):
+            atual = getattr(_requisicao_atual, 'valor', None)
+            if atual and response is not None and response.status == 429:
+                limitador_padrao().registrar_429(*atual[0], retry_after=_segundos_retry_after(response))
+            super().sleep(response)
+            if atual:
+                _aguardar_limite(*atual)
+
+    return RetryComLimite
+
+def criar_sessao(headers=None, status_para_repetir=STATUS_PARA_REPETIR):
+    # requests/urllib3 são importados só quando a primeira sessão é criada (início mais rápido)
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    retry = _classe_retry()(
+        total=http_tentativas(),
+        connect=http_tentativas(),
+        read=0,
+        status=http_tentativas(),
+        status_forcelist=status_para_repetir,
+        allowed_methods=frozenset({'GET', 'POST'}),
+        backoff_factor=http_backoff_segundos(),
+        backoff_jitter=http_backoff_jitter_segundos(),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=http_pool_hosts(), pool_maxsize=http_pool_tamanho(), max_retries=retry)
+    sessao = requests.Session()
+    sessao.mount('https://', adapter)
+    sessao.mount('http://', adapter)
+    if headers:
+        sessao.headers.update(headers)
+    return sessao
+
+def obter_sessao(nome, headers=None, status_para_repetir=STATUS_PARA_REPETIR):
+    """Retorna a sessão compartilhada `nome`, criando-a na primeira chamada."""
+    with _lock_sessoes:
+        sessao = _sessoes.get(nome)
+        if sessao is None:
+            sessao = _sessoes[nome] = criar_sessao(headers, status_para_repetir)
+        return sessao
+
+def fechar_sessoes():
+    with _lock_sessoes:
+        for sessao in _sessoes.values():
+            sessao.close()
+        _sessoes.clear()
+
+def requisitar(sessao, metodo, url, endpoint, limite=None, confirmar=None, **kwargs):
+    """
+    sessao.request() medindo a duração (com repetições) e o status final por `endpoint`
+    em metricas. `limite` = (chave, requisições por segundo) passa cada tentativa
+    (inclusive as repetições automáticas) pelo limitador de taxa compartilhado, que
+    também é avisado de cada 429 recebido. `confirmar` é chamada depois da espera do
+    limitador, logo antes do envio: se retornar False, nada é enviado e o retorno é None.
+    """
+    if limite:
+        _aguardar_limite(limite, endpoint)
+    if confirmar is not None and not confirmar():
+        return None
+    with metricas.HTTP_DURACAO.cronometrar(endpoint=endpoint):
+        _requisicao_atual.valor = (limite, endpoint) if limite else None
+        try:
+            response = sessao.request(metodo, url, **kwargs)
+        except Exception:
+            metricas.HTTP_RESPOSTAS.incrementar(endpoint=endpoint, status="erro")
+            raise
+        finally:
+            _requisicao_atual.valor = None
+    metricas.HTTP_RESPOSTAS.incrementar(endpoint=endpoint, status=response.status_code)
+    if limite:
+        # Os 429 repetidos pelo Retry do urllib3 ficam no histórico da resposta final; o
+        # limitador já foi avisado deles em RetryComLimite.sleep, falta só o da resposta final
+        historico = getattr(getattr(response.raw, 'retries', None), 'history', None) or ()
+        recebidos_429 = sum(1 for tentativa in historico if tentativa.status == 429) + (response.status_code == 429)
+        if recebidos_429:
+            metricas.LIMITE_429.incrementar(recebidos_429, endpoint=endpoint)
+        if response.status_code == 429:
+            limitador_padrao().registrar_429(*limite, retry_after=_segundos_retry_after(response))
+    return response
@@ -0,0 +1,55 @@
+# configuracao.py
+
+import os
+from functools import lru_cache
+
+# Configuração carregada sob demanda. O arquivo .env é lido na primeira consulta a
+# qualquer variável, e as variáveis obrigatórias só são validadas quando alguém as usa:
+# importar um script, rodar '--help' ou executar só uma etapa não exige as demais.
+# Os módulos não leem variáveis no import: cada parâmetro é declarado com parametro()
+# e lido na primeira chamada.
+
+# ==============================================================================
+# --- CARREGAMENTO DO AMBIENTE ---
+# ==============================================================================
+@lru_cache(maxsize=None)
+def carregar_ambiente():
+    """Carrega as variáveis de ambiente do arquivo .env (uma única vez por processo)."""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+def obter(nome, padrao=None):
+    carregar_ambiente()
+    return os.getenv(nome, padrao)
+
+def parametro(nome, padrao=None, tipo=str):
+    """
+    Declara o parâmetro `nome`: retorna uma função sem argumentos que, na primeira
+    chamada, lê a variável e a converte com `tipo` (None se ausente e sem padrão).
+    """
+    @lru_cache(maxsize=None)
+    def valor():
+        bruto = obter(nome, padrao)
+        return tipo(bruto) if bruto is not None else None
+    return valor
+
+def obrigatoria(nome):
+    valor = obter(nome)
+    if not valor:
+        raise ValueError(f"Erro: A variável de ambiente {nome} deve ser definida.")
+    return valor
+
+# ==============================================================================
+# --- VARIÁVEIS COMPARTILHADAS ---
+# ==============================================================================
+@lru_cache(maxsize=None)
+def db_file():
+    return obrigatoria('DB_FILE_PATH')
+
+@lru_cache(maxsize=None)
+def api_key():
+    return obrigatoria('INTELIPOST_API_KEY')
+
+@lru_cache(maxsize=None)
+def headers_intelipost():
+    return {'Content-Type': 'application/json', 'api-key': api_key(), 'platform': 'automacao'}
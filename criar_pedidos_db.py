@@ -1,34 +1,62 @@
 # criar_pedidos_db.py
 
-import sqlite3
-import requests
 import json
 import random
 import time
-import os
-from datetime import datetime, timedelta
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from datetime import datetime
 from zoneinfo import ZoneInfo
-from faker import Faker
-import holidays
-from dotenv import load_dotenv
+import banco_dados
+import configuracao
+import metricas
+import relogio
+from cache_cep import CacheCep
+from cache_cotacao import CacheCotacao, chave_cotacao
+from gerador_ids import GeradorOrderNumber
+from dados_sinteticos import PoolDadosSinteticos
+from calendario_uteis import calendario_padrao
+from planejamento_entregas import planejar_pedido
+from cliente_http import obter_sessao, fechar_sessoes, requisitar, STATUS_PARA_REPETIR_NAO_IDEMPOTENTE
+from limitador_taxa import limite_intelipost, limite_brasilapi
 
 # ==============================================================================
 # --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
 # ==============================================================================
-# Carrega as variáveis de ambiente do arquivo .env
-load_dotenv() 
+# DB_FILE_PATH e INTELIPOST_API_KEY são lidas (e validadas) no primeiro uso, via configuracao
+# URLs base das APIs (sobrescritas para apontar para o servidor_simulado em testes de carga)
+intelipost_api_url = configuracao.parametro('INTELIPOST_API_URL', 'https://api.intelipost.com.br/api/v1', lambda url: url.rstrip('/'))
+brasilapi_url = configuracao.parametro('BRASILAPI_URL', 'https://brasilapi.com.br/api', lambda url: url.rstrip('/'))
 
-# Busca o caminho do DB e a API Key das variáveis de ambiente
-DB_FILE = os.getenv('DB_FILE_PATH')
-API_KEY = os.getenv('INTELIPOST_API_KEY')
+def quote_api_url():
+    return f'{intelipost_api_url()}/quote_by_product'
 
-# Verificação para garantir que as variáveis foram carregadas
-if not DB_FILE or not API_KEY:
-    raise ValueError("Erro: As variáveis de ambiente DB_FILE_PATH e INTELIPOST_API_KEY devem ser definidas.")
+def order_api_url():
+    return f'{intelipost_api_url()}/shipment_order'
 
-QUOTE_API_URL = 'https://api.intelipost.com.br/api/v1/quote_by_product'
-ORDER_API_URL = 'https://api.intelipost.com.br/api/v1/shipment_order'
-CEP_LOOKUP_API_URL = 'https://brasilapi.com.br/api/cep/v1/'
+def cep_lookup_api_url():
+    return f'{brasilapi_url()}/cep/v1/'
+
+# Quantidade máxima de pedidos com chamadas de rede em andamento ao mesmo tempo
+criacao_max_workers = configuracao.parametro('CRIACAO_MAX_WORKERS', '8', int)
+# Intenções pendentes carregadas por vez na reconciliação
+reconciliacao_tamanho_lote = configuracao.parametro('RECONCILIACAO_TAMANHO_LOTE', '200', int)
+# Reserva de cada intenção pelo processo que a envia ou reconcilia, renovada logo antes de
+# cada POST. Deve superar com folga o POST com todas as repetições (timeout de 30s por
+# tentativa, backoff e esperas do limitador): só depois dela outro processo a reconcilia.
+intencao_reserva_segundos = configuracao.parametro('INTENCAO_RESERVA_SEGUNDOS', '600', float)
+
+# Planejamento inline: o pedido criado já é gravado como CONSULTADO, com as datas do
+# próprio payload (created, estimated_delivery_date, delivery_method_id) e o estado do
+# volume informado na resposta da criação, dispensando o GET da ETAPA 1. Sem um estado
+# planejável na resposta, o pedido fica CRIADO e segue pelo GET. Uma amostra (em %)
+# segue pelo GET para conferir o planejamento. PLANEJAMENTO_INLINE=0 volta a gravar
+# todos como CRIADO.
+planejamento_inline = configuracao.parametro('PLANEJAMENTO_INLINE', '1', lambda valor: valor == '1')
+planejamento_amostra_verificacao_percentual = configuracao.parametro('PLANEJAMENTO_AMOSTRA_VERIFICACAO_PERCENTUAL', '1', float)
+# Estados do volume a partir dos quais há cronograma (ver planejamento_entregas)
+ESTADOS_PLANEJAVEIS = frozenset({"SHIPPED", "IN_TRANSIT", "TO_BE_DELIVERED"})
 
 # Mapeamento de Centros de Distribuição (CDs)
 WAREHOUSES = {
@@ -176,172 +204,451 @@ CEPS_VALIDOS_BRASIL = [
     "77500-000", "77600-000", "77650-000", "77700-000", "77760-000",
     "77803-120", "77813-010", "77823-010", "77900-000",
 ]
-fake = Faker('pt_BR')
-feriados_br = holidays.BR()
 tz_brasilia = ZoneInfo("America/Sao_Paulo")
+cache_cep = CacheCep()
+cache_cotacao = CacheCotacao()
+gerador_order_number = GeradorOrderNumber()
+dados_sinteticos = PoolDadosSinteticos()
 
 # ==============================================================================
 # --- MÓDULO DE GERENCIAMENTO DO BANCO DE DADOS (SQLite) ---
 # ==============================================================================
 def conectar_db():
-    db_dir = os.path.dirname(DB_FILE)
-    if db_dir:
-        os.makedirs(db_dir, exist_ok=True)
-    conn = sqlite3.connect(DB_FILE)
-    return conn
+    return banco_dados.conectar_db(configuracao.db_file())
 
 def setup_database():
-    """Cria a tabela de pedidos se ela não existir."""
+    """Cria ou atualiza o schema do banco (ver banco_dados.MIGRACOES)."""
+    banco_dados.setup_database(configuracao.db_file())
+
+# ==============================================================================
+# --- FUNÇÕES AUXILIARES DE CRIAÇÃO (EXECUTADAS PELOS WORKERS) ---
+# ==============================================================================
+def _buscar_endereco_brasilapi(cep):
+    """Consulta a BrasilAPI. Retorna None se o CEP não existe e lança exceção em falhas transitórias."""
+    response = requisitar(obter_sessao('brasilapi'), 'GET', f"{cep_lookup_api_url()}{cep}", 'cep', limite=limite_brasilapi(), timeout=10)
+    if 400 <= response.status_code < 500 and response.status_code != 429:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+def buscar_endereco_por_cep(cep):
+    return cache_cep.obter(cep, _buscar_endereco_brasilapi)
+
+def aquecer_cache_cep(max_workers=None):
+    """Pré-carrega no cache todos os CEPs de CEPS_VALIDOS_BRASIL que estejam ausentes ou expirados."""
+    pendentes = [cep for cep in CEPS_VALIDOS_BRASIL if not cache_cep.consultar(cep)[0]]
+    print(f"\n--- Aquecendo cache de CEP: {len(pendentes)} de {len(CEPS_VALIDOS_BRASIL)} CEPs a consultar ---")
+    encontrados = 0
+    with ThreadPoolExecutor(max_workers=max_workers or criacao_max_workers()) as executor:
+        for endereco in executor.map(buscar_endereco_por_cep, pendentes):
+            if endereco:
+                encontrados += 1
+    print(f"--- Aquecimento concluído: {encontrados} CEPs válidos, {len(pendentes) - encontrados} sem dados. ---")
+
+def realizar_cotacao(origin_zip_code, cep_destino, peso, largura, altura, comprimento, permitir_cache=True):
+    """
+    Retorna a opção de entrega mais barata para a rota. Se `permitir_cache`, uma
+    cotação recente da mesma rota e faixa de pacote é reaproveitada sem chamar
+    a API; o campo "origem_cotacao" indica de onde veio o resultado.
+    """
+    custo_do_produto = round(random.uniform(100.0, 5000.0), 2)
+    chave = chave_cotacao(origin_zip_code, cep_destino, peso, largura, altura, comprimento)
+    if permitir_cache and (cotacao := cache_cotacao.consultar(chave)):
+        cotacao.update({"custo_produto": custo_do_produto, "origem_cotacao": "cache"})
+        return cotacao
+
+    payload = {
+        "destination_zip_code": cep_destino.replace('-', ''),
+        "origin_zip_code": origin_zip_code,
+        "products": [{"weight": peso, "cost_of_goods": custo_do_produto, "width": largura, "height": altura, "length": comprimento, "quantity": 1}]
+    }
+    try:
+        response = requisitar(obter_sessao('intelipost', configuracao.headers_intelipost()), 'POST', quote_api_url(), 'quote_by_product', limite=limite_intelipost(), data=json.dumps(payload), timeout=30)
+        response.raise_for_status()
+        resultado = response.json().get("content", {})
+        opcoes_entrega = resultado.get("delivery_options")
+        if not opcoes_entrega: return None
+        opcao = min(opcoes_entrega, key=lambda opt: opt.get("provider_shipping_cost", float('inf')))
+        cotacao = {"cotacao_id": resultado.get("id"), "delivery_method_id": opcao.get("delivery_method_id"), "prazo_dias_uteis": opcao.get("delivery_estimate_business_days"), "custo_frete": opcao.get("provider_shipping_cost")}
+        if all(cotacao.values()):
+            cache_cotacao.gravar(chave, cotacao)
+        cotacao.update({"custo_produto": custo_do_produto, "origem_cotacao": "api"})
+        return cotacao
+    except Exception as e:
+        print(f"ERRO na cotação: {e}")
+        return None
+
+def preparar_pedido(indice, numero_de_pedidos):
+    """
+    Executa as chamadas de rede que antecedem a criação de um único pedido (CEP e
+    cotação) e monta a intenção de criação. Não acessa o banco de dados: retorna a
+    intenção para a thread principal gravar, ou None se o pedido foi pulado.
+    """
+    metricas.log_detalhe(f"\nProcessando criação {indice + 1}/{numero_de_pedidos}...")
+
+    warehouse_code = random.choice(list(WAREHOUSES.keys()))
+    origin_zip_code = WAREHOUSES[warehouse_code]
+    metricas.log_detalhe(f"INFO: Usando CD de origem: Código '{warehouse_code}', CEP '{origin_zip_code}'")
+
+    cep_destino = random.choice(CEPS_VALIDOS_BRASIL)
+    dados_endereco = buscar_endereco_por_cep(cep_destino)
+
+    if not dados_endereco:
+        metricas.log_detalhe(f"Não foi possível obter dados para o CEP de destino {cep_destino}. Pulando.")
+        metricas.ETAPA_PEDIDOS.incrementar(etapa="criacao", resultado="pulado")
+        return None
+
+    ficticio = dados_sinteticos.sortear_cliente()
+    if not dados_endereco.get('street'):
+        dados_endereco['street'] = ficticio["rua"]
+        metricas.log_detalhe(f"INFO: Rua não encontrada para CEP geral. Usando valor fictício: '{ficticio['rua']}'")
+
+    if not dados_endereco.get('neighborhood'):
+        dados_endereco['neighborhood'] = ficticio["bairro"]
+        metricas.log_detalhe(f"INFO: Bairro não encontrado para CEP geral. Usando valor fictício: '{ficticio['bairro']}'")
+
+    p = {"peso": round(random.uniform(0.1, 50.0), 2), "largura": random.randint(1, 100), "altura": random.randint(1, 100), "comprimento": random.randint(1, 100)}
+
+    cotacao = realizar_cotacao(origin_zip_code, cep_destino, **p)
+
+    if not cotacao or not all(cotacao.values()):
+        metricas.log_detalhe(f"Não foi possível obter cotação para o CEP {cep_destino}. Pulando.")
+        metricas.ETAPA_PEDIDOS.incrementar(etapa="criacao", resultado="pulado")
+        return None
+
+    data_criacao = relogio.agora()
+    order_number = gerador_order_number.gerar()
+    cliente = ficticio["cliente"]
+
+    # Tudo o que é preciso para (re)enviar o pedido sem refazer CEP e cotação
+    return {
+        "order_number": order_number,
+        "payload": montar_payload_pedido(order_number, warehouse_code, data_criacao, cliente, dados_endereco, p, cotacao),
+        "origem_cotacao": cotacao["origem_cotacao"],
+        "contexto": {"warehouse_code": warehouse_code, "origin_zip_code": origin_zip_code, "cep_destino": cep_destino,
+                     "data_criacao": data_criacao.isoformat(), "cliente": cliente, "dados_endereco": dados_endereco, "p": p},
+    }
+
+def _estado_volume_da_resposta(response):
+    """Estado do volume informado na resposta da criação, ou None se ausente ou ilegível."""
+    try:
+        volume_array = response.json().get("content", {}).get("shipment_order_volume_array") or []
+    except (ValueError, AttributeError):
+        return None
+    return volume_array[0].get("shipment_order_volume_state") if volume_array and isinstance(volume_array[0], dict) else None
+
+def _renovar_intencao(order_number):
+    """Executado pelos workers antes de cada POST: estende a reserva da intenção; False se ela passou a outro processo."""
     conn = conectar_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS pedidos (
-            order_number TEXT PRIMARY KEY,
-            status_processo TEXT NOT NULL,
-            latest_volume_state TEXT,
-            created_iso TEXT,
-            estimated_delivery_date_iso TEXT,
-            delivery_method_id TEXT,
-            full_response_json TEXT,
-            late_delivery_flag INTEGER NOT NULL DEFAULT 0,
-            data_criacao_db TEXT,
-            data_atualizacao_db TEXT,
-            update_date_in_transit TEXT,
-            update_date_to_be_delivered TEXT,
-            update_date_delivered TEXT
+    try:
+        return banco_dados.renovar_reservas(conn, [order_number], duracao=intencao_reserva_segundos(), tabela="pedidos_intencao") == 1
+    finally:
+        conn.close()
+
+def enviar_intencao(intencao):
+    """
+    Executado pelos workers: envia o pedido da intenção. Retorna ('criado', criado), em que
+    `criado` traz o payload aceito, o estado do volume informado pela API e a resposta
+    comprimida, ou ('recusado', motivo) para uma recusa definitiva (4xx); lança exceção
+    quando o resultado é incerto (timeout, 5xx), e a intenção fica pendente para reconciliação.
+    Cada POST só sai com a reserva da intenção renovada; se ela passou a outro processo,
+    nada é enviado e o retorno é ('reserva_perdida', None).
+    """
+    order_number = intencao["order_number"]
+    payload = intencao["payload"]
+    response = enviar_pedido(payload)
+    if response is None:
+        return 'reserva_perdida', None
+    if intencao["origem_cotacao"] == "cache" and 400 <= response.status_code < 500 and response.status_code != 429:
+        # A API pode recusar um quote_id reaproveitado: refaz a cotação ao vivo e tenta uma vez mais.
+        metricas.log_detalhe(f"INFO: Cotação em cache recusada para o pedido '{order_number}' (HTTP {response.status_code}). Refazendo cotação.")
+        ctx = intencao["contexto"]
+        cache_cotacao.invalidar(chave_cotacao(ctx["origin_zip_code"], ctx["cep_destino"], **ctx["p"]))
+        cotacao = realizar_cotacao(ctx["origin_zip_code"], ctx["cep_destino"], **ctx["p"], permitir_cache=False)
+        if not cotacao or not all(cotacao.values()):
+            return 'recusado', f"cotação ao vivo indisponível para o CEP {ctx['cep_destino']}"
+        payload = montar_payload_pedido(order_number, ctx["warehouse_code"], datetime.fromisoformat(ctx["data_criacao"]), ctx["cliente"], ctx["dados_endereco"], ctx["p"], cotacao)
+        response = enviar_pedido(payload)
+        if response is None:
+            return 'reserva_perdida', None
+    if 400 <= response.status_code < 500 and response.status_code != 429:
+        return 'recusado', f"HTTP {response.status_code}: {response.text[:200]}"
+    response.raise_for_status()
+    return 'criado', {"payload": payload, "estado_volume": _estado_volume_da_resposta(response),
+                      "resposta": banco_dados.comprimir_resposta(response.content)}
+
+def _consultar_existencia(order_number):
+    """True se o pedido existe na API, False se ela responde 404; exceção se incerto (inclusive outros 4xx)."""
+    response = requisitar(obter_sessao('intelipost', configuracao.headers_intelipost()), 'GET', f"{order_api_url()}/{order_number}", 'shipment_order_get', limite=limite_intelipost(), timeout=30)
+    if response.status_code == 404:
+        return False
+    response.raise_for_status()
+    return True
+
+def reconciliar_intencao(intencao):
+    """
+    Executado pelos workers: resolve uma intenção que ficou pendente numa execução
+    anterior. O pedido só é reenviado se o GET por order_number mostrar que ele não
+    existe, de modo que um POST aceito antes de uma falha nunca é repetido.
+    """
+    if _consultar_existencia(intencao["order_number"]):
+        return 'existente', None
+    return enviar_intencao(intencao)
+
+def montar_payload_pedido(order_number, warehouse_code, data_criacao, cliente, dados_endereco, p, cotacao):
+    data_estimada_obj = calendario_padrao().adicionar_dias_uteis(data_criacao, cotacao["prazo_dias_uteis"])
+    data_estimada_ajustada = data_estimada_obj.replace(hour=23, minute=59, second=59)
+    nota = dados_sinteticos.sortear_nota_fiscal()
+
+    return {
+        "quote_id": cotacao["cotacao_id"],
+        "delivery_method_id": cotacao["delivery_method_id"],
+        "order_number": order_number,
+        "origin_warehouse_code": warehouse_code,
+        "sales_channel": "Marketplace",
+        "created": data_criacao.isoformat(timespec='seconds'),
+        "shipped_date": data_criacao.isoformat(timespec='seconds'),
+        "end_customer": {**cliente, "is_company": False, "shipping_country": "Brasil", "shipping_state": dados_endereco.get("state"), "shipping_city": dados_endereco.get("city"), "shipping_address": dados_endereco.get("street"), "shipping_number": nota["shipping_number"], "shipping_quarter": dados_endereco.get("neighborhood"), "shipping_zip_code": dados_endereco.get("cep").replace('-', '')},
+        "shipment_order_volume_array": [{"shipment_order_volume_number": 1, "volume_type_code": "BOX", "weight": p["peso"], "width": p["largura"], "height": p["altura"], "length": p["comprimento"], "products_quantity": 1, "products_nature": "products", "shipment_order_volume_invoice": {"invoice_series": "1", "invoice_number": nota["invoice_number"], "invoice_key": nota["invoice_key"], "invoice_date": data_criacao.isoformat(timespec='seconds'), "invoice_total_value": str(round(cotacao["custo_produto"] + cotacao["custo_frete"], 2)), "invoice_products_value": str(cotacao["custo_produto"]), "invoice_cfop": "6102"}}],
+        "estimated_delivery_date": data_estimada_ajustada.isoformat(timespec='seconds')
+    }
+
+def enviar_pedido(payload_pedido):
+    """POST do pedido, depois de renovar a reserva da intenção; None se ela passou a outro processo."""
+    # Sessão própria: a criação não é repetida após um 5xx, pois o pedido pode ter sido aceito.
+    sessao = obter_sessao('intelipost_pedidos', configuracao.headers_intelipost(), STATUS_PARA_REPETIR_NAO_IDEMPOTENTE)
+    return requisitar(sessao, 'POST', order_api_url(), 'shipment_order_post', limite=limite_intelipost(),
+                      confirmar=lambda: _renovar_intencao(payload_pedido["order_number"]), data=json.dumps(payload_pedido), timeout=30)
+
+# ==============================================================================
+# --- INTENÇÕES DE CRIAÇÃO (OUTBOX) ---
+# ==============================================================================
+def _registrar_intencao(cursor, intencao):
+    """
+    Grava a intenção antes do POST, já reservada para este worker: se o processo cair depois,
+    ela é reconciliada quando a reserva vencer.
+    """
+    agora_str = relogio.agora().isoformat()
+    with metricas.DB_DURACAO.cronometrar(operacao="registrar_intencao"):
+        cursor.execute(
+            """INSERT INTO pedidos_intencao (order_number, estado, dados_json, tentativas, criado_em, atualizado_em, reservado_por, reserva_expira_em)
+               VALUES (?, 'PENDENTE', ?, 1, ?, ?, ?, ?)""",
+            (intencao["order_number"], json.dumps(intencao, ensure_ascii=False), agora_str, agora_str,
+             banco_dados.identificador_worker(), time.time() + intencao_reserva_segundos())
         )
-    ''')
-    conn.commit()
-    conn.close()
-    print("Banco de dados inicializado com sucesso.")
+        cursor.connection.commit()
+
+def _colunas_do_pedido(resultado, criado, agora_str):
+    """
+    Colunas iniciais do pedido em pedidos. Com PLANEJAMENTO_INLINE, o pedido criado agora
+    já entra como CONSULTADO com o cronograma calculado a partir do payload aceito e do
+    estado do volume da resposta, sem o GET da ETAPA 1; uma amostra de
+    PLANEJAMENTO_AMOSTRA_VERIFICACAO_PERCENTUAL% entra como CRIADO com os campos planejados,
+    para a ETAPA 1 conferi-los com a API. Pedidos cuja resposta não informa um estado
+    planejável e os recuperados na reconciliação ('existente') seguem pelo GET da ETAPA 1.
+    """
+    colunas = {"status_processo": 'CRIADO', "data_criacao_db": agora_str, "data_atualizacao_db": agora_str}
+    if resultado != 'criado' or not planejamento_inline():
+        return colunas
+    payload, estado_volume = criado["payload"], criado["estado_volume"]
+    colunas.update(created_iso=payload["created"], estimated_delivery_date_iso=payload["estimated_delivery_date"], delivery_method_id=str(payload["delivery_method_id"]))
+    if estado_volume not in ESTADOS_PLANEJAVEIS:
+        metricas.log_detalhe(f"AVISO: Resposta da criação do pedido '{payload['order_number']}' sem estado de volume planejável ({estado_volume}); segue pelo GET da ETAPA 1.")
+        metricas.ETAPA_PEDIDOS.incrementar(etapa="criacao", resultado="sem_estado_volume")
+        return colunas
+    if random.uniform(0, 100) < planejamento_amostra_verificacao_percentual():
+        metricas.ETAPA_PEDIDOS.incrementar(etapa="criacao", resultado="amostra_verificacao")
+        return colunas
+    colunas.update(zip(("update_date_in_transit", "update_date_to_be_delivered", "update_date_delivered", "next_action_date"),
+                       planejar_pedido(estado_volume, payload["created"], payload["estimated_delivery_date"])))
+    colunas.update(status_processo='CONSULTADO', latest_volume_state=estado_volume)
+    return colunas
+
+def _concluir_intencao(cursor, order_number, resultado, detalhe=None):
+    """
+    Aplica o resultado do envio: 'criado'/'existente' move o pedido para a tabela pedidos
+    (com a resposta completa da criação em pedidos_resposta) e remove a intenção na mesma
+    transação; 'recusado' a encerra como RECUSADO; None (resultado incerto) a mantém
+    PENDENTE, ainda reservada: só é reconciliada quando a reserva vencer, depois de
+    qualquer POST em andamento; 'reserva_perdida' não a altera (ela é de outro processo).
+    `detalhe` é o retorno de enviar_intencao ('criado') ou o motivo da falha. Retorna True
+    se o pedido foi registrado agora.
+    """
+    agora_str = relogio.agora().isoformat()
+    registrado = False
+    if resultado == 'reserva_perdida':
+        return registrado
+    with metricas.DB_DURACAO.cronometrar(operacao="concluir_intencao"):
+        if resultado in ('criado', 'existente'):
+            colunas = _colunas_do_pedido(resultado, detalhe, agora_str)
+            cursor.execute(
+                f"INSERT OR IGNORE INTO pedidos (order_number, {', '.join(colunas)}) VALUES (?{', ?' * len(colunas)})",
+                (order_number, *colunas.values())
+            )
+            registrado = cursor.rowcount == 1
+            if registrado and resultado == 'criado':
+                banco_dados.gravar_respostas(cursor, [(order_number, detalhe["resposta"])])
+            cursor.execute("DELETE FROM pedidos_intencao WHERE order_number = ?", (order_number,))
+        elif resultado == 'recusado':
+            cursor.execute("UPDATE pedidos_intencao SET estado = 'RECUSADO', ultimo_erro = ?, atualizado_em = ? WHERE order_number = ?", (detalhe, agora_str, order_number))
+        else:
+            cursor.execute("UPDATE pedidos_intencao SET ultimo_erro = ?, atualizado_em = ? WHERE order_number = ?", (detalhe, agora_str, order_number))
+        cursor.connection.commit()
+    return registrado
+
+@metricas.medir_etapa("reconciliacao")
+def reconciliar_intencoes(conn, max_workers=None, tamanho_lote=None):
+    """
+    Retoma as intenções PENDENTES deixadas por execuções anteriores (queda do processo,
+    timeout ou 5xx no POST), sem repetir CEP e cotação. Só entram as intenções sem reserva
+    válida (INTENCAO_RESERVA_SEGUNDOS), reservadas em lotes de `tamanho_lote` por
+    order_number (banco_dados.reservar_pedidos): uma intenção ainda em envio por outro
+    processo (ou por esta execução) nunca é reconciliada ao mesmo tempo. Retorna quantos
+    pedidos foram registrados.
+    """
+    cursor = conn.cursor()
+    tamanho_lote = tamanho_lote or reconciliacao_tamanho_lote()
+    registrados = 0
+    contagem = {}
+    apos = None
+    with ThreadPoolExecutor(max_workers=max_workers or criacao_max_workers()) as executor:
+        for n_lote in itertools.count(1):
+            lote = banco_dados.reservar_pedidos(conn, "estado = 'PENDENTE'", {}, "order_number, dados_json", tamanho_lote,
+                                                apos=apos, duracao=intencao_reserva_segundos(), tabela="pedidos_intencao")
+            if not lote:
+                break
+            apos = banco_dados.ultima_chave(lote, ("order_number",))
+            if n_lote == 1:
+                print("\n--- Reconciliando intenções de criação pendentes ---")
+            cursor.executemany("UPDATE pedidos_intencao SET tentativas = tentativas + 1 WHERE order_number = ?", [(row['order_number'],) for row in lote])
+            conn.commit()
+            futuros = {executor.submit(reconciliar_intencao, json.loads(row['dados_json'])): row['order_number'] for row in lote}
+            for futuro in as_completed(futuros):
+                order_number = futuros[futuro]
+                try:
+                    resultado, detalhe = futuro.result()
+                except Exception as e:
+                    resultado, detalhe = None, str(e)
+                    print(f"ERRO ao reconciliar o pedido '{order_number}': {e}. A intenção continua pendente.")
+                if _concluir_intencao(cursor, order_number, resultado, detalhe):
+                    registrados += 1
+                if resultado == 'recusado':
+                    print(f"ERRO: Pedido '{order_number}' recusado pela API na reconciliação: {detalhe}")
+                rotulo = resultado or 'pendente'
+                contagem[rotulo] = contagem.get(rotulo, 0) + 1
+                metricas.ETAPA_PEDIDOS.incrementar(etapa="reconciliacao", resultado=rotulo)
+
+    if not contagem:
+        return 0
+    resumo = ', '.join(f"{n} {rotulo}" for rotulo, n in sorted(contagem.items()))
+    print(f"--- Reconciliação finalizada: {resumo}. {registrados} pedido(s) registrado(s). ---")
+    return registrados
 
 # ==============================================================================
 # --- FUNÇÃO PRINCIPAL DE CRIAÇÃO DE PEDIDOS ---
 # ==============================================================================
-def criar_novos_pedidos(conn, numero_de_pedidos=250):
-    """Realiza a cotação e cria novos pedidos, salvando-os no banco de dados."""
-    print(f"\n--- Iniciando criação de {numero_de_pedidos} novos pedidos ---")
-    
-    # --- FUNÇÕES INTERNAS RESTAURADAS ---
-    def adicionar_dias_uteis(data_inicial, dias_uteis):
-        dias_adicionados = 0
-        data_final = data_inicial
-        while dias_adicionados < dias_uteis:
-            data_final += timedelta(days=1)
-            if data_final.weekday() < 5 and data_final not in feriados_br:
-                dias_adicionados += 1
-        return data_final
-
-    def buscar_endereco_por_cep(cep):
-        try:
-            response = requests.get(f"{CEP_LOOKUP_API_URL}{cep}", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException:
-            return None
-
-    def realizar_cotacao(origin_zip_code, cep_destino, peso, largura, altura, comprimento):
-        custo_do_produto = round(random.uniform(100.0, 5000.0), 2)
-        payload = {
-            "destination_zip_code": cep_destino.replace('-', ''),
-            "origin_zip_code": origin_zip_code,
-            "products": [{"weight": peso, "cost_of_goods": custo_do_produto, "width": largura, "height": altura, "length": comprimento, "quantity": 1}]
-        }
-        headers = {'Content-Type': 'application/json', 'api-key': API_KEY, 'platform': 'automacao'}
-        try:
-            response = requests.post(QUOTE_API_URL, headers=headers, data=json.dumps(payload), timeout=30)
-            response.raise_for_status()
-            resultado = response.json().get("content", {})
-            opcoes_entrega = resultado.get("delivery_options")
-            if not opcoes_entrega: return None
-            opcao = min(opcoes_entrega, key=lambda opt: opt.get("provider_shipping_cost", float('inf')))
-            return {"cotacao_id": resultado.get("id"), "delivery_method_id": opcao.get("delivery_method_id"), "prazo_dias_uteis": opcao.get("delivery_estimate_business_days"), "custo_frete": opcao.get("provider_shipping_cost"), "custo_produto": custo_do_produto}
-        except Exception as e:
-            print(f"ERRO na cotação: {e}")
-            return None
-
-    # --- LÓGICA PRINCIPAL RESTAURADA ---
+@metricas.medir_etapa("criacao")
+def criar_novos_pedidos(conn, numero_de_pedidos=250, max_workers=None):
+    """
+    Realiza a cotação e cria novos pedidos, salvando-os no banco de dados.
+
+    As chamadas de rede de até `max_workers` pedidos são sobrepostas num pool
+    de threads; as gravações no SQLite ficam na thread principal, que é a dona
+    da conexão `conn`. Cada pedido passa por uma intenção gravada antes do POST
+    (pedidos_intencao), e as intenções pendentes de execuções anteriores são
+    reconciliadas primeiro.
+    """
+    max_workers = max_workers or criacao_max_workers()
+    # Carregados antes dos workers: gerar um pool de dentro de uma thread do executor a atrasaria
+    dados_sinteticos.carregar()
+    reconciliar_intencoes(conn, max_workers)
+    print(f"\n--- Iniciando criação de {numero_de_pedidos} novos pedidos ({max_workers} em paralelo) ---")
+
     pedidos_criados_count = 0
-    for i in range(numero_de_pedidos):
-        print(f"\nProcessando criação {i + 1}/{numero_de_pedidos}...")
-        
-        warehouse_code = random.choice(list(WAREHOUSES.keys()))
-        origin_zip_code = WAREHOUSES[warehouse_code]
-        print(f"INFO: Usando CD de origem: Código '{warehouse_code}', CEP '{origin_zip_code}'")
-        
-        cep_destino = random.choice(CEPS_VALIDOS_BRASIL)
-        dados_endereco = buscar_endereco_por_cep(cep_destino)
-        
-        if not dados_endereco: 
-            print(f"Não foi possível obter dados para o CEP de destino {cep_destino}. Pulando.")
-            continue
-
-        if not dados_endereco.get('street'):
-            rua_ficticia = fake.street_name()
-            dados_endereco['street'] = rua_ficticia
-            print(f"INFO: Rua não encontrada para CEP geral. Usando valor fictício: '{rua_ficticia}'")
-        
-        if not dados_endereco.get('neighborhood'):
-            bairro_ficticio = fake.bairro()
-            dados_endereco['neighborhood'] = bairro_ficticio
-            print(f"INFO: Bairro não encontrado para CEP geral. Usando valor fictício: '{bairro_ficticio}'")
-
-        p = {"peso": round(random.uniform(0.1, 50.0), 2), "largura": random.randint(1, 100), "altura": random.randint(1, 100), "comprimento": random.randint(1, 100)}
-        
-        cotacao = realizar_cotacao(origin_zip_code, cep_destino, **p)
-        
-        if not cotacao or not all(cotacao.values()): 
-            print(f"Não foi possível obter cotação para o CEP {cep_destino}. Pulando.")
-            continue
-
-        data_criacao = datetime.now(tz_brasilia)
-        order_number = f"PEDIDO-{int(time.time())}"
-        
-        data_estimada_obj = adicionar_dias_uteis(data_criacao, cotacao["prazo_dias_uteis"])
-        data_estimada_ajustada = data_estimada_obj.replace(hour=23, minute=59, second=59)
-        
-        payload_pedido = {
-            "quote_id": cotacao["cotacao_id"], 
-            "delivery_method_id": cotacao["delivery_method_id"], 
-            "order_number": order_number, 
-            "origin_warehouse_code": warehouse_code,
-            "sales_channel": "Marketplace", 
-            "created": data_criacao.isoformat(timespec='seconds'), 
-            "shipped_date": data_criacao.isoformat(timespec='seconds'),
-            "end_customer": {"first_name": fake.first_name(), "last_name": fake.last_name(), "email": fake.email(), "phone": fake.msisdn(), "cellphone": fake.msisdn(), "is_company": False, "federal_tax_payer_id": fake.cpf().replace('.', '').replace('-', ''), "shipping_country": "Brasil", "shipping_state": dados_endereco.get("state"), "shipping_city": dados_endereco.get("city"), "shipping_address": dados_endereco.get("street"), "shipping_number": str(random.randint(1, 9999)), "shipping_quarter": dados_endereco.get("neighborhood"), "shipping_zip_code": dados_endereco.get("cep").replace('-', '')},
-            "shipment_order_volume_array": [{"shipment_order_volume_number": 1, "volume_type_code": "BOX", "weight": p["peso"], "width": p["largura"], "height": p["altura"], "length": p["comprimento"], "products_quantity": 1, "products_nature": "products", "shipment_order_volume_invoice": {"invoice_series": "1", "invoice_number": str(random.randint(1000, 99999)), "invoice_key": ''.join(random.choices('0123456789', k=44)), "invoice_date": data_criacao.isoformat(timespec='seconds'), "invoice_total_value": str(round(cotacao["custo_produto"] + cotacao["custo_frete"], 2)), "invoice_products_value": str(cotacao["custo_produto"]), "invoice_cfop": "6102"}}],
-            "estimated_delivery_date": data_estimada_ajustada.isoformat(timespec='seconds')
-        }
-        
-        headers = {'Content-Type': 'application/json', 'api-key': API_KEY, 'platform': 'automacao'}
-        try:
-            response = requests.post(ORDER_API_URL, headers=headers, data=json.dumps(payload_pedido), timeout=30)
-            response.raise_for_status()
-            
-            cursor = conn.cursor()
-            agora_str = datetime.now(tz_brasilia).isoformat()
-            cursor.execute("INSERT OR IGNORE INTO pedidos (order_number, status_processo, data_criacao_db, data_atualizacao_db) VALUES (?, ?, ?, ?)", (order_number, 'CRIADO', agora_str, agora_str))
-            conn.commit()
-            print(f"SUCESSO: Pedido '{order_number}' criado na API e salvo no banco de dados.")
-            pedidos_criados_count += 1
-        except Exception as e:
-            print(f"ERRO na criação do pedido '{order_number}': {e}")
-        time.sleep(2)
-        
+    cursor = conn.cursor()
+    indices = iter(range(numero_de_pedidos))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pendentes = {}  # futuro -> ('preparo', None) ou ('envio', order_number)
+
+        def submeter_preparo():
+            # Os preparos entram aos poucos para que os envios não fiquem atrás de todos eles na fila
+            if (indice := next(indices, None)) is not None:
+                pendentes[executor.submit(preparar_pedido, indice, numero_de_pedidos)] = ('preparo', None)
+
+        for _ in range(max_workers):
+            submeter_preparo()
+        while pendentes:
+            concluidos, _ = wait(pendentes, return_when=FIRST_COMPLETED)
+            for futuro in concluidos:
+                tipo, order_number = pendentes.pop(futuro)
+                if tipo == 'preparo':
+                    submeter_preparo()
+                    try:
+                        intencao = futuro.result()
+                    except Exception as e:
+                        print(f"ERRO inesperado na preparação de pedido: {e}")
+                        metricas.ETAPA_PEDIDOS.incrementar(etapa="criacao", resultado="falha")
+                        continue
+                    if intencao:
+                        _registrar_intencao(cursor, intencao)
+                        pendentes[executor.submit(enviar_intencao, intencao)] = ('envio', intencao["order_number"])
+                    continue
+
+                try:
+                    resultado, detalhe = futuro.result()
+                except Exception as e:
+                    resultado, detalhe = None, str(e)
+                if _concluir_intencao(cursor, order_number, resultado, detalhe):
+                    metricas.log_detalhe(f"SUCESSO: Pedido '{order_number}' criado na API e salvo no banco de dados.")
+                    metricas.ETAPA_PEDIDOS.incrementar(etapa="criacao", resultado="sucesso")
+                    pedidos_criados_count += 1
+                elif resultado == 'criado':
+                    print(f"ERRO: Pedido '{order_number}' criado na API, mas já existia no banco de dados. Não foi salvo.")
+                    metricas.ETAPA_PEDIDOS.incrementar(etapa="criacao", resultado="falha")
+                elif resultado == 'recusado':
+                    print(f"ERRO na criação do pedido '{order_number}': {detalhe}")
+                    metricas.ETAPA_PEDIDOS.incrementar(etapa="criacao", resultado="falha")
+                elif resultado == 'reserva_perdida':
+                    print(f"AVISO: A intenção do pedido '{order_number}' passou a outro processo antes do envio; não foi enviada por este.")
+                    metricas.ETAPA_PEDIDOS.incrementar(etapa="criacao", resultado="reserva_perdida")
+                else:
+                    print(f"ERRO na criação do pedido '{order_number}': {detalhe}. Intenção mantida para reconciliação.")
+                    metricas.ETAPA_PEDIDOS.incrementar(etapa="criacao", resultado="pendente")
+
     print(f"\n--- Processo de criação finalizado: {pedidos_criados_count} novos pedidos foram criados. ---")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cria pedidos de teste na Intelipost e os registra no SQLite.")
+    parser.add_argument("--aquecer-cache-cep", action="store_true", help="Apenas pré-carrega o cache de CEPs e encerra.")
+    parser.add_argument("--gerar-dados-sinteticos", action="store_true", help="Apenas gera (ou carrega) os pools de clientes e notas fiscais e encerra.")
+    parser.add_argument("--reconciliar", action="store_true", help="Apenas reconcilia as intenções de criação pendentes e encerra.")
+    parser.add_argument("--verboso", action="store_true", help="Imprime uma linha por pedido (LOG_NIVEL=detalhado).")
+    args = parser.parse_args()
+    if args.verboso:
+        metricas.definir_nivel_log('detalhado')
+
     print("======================================================================")
     print("====== SCRIPT DE CRIAÇÃO DE PEDIDOS (VERSÃO SQLite) ======")
     print("======================================================================")
     db_conn = None
     try:
+        metricas.iniciar_servidor_http()
         setup_database()
-        db_conn = conectar_db()
-        criar_novos_pedidos(db_conn, numero_de_pedidos=250)
+        if args.aquecer_cache_cep:
+            aquecer_cache_cep()
+        elif args.gerar_dados_sinteticos:
+            dados_sinteticos.carregar()
+        else:
+            db_conn = conectar_db()
+            if args.reconciliar:
+                reconciliar_intencoes(db_conn)
+            else:
+                criar_novos_pedidos(db_conn, numero_de_pedidos=250)
     except Exception as e:
         print(f"\nERRO CRÍTICO NA EXECUÇÃO: {e}")
     finally:
         if db_conn:
             db_conn.close()
+        fechar_sessoes()
+        metricas.gravar_arquivo()
         print("\n==================== EXECUÇÃO CONCLUÍDA ====================")
\ No newline at end of file
@@ -0,0 +1,144 @@
+# dados_sinteticos.py
+
+import json
+import random
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import multiprocessing
+import configuracao
+from banco_dados import conectar_db
+
+# Pools de dados fictícios (clientes e notas fiscais) gerados de uma vez, em vez de
+# chamar o Faker a cada pedido. Cada pool é gerado em blocos com semente própria
+# (semente do pool + índice do bloco), então o conteúdo não depende de quantos
+# processos geraram os blocos; com a mesma DADOS_SINTETICOS_SEMENTE, dois bancos
+# recebem os mesmos registros, e os sorteios seguem a mesma sequência.
+#    - Os pools são guardados comprimidos na tabela dados_sinteticos do mesmo SQLite
+#      dos pedidos e reaproveitados nas execuções seguintes.
+#    - DADOS_SINTETICOS_PROCESSOS > 1 gera os blocos num pool de processos.
+
+# ==============================================================================
+# --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
+# ==============================================================================
+dados_sinteticos_tamanho = configuracao.parametro('DADOS_SINTETICOS_TAMANHO', '5000', int)
+dados_sinteticos_semente = configuracao.parametro('DADOS_SINTETICOS_SEMENTE', '0', int)
+dados_sinteticos_processos = configuracao.parametro('DADOS_SINTETICOS_PROCESSOS', '0', int)
+DADOS_SINTETICOS_BLOCO = 500
+
+# Incrementar quando o formato dos registros mudar: os pools gravados são regerados
+VERSAO_FORMATO = 1
+
+# ==============================================================================
+# --- GERAÇÃO (EXECUTADA TAMBÉM NOS PROCESSOS DO POOL) ---
+# ==============================================================================
+@lru_cache(maxsize=None)
+def obter_faker():
+    # O Faker é o import mais caro do pipeline: só é carregado quando um pool é gerado
+    from faker import Faker
+    return Faker('pt_BR')
+
+def _gerar_clientes(semente, quantidade):
+    fake = obter_faker()
+    fake.seed_instance(semente)
+    return [{
+        "cliente": {"first_name": fake.first_name(), "last_name": fake.last_name(), "email": fake.email(), "phone": fake.msisdn(), "cellphone": fake.msisdn(), "federal_tax_payer_id": fake.cpf().replace('.', '').replace('-', '')},
+        # Usados quando a BrasilAPI devolve um CEP geral, sem rua ou bairro
+        "rua": fake.street_name(),
+        "bairro": fake.bairro(),
+    } for _ in range(quantidade)]
+
+def _gerar_notas_fiscais(semente, quantidade):
+    rng = random.Random(semente)
+    return [{
+        "shipping_number": str(rng.randint(1, 9999)),
+        "invoice_number": str(rng.randint(1000, 99999)),
+        "invoice_key": ''.join(rng.choices('0123456789', k=44)),
+    } for _ in range(quantidade)]
+
+GERADORES = {"clientes": _gerar_clientes, "notas_fiscais": _gerar_notas_fiscais}
+
+def gerar_bloco(tipo, semente, indice_bloco, quantidade):
+    return GERADORES[tipo](f"{tipo}:{semente}:{indice_bloco}", quantidade)
+
+def gerar_pool(tipo, tamanho, semente, processos=0):
+    """Gera `tamanho` registros do `tipo`, em blocos de DADOS_SINTETICOS_BLOCO."""
+    blocos = [(tipo, semente, i, min(DADOS_SINTETICOS_BLOCO, tamanho - inicio)) for i, inicio in enumerate(range(0, tamanho, DADOS_SINTETICOS_BLOCO))]
+    if processos > 1 and len(blocos) > 1:
+        # 'spawn': o pool pode ser criado por um processo que já tem threads (sessões HTTP, métricas)
+        with ProcessPoolExecutor(max_workers=processos, mp_context=multiprocessing.get_context('spawn')) as executor:
+            resultados = list(executor.map(gerar_bloco, *zip(*blocos)))
+    else:
+        resultados = [gerar_bloco(*bloco) for bloco in blocos]
+    return [registro for bloco in resultados for registro in bloco]
+
+# ==============================================================================
+# --- POOLS (MEMÓRIA + SQLite) ---
+# ==============================================================================
+class PoolDadosSinteticos:
+    """
+    Pools de clientes e notas fiscais para a montagem dos payloads. Carregados na
+    primeira chamada (do SQLite ou, se ausentes, gerados e gravados); os sorteios
+    são seguros para uso entre threads.
+    """
+
+    def __init__(self, db_file=None, tamanho=None, semente=None, processos=None):
+        # Parâmetros None: lidos das variáveis DADOS_SINTETICOS_* no carregamento
+        self.db_file = db_file
+        self.tamanho = tamanho
+        self.semente = semente
+        self.processos = processos
+        self._pools = None
+        self._rng = None
+        self._lock = threading.Lock()
+
+    def _chave(self, tipo):
+        return f"{tipo}|v{VERSAO_FORMATO}|semente={self.semente}|tamanho={self.tamanho}"
+
+    def carregar(self):
+        """Carrega (ou gera e grava) os pools; retorna quantos foram gerados agora."""
+        with self._lock:
+            if self._pools is not None:
+                return 0
+            if self.tamanho is None: self.tamanho = dados_sinteticos_tamanho()
+            if self.semente is None: self.semente = dados_sinteticos_semente()
+            if self.processos is None: self.processos = dados_sinteticos_processos()
+            self._rng = random.Random(self.semente)
+            pools, gerados = {}, 0
+            conn = conectar_db(self.db_file or configuracao.db_file())
+            try:
+                for tipo in GERADORES:
+                    row = conn.execute("SELECT dados_zlib FROM dados_sinteticos WHERE chave = ?", (self._chave(tipo),)).fetchone()
+                    if row:
+                        pools[tipo] = json.loads(zlib.decompress(row[0]))
+                        continue
+                    inicio = time.perf_counter()
+                    pools[tipo] = gerar_pool(tipo, self.tamanho, self.semente, self.processos)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO dados_sinteticos (chave, dados_zlib, gerado_em) VALUES (?, ?, ?)",
+                        (self._chave(tipo), zlib.compress(json.dumps(pools[tipo], ensure_ascii=False).encode('utf-8')), time.time())
+                    )
+                    conn.commit()
+                    gerados += 1
+                    print(f"INFO: Pool de {tipo} gerado: {self.tamanho} registros em {time.perf_counter() - inicio:.1f}s (semente {self.semente}).")
+            finally:
+                conn.close()
+            self._pools = pools
+            return gerados
+
+    def _sortear(self, tipo):
+        self.carregar()
+        with self._lock:
+            return dict(self._rng.choice(self._pools[tipo]))
+
+    def sortear_cliente(self):
+        """Retorna {'cliente': {...end_customer...}, 'rua': ..., 'bairro': ...}."""
+        registro = self._sortear("clientes")
+        registro["cliente"] = dict(registro["cliente"])
+        return registro
+
+    def sortear_nota_fiscal(self):
+        """Retorna {'shipping_number', 'invoice_number', 'invoice_key'}."""
+        return self._sortear("notas_fiscais")
@@ -0,0 +1,160 @@
+# gerador_ids.py
+
+import atexit
+import socket
+import sqlite3
+import threading
+import time
+import os
+import uuid
+from datetime import datetime, timezone
+import configuracao
+from banco_dados import conectar_db
+
+# Gerador de números de pedido no estilo Snowflake: 'PEDIDO-<id>', em que <id> é
+# um inteiro de 63 bits formado por
+#    - 41 bits: milissegundos desde GERADOR_EPOCH_MS
+#    - 10 bits: id do nó (processo) gerador
+#    - 12 bits: sequência dentro do mesmo milissegundo
+# Cada processo reserva (lease) um id de nó livre na tabela gerador_ids_nos_reservas do
+# SQLite compartilhado, de modo que processos e hosts apontando para o mesmo banco nunca
+# geram números repetidos. Um id fixo (GERADOR_NO_ID ou o argumento no_id) passa pela
+# mesma reserva: se outro processo o detém, a geração falha com erro.
+#    - A reserva dura GERADOR_NO_RESERVA_SEGUNDOS e é renovada pelo próprio gerador na
+#      metade desse tempo; ids de reservas vencidas (processos encerrados) são reaproveitados.
+#    - Um id só é usado com a reserva válida: se ela venceu e passou a outro processo, o
+#      gerador reserva outro id antes de continuar (com id fixo, falha com erro).
+#    - Com os 1024 ids reservados por processos ativos, a geração falha com erro.
+# Os relógios dos hosts devem estar sincronizados (NTP), como em todo esquema Snowflake.
+
+# ==============================================================================
+# --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
+# ==============================================================================
+PREFIXO_ORDER_NUMBER = "PEDIDO-"
+GERADOR_EPOCH_MS = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+BITS_NO = 10
+BITS_SEQUENCIA = 12
+MAX_NO = (1 << BITS_NO) - 1
+MAX_SEQUENCIA = (1 << BITS_SEQUENCIA) - 1
+
+# Id de nó fixo para este processo (opcional, 0 a MAX_NO); sem ele, reserva o menor id livre
+gerador_no_id = configuracao.parametro('GERADOR_NO_ID', tipo=int)
+gerador_no_reserva_segundos = configuracao.parametro('GERADOR_NO_RESERVA_SEGUNDOS', '600', float)
+
+# Um id liberado só volta a ser usado depois deste intervalo, para que o novo dono não
+# gere ids no mesmo milissegundo que o anterior
+INTERVALO_REUSO_SEGUNDOS = 1.0
+
+# ==============================================================================
+# --- GERADOR ---
+# ==============================================================================
+class GeradorOrderNumber:
+    """Gera números de pedido únicos e monotônicos; seguro para uso entre threads."""
+
+    def __init__(self, db_file=None, no_id=None):
+        self.db_file = db_file
+        self._no_fixo = no_id  # None: GERADOR_NO_ID ou o menor id livre, no primeiro id gerado
+        self._no_id = None
+        self._dono = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._renovar_em = None  # None: sem reserva
+        self._ultimo_ms = -1
+        self._sequencia = 0
+        self._lock = threading.Lock()
+        atexit.register(self.liberar)
+
+    def _reservar_no(self):
+        """
+        Renova a reserva do id atual ou, se ela passou a outro processo, reserva o id fixo ou,
+        sem ele, o menor id livre (sem reserva ou com reserva vencida). Lança RuntimeError se
+        o id fixo estiver reservado por outro processo ou se não houver id livre.
+        """
+        duracao = gerador_no_reserva_segundos()
+        conn = conectar_db(self.db_file or configuracao.db_file())
+        conn.isolation_level = None  # transação explícita
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                agora = time.time()
+                no_id = self._no_id
+                if no_id is not None and not conn.execute(
+                    "UPDATE gerador_ids_nos_reservas SET expira_em = ? WHERE no_id = ? AND dono = ?", (agora + duracao, no_id, self._dono)
+                ).rowcount:
+                    no_id = None
+                if no_id is None:
+                    ocupados = {row[0] for row in conn.execute("SELECT no_id FROM gerador_ids_nos_reservas WHERE expira_em >= ?", (agora,))}
+                    if self._no_fixo is not None:
+                        if self._no_fixo in ocupados:
+                            raise RuntimeError(f"Erro: O id de nó fixo {self._no_fixo} do gerador está reservado por outro processo ativo.")
+                        no_id = self._no_fixo
+                    else:
+                        no_id = next((n for n in range(MAX_NO + 1) if n not in ocupados), None)
+                    if no_id is None:
+                        raise RuntimeError(f"Erro: Todos os {MAX_NO + 1} ids de nó do gerador estão reservados por processos ativos.")
+                    conn.execute(
+                        "INSERT OR REPLACE INTO gerador_ids_nos_reservas (no_id, dono, host, pid, reservado_em, expira_em) VALUES (?, ?, ?, ?, ?, ?)",
+                        (no_id, self._dono, socket.gethostname(), os.getpid(), datetime.now(timezone.utc).isoformat(), agora + duracao)
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        if self._no_id is not None and no_id != self._no_id:
+            print(f"AVISO: A reserva do id de nó {self._no_id} do gerador venceu e passou a outro processo; usando o id {no_id}.")
+        self._no_id = no_id
+        self._renovar_em = agora + duracao / 2
+
+    def liberar(self):
+        """
+        Devolve o id de nó reservado (chamado na saída do processo). É só uma antecipação:
+        se o banco já não existir ou estiver inacessível, a reserva vence sozinha.
+        """
+        with self._lock:
+            if self._no_id is None:
+                return
+            no_id, self._no_id, self._renovar_em = self._no_id, None, None
+            db_file = self.db_file or configuracao.db_file()
+            if not os.path.exists(db_file):
+                return
+            try:
+                conn = conectar_db(db_file)
+                try:
+                    conn.execute(
+                        "UPDATE gerador_ids_nos_reservas SET expira_em = ? WHERE no_id = ? AND dono = ?",
+                        (time.time() + INTERVALO_REUSO_SEGUNDOS, no_id, self._dono)
+                    )
+                    conn.commit()
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                print(f"AVISO: Não foi possível liberar o id de nó {no_id} do gerador ({e}); a reserva vencerá sozinha.")
+
+    def gerar_id(self):
+        with self._lock:
+            if self._no_id is None:
+                if self._no_fixo is None:
+                    self._no_fixo = gerador_no_id()
+                if self._no_fixo is not None and not 0 <= self._no_fixo <= MAX_NO:
+                    raise ValueError(f"Erro: O id de nó fixo do gerador deve estar entre 0 e {MAX_NO}; recebido {self._no_fixo}.")
+                self._reservar_no()
+            elif time.time() >= self._renovar_em:
+                self._reservar_no()
+            agora_ms = int(time.time() * 1000) - GERADOR_EPOCH_MS
+            # Relógio que voltou no tempo: continua a partir do último milissegundo usado.
+            agora_ms = max(agora_ms, self._ultimo_ms)
+            if agora_ms == self._ultimo_ms:
+                self._sequencia = (self._sequencia + 1) & MAX_SEQUENCIA
+                if self._sequencia == 0:
+                    # Sequência esgotada neste milissegundo: avança para o próximo.
+                    agora_ms += 1
+                    while int(time.time() * 1000) - GERADOR_EPOCH_MS < agora_ms:
+                        time.sleep(0.0005)
+            else:
+                self._sequencia = 0
+            self._ultimo_ms = agora_ms
+            return (agora_ms << (BITS_NO + BITS_SEQUENCIA)) | (self._no_id << BITS_SEQUENCIA) | self._sequencia
+
+    def gerar(self):
+        return f"{PREFIXO_ORDER_NUMBER}{self.gerar_id()}"
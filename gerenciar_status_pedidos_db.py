@@ -1,316 +1,573 @@
 # gerenciar_status_pedidos_db.py
 
-import sqlite3
-import requests
 import json
 import random
-import os
 import math
+import time
+import zlib
+import argparse
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta
+from functools import lru_cache
 from zoneinfo import ZoneInfo
-from dotenv import load_dotenv
+import banco_dados
+import configuracao
+import metricas
+import relogio
+from calendario_uteis import calendario_padrao
+from planejamento_entregas import calcular_next_action_date, planejar_pedido
+from cliente_http import obter_sessao, fechar_sessoes, requisitar
+from limitador_taxa import chave_limite, limite_intelipost, limite_taxa_carrier_rps
 
 # ==============================================================================
 # --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
 # ==============================================================================
-# Carrega as variáveis de ambiente do arquivo .env
-load_dotenv()
+# DB_FILE_PATH, INTELIPOST_API_KEY e as chaves das transportadoras são lidas (e validadas)
+# no primeiro uso, via configuracao: só as etapas que chamam a API exigem as chaves
+# URL base da API (sobrescrita para apontar para o servidor_simulado em testes de carga)
+intelipost_api_url = configuracao.parametro('INTELIPOST_API_URL', 'https://api.intelipost.com.br/api/v1', lambda url: url.rstrip('/'))
 
-# --- CONFIGURAÇÕES CARREGADAS DO AMBIENTE ---
-DB_FILE = os.getenv('DB_FILE_PATH')
-API_KEY = os.getenv('INTELIPOST_API_KEY')
+def order_api_url():
+    return f'{intelipost_api_url()}/shipment_order'
 
-# Verificação para garantir que as variáveis foram carregadas
-if not DB_FILE or not API_KEY:
-    raise ValueError("Erro: As variáveis de ambiente DB_FILE_PATH e INTELIPOST_API_KEY devem ser definidas.")
+def tracking_api_url():
+    return f'{intelipost_api_url()}/tracking/add/events'
 
-TRACKING_API_URL = 'https://api.intelipost.com.br/api/v1/tracking/add/events'
+# Consultas simultâneas de pedidos e quantidade de pedidos gravados por transação na ETAPA 1
+consulta_max_workers = configuracao.parametro('CONSULTA_MAX_WORKERS', '8', int)
+consulta_tamanho_lote = configuracao.parametro('CONSULTA_TAMANHO_LOTE', '100', int)
 
-# Mapeamento de transportadoras com API keys carregadas do ambiente
+# Envios de tracking simultâneos por transportadora (sobrescrito por CARRIER_<id>_MAX_WORKERS;
+# a taxa por API key vem de CARRIER_<id>_RPS, ver limitador_taxa) e quantidade de pedidos
+# confirmados gravados por transação na ETAPA 3
+tracking_max_workers_por_transportadora = configuracao.parametro('TRACKING_MAX_WORKERS_POR_TRANSPORTADORA', '4', int)
+tracking_tamanho_lote_gravacao = configuracao.parametro('TRACKING_TAMANHO_LOTE_GRAVACAO', '100', int)
+# Pedidos devidos reservados por vez na ETAPA 3 (ver banco_dados.reservar_pedidos)
+tracking_tamanho_lote_reserva = configuracao.parametro('TRACKING_TAMANHO_LOTE_RESERVA', '500', int)
+# Tempo máximo (s) de cada execução da ETAPA 3; 0 = sem limite
+tracking_orcamento_segundos = configuracao.parametro('TRACKING_ORCAMENTO_SEGUNDOS', '0', float)
+
+# ETAPA 2: percentual de pedidos abertos que devem atrasar, peso da proximidade da data
+# estimada na amostragem (0 = uniforme) e semente opcional para uma seleção reprodutível
+atraso_percentual = configuracao.parametro('ATRASO_PERCENTUAL', '2', float)
+atraso_peso_proximidade = configuracao.parametro('ATRASO_PESO_PROXIMIDADE', '0', float)
+atraso_semente = configuracao.parametro('ATRASO_SEMENTE', tipo=int)
+
+# Mapeamento de transportadoras; as API keys vêm de CARRIER_<id>_API_KEY (ver carrier_map)
 CARRIER_MAP = {
     "32": {
-        "api_key": os.getenv("CARRIER_32_API_KEY"),
         "codes": {"shipped": "98", "in_transit": "98", "to_be_delivered": "31", "delivered": "01"}
     },
     "4": {
-        "api_key": os.getenv("CARRIER_4_API_KEY"),
         "codes": {"shipped": "101", "in_transit": "101", "to_be_delivered": "182", "delivered": "01"}
     },
     "177": {
-        "api_key": os.getenv("CARRIER_177_API_KEY"),
         "codes": {"shipped": "098", "in_transit": "098", "to_be_delivered": "31", "delivered": "001"}
     },
     "51": {
-        "api_key": os.getenv("CARRIER_51_API_KEY"),
         "codes": {"shipped": "18", "in_transit": "18", "to_be_delivered": "31", "delivered": "35"}
     },
     "3363": {
-        "api_key": os.getenv("CARRIER_3363_API_KEY"),
         "codes": {"shipped": "98", "in_transit": "98", "to_be_delivered": "31", "delivered": "01"}
     },
     "23": {
-        "api_key": os.getenv("CARRIER_23_API_KEY"),
         "codes": {"shipped": "98", "in_transit": "98", "to_be_delivered": "101", "delivered": "01"}
     }
 }
 
-# Verificação para as chaves das transportadoras
-for carrier_id, data in CARRIER_MAP.items():
-    if not data["api_key"]:
-        raise ValueError(f"Erro: A variável de ambiente CARRIER_{carrier_id}_API_KEY não foi definida.")
-
 tz_brasilia = ZoneInfo("America/Sao_Paulo")
 
+ETAPAS = ("consulta", "atraso", "tracking")
+
+@lru_cache(maxsize=None)
+def carrier_map():
+    """CARRIER_MAP com api_key, headers, max_workers e limite de taxa de cada transportadora, validado no primeiro uso."""
+    carriers = {}
+    for carrier_id, data in CARRIER_MAP.items():
+        api_key = configuracao.obter(f"CARRIER_{carrier_id}_API_KEY")
+        if not api_key:
+            raise ValueError(f"Erro: A variável de ambiente CARRIER_{carrier_id}_API_KEY não foi definida.")
+        carriers[carrier_id] = {
+            **data,
+            "api_key": api_key,
+            "headers": {'Content-Type': 'application/json', 'logistic-provider-api-key': api_key, 'platform': 'automacao'},
+            "max_workers": int(configuracao.obter(f"CARRIER_{carrier_id}_MAX_WORKERS", tracking_max_workers_por_transportadora())),
+            "limite": (chave_limite(api_key), float(configuracao.obter(f"CARRIER_{carrier_id}_RPS", limite_taxa_carrier_rps()))),
+        }
+    return carriers
+
 # ==============================================================================
 # --- MÓDULO DE GERENCIAMENTO DO BANCO DE DADOS (SQLite) ---
 # ==============================================================================
 def conectar_db():
-    db_dir = os.path.dirname(DB_FILE)
-    if db_dir:
-        os.makedirs(db_dir, exist_ok=True)
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return banco_dados.conectar_db(configuracao.db_file())
 
 def setup_database():
-    """Cria a tabela de pedidos se ela não existir."""
-    conn = conectar_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS pedidos (
-            order_number TEXT PRIMARY KEY,
-            status_processo TEXT NOT NULL,
-            latest_volume_state TEXT,
-            created_iso TEXT,
-            estimated_delivery_date_iso TEXT,
-            delivery_method_id TEXT,
-            full_response_json TEXT,
-            late_delivery_flag INTEGER NOT NULL DEFAULT 0,
-            data_criacao_db TEXT,
-            data_atualizacao_db TEXT,
-            update_date_in_transit TEXT,
-            update_date_to_be_delivered TEXT,
-            update_date_delivered TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    """Cria ou atualiza o schema do banco (ver banco_dados.MIGRACOES)."""
+    banco_dados.setup_database(configuracao.db_file())
 
 # ==============================================================================
 # --- MÓDULOS DE GERENCIAMENTO DE STATUS (LÓGICA RESTAURADA) ---
 # ==============================================================================
-def consultar_pedidos_criados(conn):
-    """Consulta os detalhes de pedidos e calcula e salva as datas de update."""
+def _divergencias_planejamento(planejado, atualizacao):
+    """
+    Compara os campos gravados pela criação com planejamento inline (amostra de verificação,
+    ver criar_pedidos_db) com os da resposta do GET; retorna os nomes dos que divergem.
+    """
+    _, _, created_iso, estimated_iso, delivery_method_id = atualizacao[:5]
+    divergentes = []
+    if planejado['created_iso'] and created_iso and datetime.fromisoformat(planejado['created_iso']) != datetime.fromisoformat(created_iso):
+        divergentes.append('created_iso')
+    if planejado['estimated_delivery_date_iso'] and estimated_iso and planejado['estimated_delivery_date_iso'][:10] != estimated_iso[:10]:
+        divergentes.append('estimated_delivery_date_iso')
+    if planejado['delivery_method_id'] and str(planejado['delivery_method_id']) != str(delivery_method_id):
+        divergentes.append('delivery_method_id')
+    return divergentes
+
+def _consultar_pedido_na_api(order_number):
+    """Executado pelos workers: consulta o pedido e devolve os parâmetros do UPDATE e a resposta comprimida."""
+    response = requisitar(obter_sessao('intelipost', configuracao.headers_intelipost()), 'GET', f"{order_api_url()}/{order_number}", 'shipment_order_get', limite=limite_intelipost(), timeout=30)
+    response.raise_for_status()
+    content = response.json().get("content", {})
+
+    latest_state, volume_array = "N/A", content.get("shipment_order_volume_array", [])
+    if volume_array: latest_state = volume_array[0].get("shipment_order_volume_state", "N/A")
+
+    return ('CONSULTADO', latest_state, content.get("created_iso"), content.get("estimated_delivery_date_iso"),
+            content.get("delivery_method_id"), relogio.agora().isoformat(),
+            *planejar_pedido(latest_state, content.get("created_iso"), content.get("estimated_delivery_date_iso")),
+            order_number), banco_dados.comprimir_resposta(response.content)
+
+@metricas.medir_etapa("consulta")
+def consultar_pedidos_criados(conn, max_workers=None, tamanho_lote=None):
+    """
+    Consulta os detalhes de pedidos e calcula e salva as datas de update.
+
+    Os pedidos são reservados (banco_dados.reservar_pedidos) e consultados em lotes de
+    `tamanho_lote`, com até `max_workers` requisições simultâneas; cada lote é gravado
+    com um único executemany/commit, avançando por order_number (keyset). Vários
+    processos podem rodar a etapa ao mesmo tempo: cada pedido é consultado por quem o
+    reservou.
+
+    Com o planejamento inline da criação, só chegam aqui os pedidos da amostra de
+    verificação (cujos campos planejados são conferidos com o GET) e os que a criação
+    não pôde planejar.
+    """
     print("\n--- ETAPA 1: Iniciando consulta de pedidos com status 'CRIADO' ---")
+    max_workers = max_workers or consulta_max_workers()
+    tamanho_lote = tamanho_lote or consulta_tamanho_lote()
+    worker = banco_dados.identificador_worker()
     cursor = conn.cursor()
-    cursor.execute("SELECT order_number FROM pedidos WHERE status_processo = 'CRIADO'")
-    pedidos_para_consultar = [row['order_number'] for row in cursor.fetchall()]
-    if not pedidos_para_consultar: print("Nenhum pedido novo para consultar."); return
-    headers = {'Content-Type': 'application/json', 'api-key': API_KEY, 'platform': 'automacao'}
-    
-    for order_number in pedidos_para_consultar:
-        print(f"Consultando pedido '{order_number}'...")
-        try:
-            response = requests.get(f"https://api.intelipost.com.br/api/v1/shipment_order/{order_number}", headers=headers, timeout=30)
-            response.raise_for_status()
-            content = response.json().get("content", {})
-            
-            latest_state, volume_array = "N/A", content.get("shipment_order_volume_array", [])
-            if volume_array: latest_state = volume_array[0].get("shipment_order_volume_state", "N/A")
-
-            data_criacao_str = content.get("created_iso")
-            data_estimada_str = content.get("estimated_delivery_date_iso")
-            update_dates = {'in_transit': None, 'to_be_delivered': None, 'delivered': None}
-
-            if data_criacao_str and data_estimada_str:
-                data_criacao = datetime.fromisoformat(data_criacao_str).date()
-                data_estimada = datetime.fromisoformat(data_estimada_str).date()
-                total_prazo_dias = max(1, (data_estimada - data_criacao).days)
-
-                t_in_transit = random.uniform(0.15, 0.60)
-                t_delivered = random.uniform(0.80, 1.00)
-
-                dias_para_in_transit = math.ceil(total_prazo_dias * t_in_transit)
-                dias_para_delivered = math.ceil(total_prazo_dias * t_delivered)
-
-                update_dates['in_transit'] = (data_criacao + timedelta(days=dias_para_in_transit)).isoformat()
-                update_dates['delivered'] = (data_criacao + timedelta(days=dias_para_delivered)).isoformat()
-                update_dates['to_be_delivered'] = update_dates['delivered']
-
-            cursor.execute(
-                """UPDATE pedidos SET 
-                   status_processo = ?, latest_volume_state = ?, created_iso = ?, estimated_delivery_date_iso = ?, 
-                   delivery_method_id = ?, full_response_json = ?, data_atualizacao_db = ?,
-                   update_date_in_transit = ?, update_date_to_be_delivered = ?, update_date_delivered = ?
-                   WHERE order_number = ?""",
-                ('CONSULTADO', latest_state, content.get("created_iso"), content.get("estimated_delivery_date_iso"), 
-                 content.get("delivery_method_id"), json.dumps(response.json()), datetime.now(tz_brasilia).isoformat(),
-                 update_dates['in_transit'], update_dates['to_be_delivered'], update_dates['delivered'],
-                 order_number)
-            )
-            conn.commit()
-            print(f"SUCESSO: Pedido '{order_number}' consultado. Datas de entrega futuras calculadas e salvas.")
-        except Exception as e:
-            print(f"ERRO ao consultar o pedido '{order_number}': {e}")
-
-def marcar_pedidos_para_atraso(conn):
-    """Marca novos pedidos para atraso (se a cota de 2% não foi atingida) e define sua nova data de entrega."""
+    total_sucesso = total_erros = 0
+    com_erro = []  # Liberados só no fim, para não serem reservados de novo nesta execução
+    apos = None
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for n_lote in itertools.count(1):
+                with metricas.DB_DURACAO.cronometrar(operacao="selecionar_criados"):
+                    reservados = banco_dados.reservar_pedidos(
+                        conn, "status_processo = 'CRIADO'", {}, "order_number, created_iso, estimated_delivery_date_iso, delivery_method_id", tamanho_lote, apos=apos)
+                if not reservados:
+                    break
+                apos = banco_dados.ultima_chave(reservados, ("order_number",))
+                lote = {row['order_number']: row for row in reservados}
+                futuros = {executor.submit(_consultar_pedido_na_api, order_number): order_number for order_number in lote}
+                atualizacoes, respostas, erros = [], [], []
+                for futuro in as_completed(futuros):
+                    try:
+                        atualizacao, resposta = futuro.result()
+                        if divergentes := _divergencias_planejamento(lote[futuros[futuro]], atualizacao):
+                            print(f"AVISO: Planejamento inline do pedido '{futuros[futuro]}' diverge da API em: {', '.join(divergentes)}.")
+                            metricas.ETAPA_PEDIDOS.incrementar(etapa="consulta", resultado="divergente")
+                        atualizacoes.append((*atualizacao, worker))
+                        respostas.append((futuros[futuro], resposta))
+                    except Exception as e:
+                        erros.append(f"{futuros[futuro]} ({e})")
+                        com_erro.append(futuros[futuro])
+
+                with metricas.DB_DURACAO.cronometrar(operacao="gravar_consultas"), conn:
+                    # Só grava quem ainda detém a reserva (ela pode ter vencido e passado a outro worker)
+                    cursor.executemany(
+                        """UPDATE pedidos SET
+                           status_processo = ?, latest_volume_state = ?, created_iso = ?, estimated_delivery_date_iso = ?,
+                           delivery_method_id = ?, data_atualizacao_db = ?,
+                           update_date_in_transit = ?, update_date_to_be_delivered = ?, update_date_delivered = ?, next_action_date = ?,
+                           reservado_por = NULL, reserva_expira_em = NULL
+                           WHERE order_number = ? AND reservado_por = ?""",
+                        atualizacoes
+                    )
+                    gravados = cursor.rowcount
+                    banco_dados.gravar_respostas(cursor, respostas)
+                if gravados < len(atualizacoes):
+                    print(f"AVISO: {len(atualizacoes) - gravados} pedido(s) do lote {n_lote} não foram gravados: a reserva venceu e passou a outro worker.")
+                total_sucesso += gravados
+                total_erros += len(erros)
+                metricas.ETAPA_PEDIDOS.incrementar(gravados, etapa="consulta", resultado="sucesso")
+                metricas.ETAPA_PEDIDOS.incrementar(len(erros), etapa="consulta", resultado="falha")
+                print(f"Lote {n_lote}: {gravados} pedido(s) consultado(s) e salvo(s), {len(erros)} com erro.")
+                if erros:
+                    print(f"ERRO ao consultar: {'; '.join(erros)}")
+    finally:
+        if com_erro:
+            banco_dados.liberar_pedidos(conn, com_erro)
+
+    if total_sucesso == total_erros == 0: print("Nenhum pedido novo para consultar."); return
+    print(f"SUCESSO: {total_sucesso} pedido(s) consultado(s). Datas de entrega futuras calculadas e salvas. Erros: {total_erros}.")
+
+def _chave_amostra_atraso(semente, peso_proximidade):
+    """
+    Retorna a função SQL de chave da amostragem ponderada sem reposição (Efraimidis-Spirakis):
+    os N pedidos de maior chave formam a amostra. u é derivado de forma determinística do
+    order_number e da semente; o peso é 1 / (1 + dias até a entrega estimada) ** peso_proximidade.
+    """
+    prefixo = f"{semente}:".encode()
+    def chave(order_number, diferenca_dias):
+        u = (zlib.crc32(order_number.encode(), zlib.crc32(prefixo)) + 1) / 4294967297
+        return math.log(u) * (1 + (diferenca_dias or 0)) ** peso_proximidade
+    return chave
+
+def _proximo_dia_util(data_iso):
+    return calendario_padrao().adicionar_dias_uteis(datetime.fromisoformat(data_iso).date(), 1).isoformat()
+
+@metricas.medir_etapa("atraso")
+def marcar_pedidos_para_atraso(conn, percentual=None, peso_proximidade=None, semente=None):
+    """
+    Marca novos pedidos para atraso (se a cota de `percentual`% não foi atingida) e define sua nova data de entrega.
+
+    A seleção e a marcação são feitas num único UPDATE: o SQLite ordena os candidatos pela chave
+    de amostragem e mantém só os N primeiros, sem trazer o conjunto de candidatos para o Python.
+    Com a mesma `semente` (ATRASO_SEMENTE) e o mesmo banco, a seleção se repete. Pedidos com
+    reserva válida (em envio por outro worker na ETAPA 3) não são candidatos.
+    """
+    percentual = atraso_percentual() if percentual is None else percentual
+    peso_proximidade = atraso_peso_proximidade() if peso_proximidade is None else peso_proximidade
+    semente = atraso_semente() if semente is None else semente
+    if semente is None:
+        semente = random.randrange(2**32)
     print("\n--- ETAPA 2: Iniciando marcação de pedidos para simular atraso ---")
     cursor = conn.cursor()
-    cursor.execute("SELECT count(*) FROM pedidos WHERE status_processo = 'CONSULTADO'")
-    total_abertos = cursor.fetchone()[0]
-    cursor.execute("SELECT count(*) FROM pedidos WHERE status_processo = 'CONSULTADO' AND late_delivery_flag = 1")
-    total_ja_atrasados = cursor.fetchone()[0]
+    cursor.execute("SELECT count(*), coalesce(sum(late_delivery_flag = 1), 0) FROM pedidos WHERE status_processo = 'CONSULTADO'")
+    total_abertos, total_ja_atrasados = cursor.fetchone()
     if total_abertos == 0:
         print("Nenhum pedido em aberto para avaliar."); return
-    limite_atraso = int(total_abertos * 0.02)
-    print(f"INFO: Total de pedidos abertos: {total_abertos}. Meta de atrasados (2%): {limite_atraso}. Já marcados: {total_ja_atrasados}.")
+    limite_atraso = int(total_abertos * percentual / 100)
+    print(f"INFO: Total de pedidos abertos: {total_abertos}. Meta de atrasados ({percentual:g}%): {limite_atraso}. Já marcados: {total_ja_atrasados}.")
     if total_ja_atrasados >= limite_atraso:
-        print("A cota de 2% de pedidos em atraso já foi atingida ou superada. Nenhum novo pedido será marcado."); return
+        print(f"A cota de {percentual:g}% de pedidos em atraso já foi atingida ou superada. Nenhum novo pedido será marcado."); return
     num_para_marcar = limite_atraso - total_ja_atrasados
-    print(f"Necessário marcar mais {num_para_marcar} pedido(s) para atingir a meta.")
-    cursor.execute("SELECT * FROM pedidos WHERE status_processo = 'CONSULTADO' AND late_delivery_flag = 0")
-    pedidos_candidatos = cursor.fetchall()
-    if not pedidos_candidatos: print("Nenhum pedido elegível (sem flag de atraso) encontrado."); return
-    hoje = datetime.now(tz_brasilia).date()
-    pedidos_ordenados = []
-    for pedido in pedidos_candidatos:
-        data_estimada_str = pedido["estimated_delivery_date_iso"]
-        if data_estimada_str and data_estimada_str != 'None':
-            diferenca_dias = abs((datetime.fromisoformat(data_estimada_str).date() - hoje).days)
-            pedidos_ordenados.append({'diff': diferenca_dias, 'order_number': pedido['order_number'], 'est_date_iso': data_estimada_str})
-    pedidos_ordenados.sort(key=lambda item: item['diff'])
-    pedidos_selecionados = random.sample(pedidos_ordenados, min(num_para_marcar, len(pedidos_ordenados)))
-    if not pedidos_selecionados: print("Nenhum pedido selecionado para atraso nesta execução."); return
-    pedidos_marcados_list = []
-    for pedido in pedidos_selecionados:
-        data_estimada = datetime.fromisoformat(pedido['est_date_iso']).date()
-        nova_data_entrega = (data_estimada + timedelta(days=1)).isoformat()
-        cursor.execute(
-            "UPDATE pedidos SET late_delivery_flag = 1, update_date_delivered = ?, update_date_to_be_delivered = ?, data_atualizacao_db = ? WHERE order_number = ?",
-            (nova_data_entrega, nova_data_entrega, datetime.now(tz_brasilia).isoformat(), pedido['order_number'])
-        )
-        pedidos_marcados_list.append(pedido['order_number'])
+    print(f"Necessário marcar mais {num_para_marcar} pedido(s) para atingir a meta (semente de amostragem: {semente}).")
+
+    conn.create_function("chave_amostra_atraso", 2, _chave_amostra_atraso(semente, peso_proximidade), deterministic=True)
+    conn.create_function("proximo_dia_util", 1, _proximo_dia_util, deterministic=True)
+    hoje = relogio.agora().date()
+    inicio_update = time.perf_counter()
+    cursor.execute(
+        """UPDATE pedidos SET
+               late_delivery_flag = 1,
+               update_date_delivered = proximo_dia_util(estimated_delivery_date_iso),
+               update_date_to_be_delivered = proximo_dia_util(estimated_delivery_date_iso),
+               data_atualizacao_db = :agora,
+               next_action_date = CASE WHEN latest_volume_state = 'SHIPPED' THEN update_date_in_transit ELSE proximo_dia_util(estimated_delivery_date_iso) END
+           WHERE order_number IN (
+               SELECT order_number FROM pedidos
+               WHERE status_processo = 'CONSULTADO' AND late_delivery_flag = 0
+                 AND estimated_delivery_date_iso IS NOT NULL AND estimated_delivery_date_iso != 'None'
+                 AND (reserva_expira_em IS NULL OR reserva_expira_em < :instante)
+               ORDER BY chave_amostra_atraso(order_number, abs(julianday(substr(estimated_delivery_date_iso, 1, 10)) - julianday(:hoje))) DESC
+               LIMIT :limite
+           )
+           RETURNING order_number""",
+        {"agora": relogio.agora().isoformat(), "hoje": hoje.isoformat(), "limite": num_para_marcar, "instante": time.time()}
+    )
+    total_marcados, exemplos = 0, []
+    for (order_number,) in cursor:
+        total_marcados += 1
+        if len(exemplos) < 10: exemplos.append(order_number)
     conn.commit()
-    print(f"SUCESSO: {len(pedidos_marcados_list)} novos pedidos foram marcados para entrega em atraso: {', '.join(pedidos_marcados_list)}")
+    metricas.DB_DURACAO.observar(time.perf_counter() - inicio_update, operacao="marcar_atraso")
+    metricas.ETAPA_PEDIDOS.incrementar(total_marcados, etapa="atraso", resultado="sucesso")
+    if not total_marcados: print("Nenhum pedido elegível (sem flag de atraso) encontrado."); return
+    print(f"SUCESSO: {total_marcados} novos pedidos foram marcados para entrega em atraso: {', '.join(exemplos)}{' ...' if total_marcados > len(exemplos) else ''}")
+
+def _data_alvo_devida(data_alvo_str, hoje):
+    """Retorna a data alvo se ela já chegou (hoje >= data alvo), senão None."""
+    if data_alvo_str and hoje >= (data_alvo := datetime.fromisoformat(data_alvo_str).date()):
+        return data_alvo
+    return None
 
-def enviar_atualizacoes_de_status(conn):
-    """Processa pedidos 'CONSULTADOS', comparando a data atual com as datas de update salvas."""
+def _horario_evento(data_alvo, hoje, agora, minuto_atrasado, horas_antes):
+    """Eventos atrasados são datados no fim do dia planejado; os do dia, algumas horas antes de agora."""
+    if hoje > data_alvo:
+        return datetime.combine(data_alvo, datetime.min.time()).replace(hour=23, minute=minuto_atrasado, tzinfo=tz_brasilia)
+    return agora - timedelta(hours=horas_antes)
+
+def planejar_eventos(pedido, carrier_codes, hoje, agora):
+    """
+    Percorre as transições de estado do pedido cujas datas planejadas já chegaram e
+    retorna (eventos, estado_final). Todos os eventos devidos vão num único envio.
+    """
+    estado = pedido['latest_volume_state']
+    is_late_order = pedido['late_delivery_flag'] == 1
+    eventos = []
+
+    def evento(codigo, horario):
+        eventos.append({"event_date": horario.isoformat(timespec='seconds'), "original_code": codigo})
+
+    while True:
+        if estado == "SHIPPED":
+            if not (data_alvo := _data_alvo_devida(pedido['update_date_in_transit'], hoje)): break
+            evento(carrier_codes["in_transit"], _horario_evento(data_alvo, hoje, agora, 57, 3))
+            estado = "IN_TRANSIT"
+        elif estado == "IN_TRANSIT" and is_late_order:
+            if not (data_alvo := _data_alvo_devida(pedido['update_date_to_be_delivered'], hoje)): break
+            evento(carrier_codes["to_be_delivered"], _horario_evento(data_alvo, hoje, agora, 58, 2))
+            estado = "TO_BE_DELIVERED"
+        elif estado == "IN_TRANSIT":
+            if not (data_alvo := _data_alvo_devida(pedido['update_date_delivered'], hoje)): break
+            evento(carrier_codes["to_be_delivered"], _horario_evento(data_alvo, hoje, agora, 58, 2))
+            evento(carrier_codes["delivered"], _horario_evento(data_alvo, hoje, agora, 59, 1))
+            estado = "DELIVERED"
+        elif estado == "TO_BE_DELIVERED":
+            if not (data_alvo := _data_alvo_devida(pedido['update_date_delivered'], hoje)): break
+            evento(carrier_codes["delivered"], _horario_evento(data_alvo, hoje, agora, 59, 1))
+            estado = "DELIVERED"
+        else:
+            break
+    return eventos, estado
+
+def _enviar_eventos(order_number, eventos, carrier_headers, limite, renovar_reserva):
+    """
+    Executado pelos workers: envia todos os eventos do pedido num único POST, respeitando o
+    limite da API key. Depois da espera do limitador, a reserva do pedido é renovada
+    (`renovar_reserva`); se ela já passou a outro worker, nada é enviado e o retorno é False.
+    """
+    payload = {"order_number": order_number, "events": eventos}
+    response = requisitar(obter_sessao('intelipost_tracking'), 'POST', tracking_api_url(), 'tracking_events', limite=limite,
+                          confirmar=lambda: renovar_reserva(order_number), headers=carrier_headers, data=json.dumps(payload), timeout=30)
+    if response is None:
+        return False
+    response.raise_for_status()
+    return True
+
+def _gravar_estados(cursor, atualizacoes):
+    """Grava os estados confirmados e libera as reservas; retorna quantos pedidos ainda estavam reservados para este worker."""
+    with metricas.DB_DURACAO.cronometrar(operacao="gravar_estados"):
+        cursor.executemany(
+            """UPDATE pedidos SET status_processo = ?, latest_volume_state = ?, next_action_date = ?, data_atualizacao_db = ?,
+                   reservado_por = NULL, reserva_expira_em = NULL
+               WHERE order_number = ? AND reservado_por = ?""",
+            atualizacoes
+        )
+        gravados = cursor.rowcount
+        cursor.connection.commit()
+    metricas.ETAPA_PEDIDOS.incrementar(gravados, etapa="tracking", resultado="sucesso")
+    if gravados < len(atualizacoes):
+        metricas.ETAPA_PEDIDOS.incrementar(len(atualizacoes) - gravados, etapa="tracking", resultado="reserva_perdida")
+        print(f"AVISO: {len(atualizacoes) - gravados} pedido(s) com eventos enviados não foram gravados: a reserva venceu e passou a outro worker.")
+    return gravados
+
+def _planejar_trabalho(pedido, carriers, hoje, agora):
+    """Retorna (carrier_id, eventos, novo_estado) do pedido, ou None se ele deve ser pulado."""
+    order_number = pedido['order_number']
+    delivery_method_id = str(pedido['delivery_method_id']) # Garante que seja string para a chave do dict
+    carrier_info = carriers.get(delivery_method_id)
+    if not carrier_info:
+        metricas.log_detalhe(f"AVISO: Delivery method ID '{delivery_method_id}' do pedido '{order_number}' não mapeado. Pulando.")
+        return None
+    eventos, estado_final = planejar_eventos(pedido, carrier_info["codes"], hoje, agora)
+    if not eventos:
+        metricas.log_detalhe(f"AVISO: Nenhuma ação definida para o pedido '{order_number}' no estado '{pedido['latest_volume_state']}'.")
+        return None
+    if estado_final == "DELIVERED":
+        status_processo, next_action_date = 'COMPLETO', None
+    else:
+        status_processo = 'CONSULTADO'
+        next_action_date = calcular_next_action_date(estado_final, pedido['late_delivery_flag'], pedido['update_date_in_transit'], pedido['update_date_to_be_delivered'], pedido['update_date_delivered'])
+    return delivery_method_id, eventos, (status_processo, estado_final, next_action_date)
+
+@metricas.medir_etapa("tracking")
+def enviar_atualizacoes_de_status(conn, tamanho_reserva=None, orcamento_segundos=None):
+    """
+    Processa pedidos 'CONSULTADOS' com evento devido: monta um único array de eventos
+    por pedido e os envia agrupados por transportadora, com até
+    TRACKING_MAX_WORKERS_POR_TRANSPORTADORA envios simultâneos por transportadora.
+    Só os pedidos cujo envio foi aceito pela API têm o estado atualizado no banco, e o
+    resumo conta apenas os estados efetivamente gravados.
+
+    As reservas dos pedidos na fila (e dos já enviados, até a gravação em lote) são
+    renovadas a cada metade de RESERVA_DURACAO_SEGUNDOS enquanto esperam o limitador de
+    taxa, e cada envio renova a do seu pedido logo antes do POST: um pedido cuja reserva
+    ainda assim venceu e passou a outro worker é descartado sem envio, de modo que dois
+    workers nunca enviam os mesmos eventos.
+
+    Os pedidos devidos são reservados em lotes de `tamanho_reserva` por prioridade: os
+    mais atrasados primeiro (next_action_date) e, na mesma data, as transições que
+    concluem a entrega (banco_dados.SQL_PRIORIDADE_TRANSICAO), continuando da última
+    chave reservada; um novo lote é reservado quando metade do anterior foi concluída.
+    Várias cópias do script dividem o trabalho sem enviar os mesmos eventos duas vezes.
+
+    Com `orcamento_segundos` (TRACKING_ORCAMENTO_SEGUNDOS), ao fim do orçamento nenhum lote
+    novo é reservado, os envios ainda não iniciados são cancelados e liberados, e o
+    backlog restante é informado.
+    """
     print("\n--- ETAPA 3: Iniciando envio de eventos de tracking ---")
+    tamanho_reserva = tamanho_reserva or tracking_tamanho_lote_reserva()
+    orcamento_segundos = tracking_orcamento_segundos() if orcamento_segundos is None else orcamento_segundos
+    prazo = time.perf_counter() + orcamento_segundos if orcamento_segundos > 0 else None
+    worker = banco_dados.identificador_worker()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM pedidos WHERE status_processo = 'CONSULTADO'")
-    pedidos_para_processar = cursor.fetchall()
-    if not pedidos_para_processar: print("Nenhum pedido no estado 'CONSULTADO' para processar."); return
-    
-    hoje = datetime.now(tz_brasilia).date()
-
-    for pedido in pedidos_para_processar:
-        order_number = pedido['order_number']
-        print(f"\nProcessando pedido '{order_number}' com estado '{pedido['latest_volume_state']}'...")
-        
-        is_late_order = pedido['late_delivery_flag'] == 1
-        agora = datetime.now(tz_brasilia)
-        latest_volume_state = pedido['latest_volume_state']
-        delivery_method_id = str(pedido['delivery_method_id']) # Garante que seja string para a chave do dict
-
-        carrier_info = CARRIER_MAP.get(delivery_method_id)
-
-        if not carrier_info: 
-            print(f"AVISO: Delivery method ID '{delivery_method_id}' não mapeado. Pulando.")
-            continue
-            
-        logistic_api_key = carrier_info["api_key"]
-        carrier_codes = carrier_info["codes"]
-
-        def enviar_evento(evento):
-            payload = {"order_number": order_number, "events": [evento]}
-            headers = {'Content-Type': 'application/json', 'logistic-provider-api-key': logistic_api_key, 'platform': 'automacao'}
-            print(f"Enviando evento '{evento['original_code']}' para o pedido '{order_number}'...")
-            try:
-                response = requests.post(TRACKING_API_URL, headers=headers, data=json.dumps(payload), timeout=30)
-                response.raise_for_status(); return True
-            except Exception as e: print(f"ERRO ao enviar evento: {e}"); return False
-
-        if latest_volume_state == "SHIPPED":
-            data_alvo_str = pedido['update_date_in_transit']
-            if data_alvo_str and hoje >= (data_alvo := datetime.fromisoformat(data_alvo_str).date()):
-                novo_estado, codigo_evento = "IN_TRANSIT", carrier_codes["in_transit"]
-                
-                if hoje > data_alvo:
-                    print(f"INFO: Processando evento de {data_alvo} com atraso.")
-                    event_ts = datetime.combine(data_alvo, datetime.min.time()).replace(hour=23, minute=57, tzinfo=tz_brasilia)
-                else:
-                    event_ts = agora - timedelta(hours=3)
-
-                if enviar_evento({"event_date": event_ts.isoformat(timespec='seconds'), "original_code": codigo_evento}):
-                    cursor.execute("UPDATE pedidos SET latest_volume_state = ?, data_atualizacao_db = ? WHERE order_number = ?", (novo_estado, agora.isoformat(), order_number)); conn.commit()
-                    print(f"Estado do pedido '{order_number}' atualizado para '{novo_estado}'.")
-            else: 
-                print(f"INFO: Aguardando data planejada para mover para 'IN_TRANSIT' ({data_alvo_str}).")
-        
-        elif latest_volume_state == "IN_TRANSIT":
-            if is_late_order:
-                data_alvo_str = pedido['update_date_to_be_delivered']
-                if data_alvo_str and hoje >= (data_alvo := datetime.fromisoformat(data_alvo_str).date()):
-                    novo_estado, codigo_evento = "TO_BE_DELIVERED", carrier_codes["to_be_delivered"]
-                    if hoje > data_alvo:
-                        event_ts = datetime.combine(data_alvo, datetime.min.time()).replace(hour=23, minute=58, tzinfo=tz_brasilia)
-                    else:
-                        event_ts = agora - timedelta(hours=2)
-                    if enviar_evento({"event_date": event_ts.isoformat(timespec='seconds'), "original_code": codigo_evento}):
-                        cursor.execute("UPDATE pedidos SET latest_volume_state = ?, data_atualizacao_db = ? WHERE order_number = ?", (novo_estado, agora.isoformat(), order_number)); conn.commit()
-                        print(f"Estado do pedido '{order_number}' atualizado para '{novo_estado}'.")
-                else: 
-                    print(f"INFO: Pedido em atraso aguardando data planejada para 'TO_BE_DELIVERED' ({data_alvo_str}).")
-            else:
-                data_alvo_str = pedido['update_date_delivered']
-                if data_alvo_str and hoje >= (data_alvo := datetime.fromisoformat(data_alvo_str).date()):
-                    print("INFO: Pedido no prazo. Data alvo atingida. Enviando eventos finais...")
-                    codigo_em_rota, codigo_entregue = carrier_codes["to_be_delivered"], carrier_codes["delivered"]
-                    
-                    if hoje > data_alvo:
-                        event_ts_em_rota = datetime.combine(data_alvo, datetime.min.time()).replace(hour=23, minute=58, tzinfo=tz_brasilia)
-                        event_ts_entregue = datetime.combine(data_alvo, datetime.min.time()).replace(hour=23, minute=59, tzinfo=tz_brasilia)
-                    else:
-                        event_ts_em_rota = agora - timedelta(hours=2)
-                        event_ts_entregue = agora - timedelta(hours=1)
-
-                    if enviar_evento({"event_date": event_ts_em_rota.isoformat(timespec='seconds'), "original_code": codigo_em_rota}) and \
-                       enviar_evento({"event_date": event_ts_entregue.isoformat(timespec='seconds'), "original_code": codigo_entregue}):
-                        cursor.execute("UPDATE pedidos SET status_processo = ?, latest_volume_state = ?, data_atualizacao_db = ? WHERE order_number = ?", ('COMPLETO', 'DELIVERED', agora.isoformat(), order_number)); conn.commit()
-                        print(f"SUCESSO: Pedido '{order_number}' finalizado e movido para 'COMPLETO'.")
-                else: 
-                    print(f"INFO: Aguardando data planejada para eventos finais ({data_alvo_str}).")
-
-        elif latest_volume_state == "TO_BE_DELIVERED":
-            data_alvo_str = pedido['update_date_delivered']
-            if data_alvo_str and hoje >= (data_alvo := datetime.fromisoformat(data_alvo_str).date()):
-                codigo_entregue = carrier_codes["delivered"]
-                
-                if hoje > data_alvo:
-                    event_ts = datetime.combine(data_alvo, datetime.min.time()).replace(hour=23, minute=59, tzinfo=tz_brasilia)
+    agora = relogio.agora()
+    hoje = agora.date()
+    carriers = carrier_map()
+
+    # Renovações de reserva feitas pelas threads dos executores: conexão própria, serializada
+    conn_reservas = banco_dados.conectar_db(configuracao.db_file(), compartilhada=True)
+    lock_reservas = threading.Lock()
+
+    def renovar_reserva(order_number):
+        with lock_reservas, metricas.DB_DURACAO.cronometrar(operacao="renovar_reserva"):
+            return banco_dados.renovar_reservas(conn_reservas, [order_number]) == 1
+
+    intervalo_renovacao = banco_dados.reserva_duracao_segundos() / 2
+    renovar_fila_em = time.perf_counter() + intervalo_renovacao
+
+    executores, futuros = {}, {}
+    enviados = atualizados = falhas = pulados = adiados = perdidos = 0
+    atualizacoes = []
+    a_liberar = []  # Pulados, com falha e adiados: liberados só no fim, para não serem reservados de novo nesta execução
+    esgotado = orcamento_esgotado = False
+    chave, apos = ("next_action_date", "prioridade_transicao", "order_number"), None
+
+    def reservar_e_enviar():
+        """Reserva o próximo lote de pedidos devidos, planeja os eventos e os submete; retorna quantos foram reservados."""
+        nonlocal pulados, apos
+        with metricas.DB_DURACAO.cronometrar(operacao="selecionar_devidos"):
+            pedidos = banco_dados.reservar_pedidos(
+                conn, "status_processo = 'CONSULTADO' AND next_action_date <= :hoje", {"hoje": hoje.isoformat()},
+                """order_number, next_action_date, prioridade_transicao, latest_volume_state, late_delivery_flag, delivery_method_id,
+                   update_date_in_transit, update_date_to_be_delivered, update_date_delivered""",
+                tamanho_reserva, chave=chave, apos=apos)
+        if pedidos:
+            apos = banco_dados.ultima_chave(pedidos, chave)
+        por_carrier = {}
+        for pedido in pedidos:
+            if (trabalho := _planejar_trabalho(pedido, carriers, hoje, agora)) is None:
+                metricas.ETAPA_PEDIDOS.incrementar(etapa="tracking", resultado="pulado")
+                pulados += 1
+                a_liberar.append(pedido['order_number'])
+                continue
+            carrier_id, eventos, novo_estado = trabalho
+            por_carrier[carrier_id] = por_carrier.get(carrier_id, 0) + 1
+            if carrier_id not in executores:
+                executores[carrier_id] = ThreadPoolExecutor(max_workers=carriers[carrier_id]["max_workers"])
+            carrier_info = carriers[carrier_id]
+            futuro = executores[carrier_id].submit(_enviar_eventos, pedido['order_number'], eventos, carrier_info["headers"], carrier_info["limite"], renovar_reserva)
+            futuros[futuro] = (carrier_id, pedido['order_number'], eventos, novo_estado)
+        for carrier_id, quantidade in sorted(por_carrier.items()):
+            print(f"INFO: Transportadora '{carrier_id}': {quantidade} pedido(s) com eventos a enviar.")
+        return len(pedidos)
+
+    try:
+        while True:
+            if prazo is not None and not orcamento_esgotado and time.perf_counter() >= prazo:
+                esgotado = orcamento_esgotado = True
+                # Os envios em andamento terminam; os que ainda estão na fila voltam para o backlog
+                for futuro in [f for f in futuros if f.cancel()]:
+                    a_liberar.append(futuros.pop(futuro)[1])
+                    adiados += 1
+                metricas.ETAPA_PEDIDOS.incrementar(adiados, etapa="tracking", resultado="adiado")
+            if not esgotado and len(futuros) <= tamanho_reserva // 2:
+                esgotado = reservar_e_enviar() == 0
+            if not futuros:
+                if esgotado:
+                    break
+                continue
+            if time.perf_counter() >= renovar_fila_em:
+                with lock_reservas, metricas.DB_DURACAO.cronometrar(operacao="renovar_reservas"):
+                    # Na fila, em envio e já enviados aguardando a gravação em lote
+                    banco_dados.renovar_reservas(conn_reservas, [item[1] for item in futuros.values()] + [item[4] for item in atualizacoes])
+                renovar_fila_em = time.perf_counter() + intervalo_renovacao
+            restante = renovar_fila_em - time.perf_counter()
+            if prazo is not None and not orcamento_esgotado:
+                restante = min(restante, prazo - time.perf_counter())
+            concluidos, _ = wait(futuros, timeout=max(0.0, restante), return_when=FIRST_COMPLETED)
+            for futuro in concluidos:
+                carrier_id, order_number, eventos, (status_processo, estado_final, next_action_date) = futuros.pop(futuro)
+                codigos = ', '.join(e['original_code'] for e in eventos)
+                try:
+                    enviado = futuro.result()
+                except Exception as e:
+                    falhas += 1
+                    a_liberar.append(order_number)
+                    print(f"ERRO ao enviar eventos ({codigos}) do pedido '{order_number}': {e}")
+                    metricas.ETAPA_PEDIDOS.incrementar(etapa="tracking", resultado="falha")
+                    continue
+                if not enviado:
+                    # A reserva passou a outro worker enquanto o pedido esperava na fila
+                    perdidos += 1
+                    metricas.ETAPA_PEDIDOS.incrementar(etapa="tracking", resultado="reserva_perdida")
+                    metricas.log_detalhe(f"AVISO: Reserva do pedido '{order_number}' perdida antes do envio; eventos ({codigos}) não enviados.")
+                    continue
+                enviados += 1
+                metricas.EVENTOS_TRACKING.incrementar(len(eventos), carrier=carrier_id)
+                atualizacoes.append((status_processo, estado_final, next_action_date, relogio.agora().isoformat(), order_number, worker))
+                if status_processo == 'COMPLETO':
+                    metricas.log_detalhe(f"SUCESSO: Eventos ({codigos}) enviados. Pedido '{order_number}' finalizado e movido para 'COMPLETO'.")
                 else:
-                    event_ts = agora - timedelta(hours=1)
-                
-                if enviar_evento({"event_date": event_ts.isoformat(timespec='seconds'), "original_code": codigo_entregue}):
-                    cursor.execute("UPDATE pedidos SET status_processo = ?, latest_volume_state = ?, data_atualizacao_db = ? WHERE order_number = ?", ('COMPLETO', 'DELIVERED', agora.isoformat(), order_number)); conn.commit()
-                    print(f"SUCESSO: Pedido '{order_number}' finalizado e movido para 'COMPLETO'.")
-            else:
-                print(f"INFO: Aguardando data planejada para finalizar entrega ({data_alvo_str}).")
-        else:
-            print(f"AVISO: Nenhuma ação definida para o estado '{latest_volume_state}'.")
+                    metricas.log_detalhe(f"Eventos ({codigos}) enviados. Estado do pedido '{order_number}' atualizado para '{estado_final}'.")
+                if len(atualizacoes) >= tracking_tamanho_lote_gravacao():
+                    gravados = _gravar_estados(cursor, atualizacoes)
+                    atualizados += gravados
+                    perdidos += len(atualizacoes) - gravados
+                    atualizacoes = []
+    finally:
+        for executor in executores.values():
+            executor.shutdown(wait=True)
+        if atualizacoes:
+            gravados = _gravar_estados(cursor, atualizacoes)
+            atualizados += gravados
+            perdidos += len(atualizacoes) - gravados
+        if a_liberar:
+            banco_dados.liberar_pedidos(conn, a_liberar)
+        conn_reservas.close()
+
+    if orcamento_esgotado:
+        restantes, mais_antigo = conn.execute(
+            "SELECT count(*), min(next_action_date) FROM pedidos WHERE status_processo = 'CONSULTADO' AND next_action_date <= ?", (hoje.isoformat(),)
+        ).fetchone()
+        print(f"AVISO: Orçamento de {orcamento_segundos:g}s esgotado: {adiados} envio(s) adiado(s); "
+              f"{restantes} pedido(s) com evento devido ficam para a próxima execução (data devida mais antiga: {mais_antigo or '-'}).")
+    elif enviados == falhas == pulados == perdidos == 0: print("Nenhum pedido no estado 'CONSULTADO' com evento devido hoje."); return
+    print(f"\n--- Envio de tracking finalizado: {atualizados} pedido(s) atualizado(s), {falhas} com falha, {pulados} pulado(s), {adiados} adiado(s), "
+          f"{perdidos} com reserva perdida para outro worker. ---")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consulta pedidos criados, marca atrasos e envia eventos de tracking.")
+    parser.add_argument("--etapas", nargs="+", choices=ETAPAS, default=list(ETAPAS), help="Etapas a executar (padrão: todas, nesta ordem).")
+    parser.add_argument("--orcamento-segundos", type=float, help="Tempo máximo da ETAPA 3 (padrão: TRACKING_ORCAMENTO_SEGUNDOS; 0 = sem limite).")
+    parser.add_argument("--verboso", action="store_true", help="Imprime uma linha por pedido (LOG_NIVEL=detalhado).")
+    args = parser.parse_args()
+    if args.verboso:
+        metricas.definir_nivel_log('detalhado')
+
     print("="*80); print("====== SCRIPT DE CONSULTA E GESTÃO DE STATUS DE PEDIDOS (VERSÃO SQLite) ======"); print("="*80)
     db_conn = None
     try:
+        metricas.iniciar_servidor_http()
         setup_database()
         db_conn = conectar_db()
-        consultar_pedidos_criados(db_conn)
-        marcar_pedidos_para_atraso(db_conn)
-        enviar_atualizacoes_de_status(db_conn)
+        if "consulta" in args.etapas:
+            consultar_pedidos_criados(db_conn)
+        if "atraso" in args.etapas:
+            marcar_pedidos_para_atraso(db_conn)
+        if "tracking" in args.etapas:
+            enviar_atualizacoes_de_status(db_conn, orcamento_segundos=args.orcamento_segundos)
     except Exception as e:
         print(f"\nERRO CRÍTICO NA EXECUÇÃO: {e}")
     finally:
         if db_conn: db_conn.close()
+        fechar_sessoes()
+        metricas.gravar_arquivo()
         print("\n==================== EXECUÇÃO CONCLUÍDA ====================")
\ No newline at end of file
@@ -0,0 +1,145 @@
+# limitador_taxa.py
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+import configuracao
+
+# Limitador de taxa (token bucket) por API key, compartilhado entre processos pela tabela
+# limites_taxa de um SQLite próprio (LIMITE_TAXA_DB_FILE, separado do banco dos pedidos, para
+# que as requisições não esperem atrás da limpeza, do VACUUM ou das gravações em lote): cada
+# tentativa (inclusive as repetições automáticas, ver cliente_http) reserva um token numa
+# transação IMMEDIATE curta e, se o balde está vazio, espera (fora da transação) até a vez dela.
+#    - A chave é um hash da API key (a chave em si não é gravada); carriers que usam a
+#      mesma API key dividem o mesmo balde.
+#    - Ao receber 429 a taxa do balde cai pela metade (até LIMITE_TAXA_MINIMA_FRACAO da
+#      configurada) e o balde fica vazio até o Retry-After; depois a taxa volta linearmente
+#      à configurada em LIMITE_TAXA_RECUPERACAO_SEGUNDOS.
+# Taxa 0 desativa o limite para a chave.
+
+# ==============================================================================
+# --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
+# ==============================================================================
+# Requisições por segundo: API principal da Intelipost, cada transportadora
+# (sobrescrito por CARRIER_<id>_RPS) e BrasilAPI
+limite_taxa_intelipost_rps = configuracao.parametro('LIMITE_TAXA_INTELIPOST_RPS', '20', float)
+limite_taxa_carrier_rps = configuracao.parametro('LIMITE_TAXA_CARRIER_RPS', '10', float)
+limite_taxa_brasilapi_rps = configuracao.parametro('LIMITE_TAXA_BRASILAPI_RPS', '0', float)
+# Tamanho do balde, em segundos de taxa (rajada máxima após um período ocioso)
+limite_taxa_rajada_segundos = configuracao.parametro('LIMITE_TAXA_RAJADA_SEGUNDOS', '1', float)
+limite_taxa_minima_fracao = configuracao.parametro('LIMITE_TAXA_MINIMA_FRACAO', '0.1', float)
+limite_taxa_recuperacao_segundos = configuracao.parametro('LIMITE_TAXA_RECUPERACAO_SEGUNDOS', '30', float)
+# Arquivo dos baldes; padrão: '<banco dos pedidos>-limites_taxa.db', ao lado dele
+limite_taxa_db_file = configuracao.parametro('LIMITE_TAXA_DB_FILE')
+# As transações do limitador duram microssegundos: uma espera longa indica outro problema
+LIMITE_TAXA_BUSY_TIMEOUT_SEGUNDOS = 5
+
+def arquivo_limites_padrao():
+    return limite_taxa_db_file() or f"{os.path.splitext(configuracao.db_file())[0]}-limites_taxa.db"
+
+def chave_limite(api_key):
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+# ==============================================================================
+# --- LIMITADOR (SQLite) ---
+# ==============================================================================
+class LimitadorTaxa:
+    """
+    Token bucket persistido num SQLite próprio (`db_file`). Uma única conexão por processo,
+    protegida por lock; a coordenação entre processos vem do BEGIN IMMEDIATE de cada reserva.
+    """
+
+    def __init__(self, db_file=None):
+        self.db_file = db_file
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _conexao(self):
+        if self._conn is None:
+            db_file = self.db_file or arquivo_limites_padrao()
+            if os.path.dirname(db_file):
+                os.makedirs(os.path.dirname(db_file), exist_ok=True)
+            conn = sqlite3.connect(db_file, timeout=LIMITE_TAXA_BUSY_TIMEOUT_SEGUNDOS, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            # Os baldes se recompõem sozinhos: perder as últimas reservas numa queda não importa
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS limites_taxa (
+                    chave TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    taxa REAL NOT NULL,
+                    atualizado_em REAL NOT NULL
+                )
+            ''')
+            self._conn = conn
+        return self._conn
+
+    def _atualizar(self, chave, taxa_maxima, alterar):
+        """Lê o balde de `chave` (recarregado até agora) numa transação IMMEDIATE, aplica `alterar` e grava."""
+        agora = time.time()
+        with self._lock:
+            conn = self._conexao()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, taxa, atualizado_em FROM limites_taxa WHERE chave = ?", (chave,)).fetchone()
+                capacidade = max(1.0, taxa_maxima * limite_taxa_rajada_segundos())
+                if row is None:
+                    tokens, taxa = capacidade, taxa_maxima
+                else:
+                    tokens, taxa, atualizado_em = row
+                    decorrido = max(0.0, agora - atualizado_em)
+                    tokens = min(capacidade, tokens + decorrido * taxa)
+                    taxa = min(taxa_maxima, taxa + taxa_maxima * decorrido / limite_taxa_recuperacao_segundos())
+                tokens, taxa, resultado = alterar(tokens, taxa)
+                conn.execute(
+                    "INSERT OR REPLACE INTO limites_taxa (chave, tokens, taxa, atualizado_em) VALUES (?, ?, ?, ?)",
+                    (chave, tokens, taxa, agora)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return resultado
+
+    def aguardar(self, chave, taxa_maxima):
+        """Reserva um token de `chave`, dormindo até ele estar disponível. Retorna os segundos esperados."""
+        if taxa_maxima <= 0:
+            return 0.0
+        # O token é reservado mesmo com o balde vazio (saldo negativo): quem chega depois
+        # espera a sua vez na fila, sem nova consulta ao banco
+        espera = self._atualizar(chave, taxa_maxima, lambda tokens, taxa: (tokens - 1, taxa, max(0.0, (1 - tokens) / taxa)))
+        if espera > 0:
+            time.sleep(espera)
+        return espera
+
+    def registrar_429(self, chave, taxa_maxima, retry_after=None):
+        """Reduz a taxa de `chave` pela metade e esvazia o balde pelo Retry-After (segundos)."""
+        if taxa_maxima <= 0:
+            return
+        def reduzir(tokens, taxa):
+            nova_taxa = max(taxa_maxima * limite_taxa_minima_fracao(), taxa / 2)
+            return min(tokens, -(retry_after or 0) * nova_taxa), nova_taxa, None
+        self._atualizar(chave, taxa_maxima, reduzir)
+
+    def fechar(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+@lru_cache(maxsize=None)
+def limite_intelipost():
+    """(chave, taxa) da API key principal, usada por cotação, criação e consulta de pedidos."""
+    return chave_limite(configuracao.api_key()), limite_taxa_intelipost_rps()
+
+def limite_brasilapi():
+    """(chave, taxa) da BrasilAPI, que não usa API key."""
+    return 'brasilapi', limite_taxa_brasilapi_rps()
+
+@lru_cache(maxsize=None)
+def limitador_padrao():
+    """Limitador compartilhado pelo processo, criado na primeira chamada."""
+    return LimitadorTaxa()
@@ -2,89 +2,240 @@
 
 import sqlite3
 import os
-from datetime import datetime, timedelta
+import gzip
+import json
+import zlib
+import argparse
+from datetime import timedelta
 from zoneinfo import ZoneInfo
-from dotenv import load_dotenv # ALTERAÇÃO: Importado para carregar variáveis de ambiente
+import banco_dados
+import configuracao
+import metricas
+import relogio
+from banco_dados import conectar_db
 
 # Deleta pedidos que:
 #    - O campo status_processo é igual a 'COMPLETO'.
 #    - A data em update_date_delivered é igual ou anterior à data de corte (data atual)
+# Os pedidos removidos são arquivados em JSONL.gz, um arquivo por dia de entrega. Cada lote
+# é gravado primeiro num arquivo '.pendente' e só entra no arquivo do dia depois do commit
+# do DELETE; pendências de uma execução interrompida são resolvidas na seguinte, de modo
+# que nenhum lote é arquivado duas vezes (nem perdido).
 
 # ==============================================================================
 # --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
 # ==============================================================================
-# ALTERAÇÃO: Carrega as variáveis de ambiente do arquivo .env
-load_dotenv()
-
 # --- BANCO DE DADOS ---
-# ALTERAÇÃO: Busca o caminho do DB da variável de ambiente
-DB_FILE = os.getenv('DB_FILE_PATH')
-
-# Verificação para garantir que a variável foi carregada
-if not DB_FILE:
-    raise ValueError("Erro: A variável de ambiente DB_FILE_PATH deve ser definida.")
+# DB_FILE_PATH é lida (e validada) no primeiro uso, via configuracao.db_file()
 
 # --- FUSO HORÁRIO ---
 tz_brasilia = ZoneInfo("America/Sao_Paulo")
 
+# --- LIMPEZA EM LOTES, ARQUIVAMENTO E RECUPERAÇÃO DE ESPAÇO ---
+limpeza_tamanho_lote = configuracao.parametro('LIMPEZA_TAMANHO_LOTE', '1000', int)
+limpeza_arquivar = configuracao.parametro('LIMPEZA_ARQUIVAR', '1', lambda valor: valor == '1')
+# Padrão: subdiretório 'arquivo' ao lado do banco (ver diretorio_arquivo)
+limpeza_dir_arquivo = configuracao.parametro('LIMPEZA_DIR_ARQUIVO')
+limpeza_paginas_vacuum_incremental = configuracao.parametro('LIMPEZA_PAGINAS_VACUUM_INCREMENTAL', '2000', int)
+# Fração de páginas livres a partir da qual o VACUUM completo é executado
+limpeza_limite_freelist_vacuum = configuracao.parametro('LIMPEZA_LIMITE_FREELIST_VACUUM', '0.25', float)
+
+# Lote gravado antes do commit do DELETE e lote já removido, em acréscimo ao arquivo do dia
+SUFIXO_PENDENTE = ".pendente"
+SUFIXO_CONFIRMADO = ".confirmado"
+
+
+# ==============================================================================
+# --- FUNÇÕES AUXILIARES DE ARQUIVAMENTO E VACUUM ---
+# ==============================================================================
+def diretorio_arquivo():
+    return limpeza_dir_arquivo() or os.path.join(os.path.dirname(configuracao.db_file()), 'arquivo')
+
+def _fsync_escrita(arquivo):
+    arquivo.flush()
+    os.fsync(arquivo.fileno())
+
+def _arquivar_lote(pedidos, respostas, dir_arquivo):
+    """
+    Grava os pedidos, por dia de entrega, em 'pedidos-AAAA-MM-DD.jsonl.gz.pendente' (um
+    membro gzip por arquivo) e retorna os caminhos; o lote só passa aos arquivos do dia
+    em _confirmar_pendente, depois do commit do DELETE.
+    """
+    por_dia = {}
+    for pedido in pedidos:
+        registro = {k: pedido[k] for k in pedido.keys() if k != 'full_response_json'}
+        payload = respostas.get(pedido['order_number'])
+        registro['resposta_completa'] = json.loads(zlib.decompress(payload)) if payload is not None else None
+        por_dia.setdefault((pedido['update_date_delivered'] or 'sem-data')[:10], []).append(registro)
+    os.makedirs(dir_arquivo, exist_ok=True)
+    pendentes = []
+    for dia, registros in por_dia.items():
+        caminho = os.path.join(dir_arquivo, f"pedidos-{dia}.jsonl.gz{SUFIXO_PENDENTE}")
+        with open(caminho, 'wb') as arquivo_bruto:
+            with gzip.GzipFile(fileobj=arquivo_bruto, mode='wb') as arquivo:
+                for registro in registros:
+                    arquivo.write(json.dumps(registro, ensure_ascii=False).encode('utf-8') + b"\n")
+            _fsync_escrita(arquivo_bruto)
+        pendentes.append(caminho)
+    return pendentes
+
+def _acrescentar(destino, tamanho_original, origem):
+    """Trunca `destino` em `tamanho_original` (desfaz um acréscimo interrompido) e acrescenta `origem`."""
+    with open(destino, 'ab') as arquivo:
+        arquivo.truncate(tamanho_original)
+        with open(origem, 'rb') as lote:
+            arquivo.write(lote.read())
+        _fsync_escrita(arquivo)
+    os.remove(origem)
+
+def _confirmar_pendente(caminho_pendente):
+    """
+    Acrescenta um lote já removido do banco ao arquivo do dia (um gzip com vários membros
+    continua legível como um único stream). O pendente é antes renomeado para
+    '<arquivo>.<tamanho>.confirmado', para que um acréscimo interrompido seja refeito do ponto certo.
+    """
+    destino = caminho_pendente[:-len(SUFIXO_PENDENTE)]
+    tamanho = os.path.getsize(destino) if os.path.exists(destino) else 0
+    confirmado = f"{destino}.{tamanho}{SUFIXO_CONFIRMADO}"
+    os.replace(caminho_pendente, confirmado)
+    _acrescentar(destino, tamanho, confirmado)
+
+def _resolver_pendencias(conn, dir_arquivo):
+    """
+    Conclui o arquivamento de uma execução interrompida: lotes confirmados são acrescentados;
+    um lote pendente é confirmado se o DELETE dele chegou ao banco (nenhum dos pedidos
+    existe mais) e descartado caso contrário (os pedidos serão arquivados de novo).
+    """
+    if not os.path.isdir(dir_arquivo):
+        return
+    for nome in sorted(os.listdir(dir_arquivo)):
+        caminho = os.path.join(dir_arquivo, nome)
+        if nome.endswith(SUFIXO_CONFIRMADO):
+            destino, tamanho = nome[:-len(SUFIXO_CONFIRMADO)].rsplit('.', 1)
+            _acrescentar(os.path.join(dir_arquivo, destino), int(tamanho), caminho)
+            print(f"INFO: Arquivamento interrompido de '{destino}' concluído.")
+        elif nome.endswith(SUFIXO_PENDENTE):
+            with gzip.open(caminho, 'rt', encoding='utf-8') as arquivo:
+                numeros = [json.loads(linha)['order_number'] for linha in arquivo]
+            marcadores = ','.join('?' * len(numeros))
+            if conn.execute(f"SELECT 1 FROM pedidos WHERE order_number IN ({marcadores}) LIMIT 1", numeros).fetchone():
+                os.remove(caminho)
+                print(f"INFO: Lote pendente '{nome}' descartado: os pedidos não foram removidos e serão arquivados de novo.")
+            else:
+                _confirmar_pendente(caminho)
+                print(f"INFO: Lote pendente '{nome}' (já removido do banco) incluído no arquivo.")
+
+def _recuperar_espaco(conn):
+    """
+    Devolve ao sistema de arquivos as páginas livres. Em auto_vacuum=INCREMENTAL libera até
+    LIMPEZA_PAGINAS_VACUUM_INCREMENTAL páginas por execução; o VACUUM completo (que trava o
+    banco) só roda quando a fração de páginas livres passa de LIMPEZA_LIMITE_FREELIST_VACUUM.
+    """
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    paginas_livres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    total_paginas = conn.execute("PRAGMA page_count").fetchone()[0]
+    fracao_livre = paginas_livres / total_paginas if total_paginas else 0
+    print(f"INFO: Páginas livres: {paginas_livres} de {total_paginas} ({fracao_livre:.1%}).")
+
+    if fracao_livre > limpeza_limite_freelist_vacuum():
+        print("\nINFO: Limite de páginas livres atingido. Reorganizando o banco de dados com VACUUM...")
+        # O VACUUM também converte bancos antigos para auto_vacuum=INCREMENTAL
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        with metricas.DB_DURACAO.cronometrar(operacao="vacuum"):
+            conn.execute("VACUUM")
+        print("INFO: Reorganização concluída.")
+    elif auto_vacuum == 2 and paginas_livres:
+        with metricas.DB_DURACAO.cronometrar(operacao="vacuum_incremental"):
+            conn.execute(f"PRAGMA incremental_vacuum({limpeza_paginas_vacuum_incremental()})").fetchall()
+        print(f"INFO: VACUUM incremental liberou até {limpeza_paginas_vacuum_incremental()} página(s).")
 
 # ==============================================================================
 # --- FUNÇÃO DE LIMPEZA ---
 # ==============================================================================
 
-def limpar_pedidos_antigos():
+@metricas.medir_etapa("limpeza")
+def limpar_pedidos_antigos(tamanho_lote=None, arquivar=None, conn=None):
     """
-    Deleta pedidos da base de dados que foram concluídos e, em seguida,
-    reorganiza o arquivo do banco de dados.
+    Deleta pedidos da base de dados que foram concluídos, em lotes de `tamanho_lote`
+    com uma transação curta por lote, arquivando cada lote antes de removê-lo, e em
+    seguida recupera o espaço do arquivo do banco de dados.
+
+    Se `conn` for informada (serviço contínuo), o banco já está configurado e a
+    conexão não é fechada ao final.
     """
-    conn = None
+    tamanho_lote = tamanho_lote or limpeza_tamanho_lote()
+    arquivar = limpeza_arquivar() if arquivar is None else arquivar
+    conexao_propria = conn is None
+    db_file = configuracao.db_file()
+    dir_arquivo = diretorio_arquivo()
     # Garante que o diretório para o DB exista, caso contrário, a conexão falhará
-    db_dir = os.path.dirname(DB_FILE)
-    if db_dir and not os.path.exists(db_dir):
+    db_dir = os.path.dirname(db_file)
+    if conexao_propria and db_dir and not os.path.exists(db_dir):
         print(f"INFO: O diretório do banco de dados '{db_dir}' não existe. Nada a limpar.")
         return
         
-    if not os.path.exists(DB_FILE):
-        print(f"INFO: O arquivo do banco de dados '{DB_FILE}' não foi encontrado. Nada a limpar.")
+    if conexao_propria and not os.path.exists(db_file):
+        print(f"INFO: O arquivo do banco de dados '{db_file}' não foi encontrado. Nada a limpar.")
         return
 
     try:
-        conn = sqlite3.connect(DB_FILE)
+        if conexao_propria:
+            banco_dados.setup_database(db_file)
+            conn = conectar_db(db_file)
         cursor = conn.cursor()
 
         # 1. Calcular a data de corte (data de hoje)
-        hoje = datetime.now(tz_brasilia).date()
+        hoje = relogio.agora().date()
         data_corte_str = hoje.isoformat()
+        # Comparação direta com a coluna (sem date()) para usar o índice (status_processo, update_date_delivered)
+        limite_exclusivo_str = (hoje + timedelta(days=1)).isoformat()
 
         print(f"INFO: A data de corte para exclusão é: {data_corte_str}")
         print("INFO: Pedidos completos entregues nesta data ou antes serão removidos.")
+        if arquivar:
+            print(f"INFO: Pedidos removidos serão arquivados em '{dir_arquivo}'.")
+        _resolver_pendencias(conn, dir_arquivo)
 
-        # 2. Executar o comando DELETE com base nos critérios
-        cursor.execute(
-            """
-            DELETE FROM pedidos
-            WHERE
-                status_processo = 'COMPLETO'
-                AND date(update_date_delivered) <= ?
-            """,
-            (data_corte_str,)
-        )
-
-        registros_deletados = cursor.rowcount
-        
-        # 3. Confirma a transação de DELETE (mesmo que nada tenha sido deletado)
-        conn.commit()
+        # 2. Remove (e arquiva) em lotes, cada um na sua própria transação
+        #    Páginas por keyset de (update_date_delivered, order_number): cada lote começa onde o anterior parou
+        registros_deletados = 0
+        lotes = banco_dados.iterar_lotes(
+            conn, "status_processo = 'COMPLETO' AND update_date_delivered < :corte", {"corte": limite_exclusivo_str},
+            "*", tamanho_lote, chave=("update_date_delivered", "order_number"))
+        while True:
+            with metricas.DB_DURACAO.cronometrar(operacao="selecionar_lote_limpeza"):
+                lote = next(lotes, None)
+            if lote is None:
+                break
+            numeros = [(pedido['order_number'],) for pedido in lote]
+
+            pendentes = []
+            if arquivar:
+                with metricas.DB_DURACAO.cronometrar(operacao="arquivar_lote"):
+                    marcadores = ','.join('?' * len(numeros))
+                    respostas = dict(cursor.execute(
+                        f"SELECT order_number, payload_zlib FROM pedidos_resposta WHERE order_number IN ({marcadores})",
+                        [n for (n,) in numeros]
+                    ).fetchall())
+                    pendentes = _arquivar_lote(lote, respostas, dir_arquivo)
+
+            # 3. Confirma a transação de DELETE do lote (pedidos_resposta sai em cascata)
+            with metricas.DB_DURACAO.cronometrar(operacao="excluir_lote"):
+                cursor.executemany("DELETE FROM pedidos WHERE order_number = ?", numeros)
+                conn.commit()
+            for caminho in pendentes:
+                _confirmar_pendente(caminho)
+            registros_deletados += len(numeros)
+            metricas.ETAPA_PEDIDOS.incrementar(len(numeros), etapa="limpeza", resultado="sucesso")
+            print(f"INFO: Lote de {len(numeros)} pedido(s) removido(s). Total até agora: {registros_deletados}.")
 
         if registros_deletados > 0:
             print(f"\nSUCESSO: {registros_deletados} pedido(s) antigo(s) foram removidos do banco de dados.")
         else:
             print("\nINFO: Nenhum pedido antigo correspondeu aos critérios para limpeza.")
 
-        # --- Executa o VACUUM incondicionalmente ---
-        print("\nINFO: Reorganizando o banco de dados para otimizar o arquivo...")
-        cursor.execute("VACUUM")
-        conn.commit() # VACUUM precisa de um commit em algumas configurações
-        print("INFO: Reorganização concluída.")
+        # 4. Recupera espaço de forma incremental; VACUUM completo só acima do limite
+        _recuperar_espaco(conn)
 
     except sqlite3.Error as e:
         print(f"\nERRO: Ocorreu um erro no banco de dados: {e}")
@@ -93,13 +244,20 @@ def limpar_pedidos_antigos():
     except Exception as e:
         print(f"\nERRO: Ocorreu um erro inesperado: {e}")
     finally:
-        if conn:
+        if conn and conexao_propria:
             conn.close()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove (e arquiva) os pedidos completos já entregues.")
+    parser.add_argument("--tamanho-lote", type=int, help="Pedidos removidos por transação (padrão: LIMPEZA_TAMANHO_LOTE).")
+    parser.add_argument("--sem-arquivo", action="store_true", help="Remove os pedidos sem gravar o arquivo JSONL.gz.")
+    args = parser.parse_args()
+
     print("======================================================================")
     print("========= SCRIPT DE LIMPEZA DE PEDIDOS ANTIGOS (SQLite) =========")
     print("======================================================================")
-    limpar_pedidos_antigos()
+    metricas.iniciar_servidor_http()
+    limpar_pedidos_antigos(tamanho_lote=args.tamanho_lote, arquivar=False if args.sem_arquivo else None)
+    metricas.gravar_arquivo()
     print("\n==================== EXECUÇÃO CONCLUÍDA ====================")
\ No newline at end of file
@@ -0,0 +1,192 @@
+# metricas.py
+
+import os
+import threading
+import time
+import bisect
+import functools
+from contextlib import contextmanager
+import configuracao
+
+# Instrumentação compartilhada pelos scripts: contadores e histogramas de latência em
+# memória, exportados no formato texto do Prometheus.
+#    - METRICAS_ARQUIVO: arquivo reescrito ao fim de cada execução/etapa (ex.: para o
+#      textfile collector do node_exporter).
+#    - METRICAS_PORTA: porta local em que GET /metrics é servido enquanto o processo roda.
+# LOG_NIVEL controla a saída no console: 'resumo' (padrão) imprime só os totais de cada
+# etapa, lotes e erros; 'detalhado' também imprime uma linha por pedido.
+
+# ==============================================================================
+# --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
+# ==============================================================================
+metricas_arquivo = configuracao.parametro('METRICAS_ARQUIVO')
+metricas_porta = configuracao.parametro('METRICAS_PORTA', '0', int)
+log_nivel = configuracao.parametro('LOG_NIVEL', 'resumo')
+
+BUCKETS_SEGUNDOS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registro = []
+_lock = threading.Lock()
+_nivel_log = None  # definido por definir_nivel_log (ex.: --verboso); senão, LOG_NIVEL
+
+# ==============================================================================
+# --- LOG POR PEDIDO ---
+# ==============================================================================
+def definir_nivel_log(nivel):
+    global _nivel_log
+    _nivel_log = nivel
+
+def log_detalhe(mensagem):
+    """Imprime `mensagem` só com LOG_NIVEL=detalhado (linhas por pedido)."""
+    if (_nivel_log or log_nivel()) == 'detalhado':
+        print(mensagem)
+
+# ==============================================================================
+# --- TIPOS DE MÉTRICA ---
+# ==============================================================================
+def _formatar_rotulos(nomes, valores, extra=None):
+    pares = [f'{nome}="{str(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+class Contador:
+    """Contador monotônico com rótulos."""
+    tipo = "counter"
+
+    def __init__(self, nome, descricao, rotulos=()):
+        self.nome, self.descricao, self.rotulos = nome, descricao, tuple(rotulos)
+        self._valores = {}
+        with _lock:
+            _registro.append(self)
+
+    def incrementar(self, valor=1, **rotulos):
+        chave = tuple(rotulos[r] for r in self.rotulos)
+        with _lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def valor(self, **rotulos):
+        return self._valores.get(tuple(rotulos[r] for r in self.rotulos), 0)
+
+    def exportar(self):
+        with _lock:
+            itens = sorted(self._valores.items(), key=lambda item: tuple(map(str, item[0])))
+        return [f"{self.nome}{_formatar_rotulos(self.rotulos, chave)} {valor:g}" for chave, valor in itens]
+
+class Histograma:
+    """Histograma cumulativo (buckets em segundos) com rótulos."""
+    tipo = "histogram"
+
+    def __init__(self, nome, descricao, rotulos=(), buckets=BUCKETS_SEGUNDOS):
+        self.nome, self.descricao, self.rotulos = nome, descricao, tuple(rotulos)
+        self.buckets = tuple(buckets)
+        self._series = {}  # rótulos -> [contagens por bucket (+Inf no fim), soma]
+        with _lock:
+            _registro.append(self)
+
+    def observar(self, valor, **rotulos):
+        chave = tuple(rotulos[r] for r in self.rotulos)
+        indice = bisect.bisect_left(self.buckets, valor)
+        with _lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][indice] += 1
+            serie[1] += valor
+
+    @contextmanager
+    def cronometrar(self, **rotulos):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **rotulos)
+
+    def exportar(self):
+        with _lock:
+            itens = sorted(((chave, list(serie[0]), serie[1]) for chave, serie in self._series.items()), key=lambda item: tuple(map(str, item[0])))
+        linhas = []
+        for chave, contagens, soma in itens:
+            acumulado = 0
+            for limite, contagem in zip(self.buckets + (float('inf'),), contagens):
+                acumulado += contagem
+                le = "+Inf" if limite == float('inf') else f"{limite:g}"
+                rotulos = _formatar_rotulos(self.rotulos, chave, f'le="{le}"')
+                linhas.append(f"{self.nome}_bucket{rotulos} {acumulado}")
+            linhas.append(f"{self.nome}_sum{_formatar_rotulos(self.rotulos, chave)} {soma:.6f}")
+            linhas.append(f"{self.nome}_count{_formatar_rotulos(self.rotulos, chave)} {acumulado}")
+        return linhas
+
+# ==============================================================================
+# --- MÉTRICAS DO PIPELINE ---
+# ==============================================================================
+HTTP_DURACAO = Histograma("pipeline_http_requisicao_segundos", "Duração das chamadas HTTP por endpoint, incluindo repetições.", ["endpoint"])
+HTTP_RESPOSTAS = Contador("pipeline_http_respostas_total", "Respostas HTTP por endpoint e status ('erro' = falha de conexão).", ["endpoint", "status"])
+DB_DURACAO = Histograma("pipeline_db_operacao_segundos", "Duração das operações no SQLite (consultas e commits).", ["operacao"])
+ETAPA_DURACAO = Histograma("pipeline_etapa_duracao_segundos", "Duração de cada execução de etapa.", ["etapa"], buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600))
+ETAPA_PEDIDOS = Contador("pipeline_etapa_pedidos_total", "Pedidos processados por etapa e resultado (sucesso, pulado, falha).", ["etapa", "resultado"])
+LIMITE_ESPERA = Histograma("pipeline_limite_espera_segundos", "Espera imposta pelo limitador de taxa antes das chamadas HTTP.", ["endpoint"])
+LIMITE_429 = Contador("pipeline_limite_429_total", "Respostas 429 recebidas (inclusive as repetidas automaticamente).", ["endpoint"])
+EVENTOS_TRACKING = Contador("pipeline_eventos_tracking_total", "Eventos de tracking aceitos pela API por transportadora.", ["carrier"])
+
+def medir_etapa(nome):
+    """Decorador: registra em ETAPA_DURACAO a duração de cada execução da etapa `nome`."""
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def medida(*args, **kwargs):
+            with ETAPA_DURACAO.cronometrar(etapa=nome):
+                return funcao(*args, **kwargs)
+        return medida
+    return decorador
+
+# ==============================================================================
+# --- EXPORTAÇÃO ---
+# ==============================================================================
+def exportar_prometheus():
+    """Todas as métricas registradas no formato texto do Prometheus (versão 0.0.4)."""
+    with _lock:
+        metricas = list(_registro)
+    linhas = []
+    for metrica in metricas:
+        linhas.append(f"# HELP {metrica.nome} {metrica.descricao}")
+        linhas.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+        linhas.extend(metrica.exportar())
+    return "\n".join(linhas) + "\n"
+
+def gravar_arquivo(caminho=None):
+    """Reescreve o arquivo de métricas de forma atômica; sem caminho nem METRICAS_ARQUIVO, não faz nada."""
+    caminho = caminho or metricas_arquivo()
+    if not caminho:
+        return
+    temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporario, 'w', encoding='utf-8') as f:
+        f.write(exportar_prometheus())
+    os.replace(temporario, caminho)
+
+def iniciar_servidor_http(porta=None, host='127.0.0.1'):
+    """Serve GET /metrics numa thread daemon; sem porta nem METRICAS_PORTA, não faz nada."""
+    porta = porta or metricas_porta()
+    if not porta:
+        return None
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class ManipuladorMetricas(BaseHTTPRequestHandler):
+        def log_message(self, formato, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            dados = exportar_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(dados)))
+            self.end_headers()
+            self.wfile.write(dados)
+
+    servidor = ThreadingHTTPServer((host, porta), ManipuladorMetricas)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="metricas-http", daemon=True).start()
+    print(f"INFO: Métricas disponíveis em http://{host}:{porta}/metrics")
+    return servidor
@@ -0,0 +1,47 @@
+# planejamento_entregas.py
+
+import math
+import random
+from datetime import datetime
+from calendario_uteis import calendario_padrao
+
+# Cronograma simulado de cada pedido: as datas em que ele passa a IN_TRANSIT e a
+# DELIVERED (e TO_BE_DELIVERED, para os atrasados) e a data do próximo evento devido.
+# Usado pela ETAPA 1 a partir da resposta do GET e pela criação, quando o pedido é
+# planejado na hora com os dados do próprio payload (ver criar_pedidos_db).
+
+def calcular_next_action_date(latest_volume_state, late_delivery_flag, update_date_in_transit, update_date_to_be_delivered, update_date_delivered):
+    """Data em que o pedido terá o próximo evento de tracking (mesma regra de banco_dados.SQL_NEXT_ACTION_DATE)."""
+    if latest_volume_state == "SHIPPED":
+        return update_date_in_transit
+    if latest_volume_state == "IN_TRANSIT":
+        return update_date_to_be_delivered if late_delivery_flag == 1 else update_date_delivered
+    if latest_volume_state == "TO_BE_DELIVERED":
+        return update_date_delivered
+    return None
+
+def calcular_datas_de_update(data_criacao_str, data_estimada_str):
+    """Sorteia as datas de IN_TRANSIT e DELIVERED dentro do prazo útil entre criação e entrega estimada."""
+    update_dates = {'in_transit': None, 'to_be_delivered': None, 'delivered': None}
+    if data_criacao_str and data_estimada_str:
+        data_criacao = datetime.fromisoformat(data_criacao_str).date()
+        data_estimada = datetime.fromisoformat(data_estimada_str).date()
+        calendario = calendario_padrao()
+        total_prazo_dias = max(1, calendario.dias_uteis_entre(data_criacao, data_estimada))
+
+        t_in_transit = random.uniform(0.15, 0.60)
+        t_delivered = random.uniform(0.80, 1.00)
+
+        dias_para_in_transit = math.ceil(total_prazo_dias * t_in_transit)
+        dias_para_delivered = math.ceil(total_prazo_dias * t_delivered)
+
+        update_dates['in_transit'] = calendario.adicionar_dias_uteis(data_criacao, dias_para_in_transit).isoformat()
+        update_dates['delivered'] = calendario.adicionar_dias_uteis(data_criacao, dias_para_delivered).isoformat()
+        update_dates['to_be_delivered'] = update_dates['delivered']
+    return update_dates
+
+def planejar_pedido(latest_volume_state, created_iso, estimated_delivery_date_iso):
+    """Retorna (update_date_in_transit, update_date_to_be_delivered, update_date_delivered, next_action_date) de um pedido sem atraso."""
+    update_dates = calcular_datas_de_update(created_iso, estimated_delivery_date_iso)
+    next_action_date = calcular_next_action_date(latest_volume_state, 0, update_dates['in_transit'], update_dates['to_be_delivered'], update_dates['delivered'])
+    return update_dates['in_transit'], update_dates['to_be_delivered'], update_dates['delivered'], next_action_date
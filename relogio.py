@@ -0,0 +1,62 @@
+# relogio.py
+
+import threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from configuracao import parametro
+
+# Fonte única do "agora" de negócio dos três scripts: data de criação dos pedidos, datas
+# devidas do tracking e corte da limpeza. Por padrão é o relógio do sistema; um
+# RelogioSimulado desloca o tempo (RELOGIO_DESLOCAMENTO_DIAS, ou instalado por
+# definir_relogio, como faz a simulacao_ciclo_vida) para percorrer semanas em minutos.
+# TTLs de cache, reservas de pedidos e o limitador de taxa continuam no tempo real.
+
+# ==============================================================================
+# --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
+# ==============================================================================
+tz_brasilia = ZoneInfo("America/Sao_Paulo")
+
+relogio_deslocamento_dias = parametro('RELOGIO_DESLOCAMENTO_DIAS', '0', float)
+
+# ==============================================================================
+# --- RELÓGIOS ---
+# ==============================================================================
+class RelogioSistema:
+    def agora(self, tz=tz_brasilia):
+        return datetime.now(tz)
+
+class RelogioSimulado:
+    """Relógio do sistema mais um deslocamento, que `avancar` aumenta; seguro para uso entre threads."""
+
+    def __init__(self, inicio=None, deslocamento=timedelta(0)):
+        if inicio is not None:
+            deslocamento = inicio - datetime.now(inicio.tzinfo)
+        self._deslocamento = deslocamento
+        self._lock = threading.Lock()
+
+    def agora(self, tz=tz_brasilia):
+        with self._lock:
+            return datetime.now(tz) + self._deslocamento
+
+    def avancar(self, **duracao):
+        """Avança o relógio em `duracao` (argumentos de timedelta, ex.: days=1)."""
+        with self._lock:
+            self._deslocamento += timedelta(**duracao)
+
+_relogio = None  # criado no primeiro uso, conforme RELOGIO_DESLOCAMENTO_DIAS
+
+def _relogio_atual():
+    global _relogio
+    if _relogio is None:
+        deslocamento = relogio_deslocamento_dias()
+        _relogio = RelogioSimulado(deslocamento=timedelta(days=deslocamento)) if deslocamento else RelogioSistema()
+    return _relogio
+
+def definir_relogio(relogio):
+    """Instala `relogio` para todos os scripts do processo; retorna o anterior."""
+    global _relogio
+    anterior, _relogio = _relogio_atual(), relogio
+    return anterior
+
+def agora(tz=tz_brasilia):
+    return _relogio_atual().agora(tz)
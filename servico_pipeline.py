@@ -0,0 +1,128 @@
+# servico_pipeline.py
+
+import queue
+import signal
+import threading
+import banco_dados
+import configuracao
+import metricas
+import criar_pedidos_db
+import gerenciar_status_pedidos_db
+import limpeza_base
+from cliente_http import fechar_sessoes
+
+# Serviço contínuo que substitui as três execuções via cron. Os módulos, o schema do
+# banco e as sessões HTTP são inicializados uma única vez, e cada etapa roda numa
+# thread própria, com sua conexão SQLite:
+#    criação -> consulta -> atraso -> tracking        limpeza (independente)
+# Cada etapa roda a cada PIPELINE_INTERVALO_<ETAPA>_SEGUNDOS ou, antes disso, assim que a
+# etapa anterior termina e a avisa pela sua fila. Intervalo 0 desativa a etapa.
+# SIGINT/SIGTERM encerram o serviço depois que cada etapa conclui a execução em andamento.
+
+# ==============================================================================
+# --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
+# ==============================================================================
+pipeline_pedidos_por_ciclo = configuracao.parametro('PIPELINE_PEDIDOS_POR_CICLO', '250', int)
+INTERVALOS_PADRAO = {
+    "criacao": 3600,
+    "consulta": 300,
+    "atraso": 900,
+    "tracking": 300,
+    "limpeza": 86400,
+}
+
+def intervalo_da_etapa(nome):
+    return float(configuracao.obter(f"PIPELINE_INTERVALO_{nome.upper()}_SEGUNDOS", INTERVALOS_PADRAO[nome]))
+
+# ==============================================================================
+# --- ETAPAS ---
+# ==============================================================================
+class Etapa(threading.Thread):
+    """Executa `funcao(conn)` em loop, a cada `intervalo` segundos ou quando notificada."""
+
+    def __init__(self, nome, funcao, intervalo, parar):
+        super().__init__(name=f"etapa-{nome}", daemon=True)
+        self.nome = nome
+        self.funcao = funcao
+        self.intervalo = intervalo
+        self.parar = parar
+        self.fila = queue.Queue()
+        self.seguintes = []
+
+    def notificar(self):
+        self.fila.put(self.nome)
+
+    def run(self):
+        conn = banco_dados.conectar_db(configuracao.db_file())
+        try:
+            while not self.parar.is_set():
+                try:
+                    self.fila.get(timeout=self.intervalo)
+                except queue.Empty:
+                    pass
+                if self.parar.is_set():
+                    break
+                # Várias notificações acumuladas valem por uma única execução
+                while not self.fila.empty():
+                    self.fila.get_nowait()
+                try:
+                    self.funcao(conn)
+                except Exception as e:
+                    print(f"\nERRO na etapa '{self.nome}': {e}")
+                    conn.rollback()
+                metricas.gravar_arquivo()
+                for etapa in self.seguintes:
+                    etapa.notificar()
+        finally:
+            conn.close()
+
+def montar_etapas(parar):
+    funcoes = {
+        "criacao": lambda conn: criar_pedidos_db.criar_novos_pedidos(conn, numero_de_pedidos=pipeline_pedidos_por_ciclo()),
+        "consulta": gerenciar_status_pedidos_db.consultar_pedidos_criados,
+        "atraso": gerenciar_status_pedidos_db.marcar_pedidos_para_atraso,
+        "tracking": gerenciar_status_pedidos_db.enviar_atualizacoes_de_status,
+        "limpeza": lambda conn: limpeza_base.limpar_pedidos_antigos(conn=conn),
+    }
+    etapas = {nome: Etapa(nome, funcao, intervalo_da_etapa(nome), parar) for nome, funcao in funcoes.items() if intervalo_da_etapa(nome) > 0}
+    for origem, destino in (("criacao", "consulta"), ("consulta", "atraso"), ("atraso", "tracking")):
+        if origem in etapas and destino in etapas:
+            etapas[origem].seguintes.append(etapas[destino])
+    return etapas
+
+# ==============================================================================
+# --- EXECUÇÃO DO SERVIÇO ---
+# ==============================================================================
+def executar_servico():
+    parar = threading.Event()
+    etapas = montar_etapas(parar)
+
+    def encerrar(signum, frame):
+        print(f"\nINFO: Sinal {signal.Signals(signum).name} recebido. Encerrando após as execuções em andamento...")
+        parar.set()
+        for etapa in etapas.values():
+            etapa.notificar()
+
+    signal.signal(signal.SIGINT, encerrar)
+    signal.signal(signal.SIGTERM, encerrar)
+
+    banco_dados.setup_database(configuracao.db_file())
+    metricas.iniciar_servidor_http()
+    for nome, etapa in etapas.items():
+        print(f"INFO: Etapa '{nome}' ativa, intervalo de {etapa.intervalo:g}s.")
+        etapa.start()
+        etapa.notificar()  # primeira execução imediata
+
+    try:
+        while any(etapa.is_alive() for etapa in etapas.values()):
+            for etapa in etapas.values():
+                etapa.join(timeout=1)
+    finally:
+        fechar_sessoes()
+
+if __name__ == "__main__":
+    print("======================================================================")
+    print("====== SERVIÇO CONTÍNUO DO PIPELINE DE PEDIDOS (VERSÃO SQLite) ======")
+    print("======================================================================")
+    executar_servico()
+    print("\n==================== SERVIÇO ENCERRADO ====================")
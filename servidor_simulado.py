@@ -0,0 +1,309 @@
+# servidor_simulado.py
+
+import json
+import math
+import random
+import threading
+import time
+import argparse
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import configuracao
+
+# Servidor local que imita os quatro endpoints usados pelos scripts, para testes de
+# carga sem tocar nas APIs reais:
+#    POST /api/v1/quote_by_product         GET /api/cep/v1/<cep>            (BrasilAPI)
+#    POST /api/v1/shipment_order           POST /api/v1/tracking/add/events
+#    GET  /api/v1/shipment_order/<número>
+# A latência de cada resposta segue uma distribuição configurável; uma fração das
+# requisições responde 503 (taxa_erro) ou 429 (taxa_429), e um limite de requisições por
+# segundo por api-key (token bucket) responde 429 com Retry-After ao ser excedido.
+# Para apontar os scripts para ele:
+#    INTELIPOST_API_URL=http://127.0.0.1:8765/api/v1  BRASILAPI_URL=http://127.0.0.1:8765/api
+# GET /__estatisticas devolve contagens e latências por endpoint; POST /__zerar as zera.
+
+# ==============================================================================
+# --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
+# ==============================================================================
+simulador_porta = configuracao.parametro('SIMULADOR_PORTA', '8765', int)
+DISTRIBUICOES = ("fixa", "uniforme", "exponencial", "lognormal")
+
+DELIVERY_METHOD_IDS = [32, 4, 177, 51, 3363, 23]
+ESTADOS = ["SHIPPED", "IN_TRANSIT", "TO_BE_DELIVERED"]
+
+class ConfiguracaoSimulador:
+    """Parâmetros do simulador; os padrões vêm das variáveis SIMULADOR_*."""
+
+    def __init__(self, latencia_ms=None, distribuicao=None, sigma=None, taxa_erro=None, taxa_429=None,
+                 limite_rps=None, taxa_cep_inexistente=None, taxa_erro_apos_gravar=None, deslocamento_dias=None):
+        def padrao(valor, nome, default, tipo=float):
+            return valor if valor is not None else tipo(configuracao.obter(nome, default))
+        self.latencia_ms = padrao(latencia_ms, 'SIMULADOR_LATENCIA_MS', '50')
+        self.distribuicao = padrao(distribuicao, 'SIMULADOR_DISTRIBUICAO', 'lognormal', str)
+        self.sigma = padrao(sigma, 'SIMULADOR_SIGMA', '0.5')
+        self.taxa_erro = padrao(taxa_erro, 'SIMULADOR_TAXA_ERRO', '0')
+        self.taxa_429 = padrao(taxa_429, 'SIMULADOR_TAXA_429', '0')
+        # Requisições por segundo aceitas por api-key (0 = sem limite)
+        self.limite_rps = padrao(limite_rps, 'SIMULADOR_LIMITE_RPS', '0')
+        self.taxa_cep_inexistente = padrao(taxa_cep_inexistente, 'SIMULADOR_TAXA_CEP_INEXISTENTE', '0')
+        # Fração dos erros do POST shipment_order em que o pedido foi gravado antes do 503
+        self.taxa_erro_apos_gravar = padrao(taxa_erro_apos_gravar, 'SIMULADOR_TAXA_ERRO_APOS_GRAVAR', '0')
+        # Dias subtraídos das datas do pedido na consulta, para que os eventos de tracking fiquem devidos
+        self.deslocamento_dias = padrao(deslocamento_dias, 'SIMULADOR_DESLOCAMENTO_DIAS', '0', int)
+        if self.distribuicao not in DISTRIBUICOES:
+            raise ValueError(f"Erro: Distribuição de latência '{self.distribuicao}' inválida. Use uma de: {', '.join(DISTRIBUICOES)}.")
+
+    def sortear_latencia(self, rng):
+        """Latência em segundos; `latencia_ms` é a média (fixa, uniforme, exponencial) ou a mediana (lognormal)."""
+        media = self.latencia_ms / 1000
+        if media <= 0:
+            return 0.0
+        if self.distribuicao == "fixa":
+            return media
+        if self.distribuicao == "uniforme":
+            return rng.uniform(0, 2 * media)
+        if self.distribuicao == "exponencial":
+            return rng.expovariate(1 / media)
+        return rng.lognormvariate(math.log(media), self.sigma)
+
+# ==============================================================================
+# --- ESTADO DO SIMULADOR ---
+# ==============================================================================
+class EstadoSimulador:
+    """Pedidos criados, buckets de limite por api-key e estatísticas; seguro entre threads."""
+
+    def __init__(self, config, semente=None):
+        self.config = config
+        self.rng = random.Random(semente)
+        self.lock = threading.Lock()
+        self.pedidos = {}
+        self.buckets = {}
+        self.zerar()
+
+    def zerar(self):
+        with self.lock:
+            self.respostas = {}   # (endpoint, status) -> quantidade
+            self.latencias = {}   # endpoint -> [segundos]
+            self.eventos = 0
+
+    def sortear(self, probabilidade):
+        with self.lock:
+            return self.rng.random() < probabilidade
+
+    def consumir_limite(self, chave):
+        """Token bucket por api-key: retorna 0 se a requisição pode seguir, ou os segundos até o próximo token."""
+        if self.config.limite_rps <= 0:
+            return 0
+        agora = time.monotonic()
+        with self.lock:
+            tokens, ultimo = self.buckets.get(chave, (self.config.limite_rps, agora))
+            tokens = min(self.config.limite_rps, tokens + (agora - ultimo) * self.config.limite_rps)
+            if tokens >= 1:
+                self.buckets[chave] = (tokens - 1, agora)
+                return 0
+            self.buckets[chave] = (tokens, agora)
+            return (1 - tokens) / self.config.limite_rps
+
+    def registrar(self, endpoint, status, duracao, eventos=0):
+        with self.lock:
+            self.respostas[(endpoint, status)] = self.respostas.get((endpoint, status), 0) + 1
+            self.latencias.setdefault(endpoint, []).append(duracao)
+            self.eventos += eventos
+
+    def estatisticas(self):
+        """Contagens por status e percentis de latência (ms) por endpoint."""
+        with self.lock:
+            resultado = {"eventos": self.eventos, "endpoints": {}}
+            for endpoint, latencias in self.latencias.items():
+                ordenadas = sorted(latencias)
+                resultado["endpoints"][endpoint] = {
+                    "requisicoes": len(ordenadas),
+                    "status": {str(status): n for (ep, status), n in sorted(self.respostas.items()) if ep == endpoint},
+                    **{f"p{p}_ms": round(percentil(ordenadas, p) * 1000, 1) for p in (50, 95, 99)},
+                }
+            return resultado
+
+def percentil(valores_ordenados, p):
+    if not valores_ordenados:
+        return 0.0
+    return valores_ordenados[min(len(valores_ordenados) - 1, math.ceil(p / 100 * len(valores_ordenados)) - 1)]
+
+# ==============================================================================
+# --- ENDPOINTS ---
+# ==============================================================================
+def _cotacao(estado, corpo):
+    opcoes = [
+        {"delivery_method_id": dm_id, "delivery_estimate_business_days": estado.rng.randint(1, 10), "provider_shipping_cost": round(estado.rng.uniform(10, 120), 2)}
+        for dm_id in estado.rng.sample(DELIVERY_METHOD_IDS, 3)
+    ]
+    return 200, {"status": "OK", "content": {"id": estado.rng.randint(1, 10**9), "delivery_options": opcoes}}
+
+def _criar_pedido(estado, corpo):
+    order_number = corpo.get("order_number")
+    if not order_number or not corpo.get("quote_id"):
+        return 400, {"status": "ERROR", "messages": [{"text": "order_number e quote_id são obrigatórios"}]}
+    with estado.lock:
+        if order_number in estado.pedidos:
+            return 400, {"status": "ERROR", "messages": [{"text": f"Pedido {order_number} já existe"}]}
+        estado.pedidos[order_number] = {
+            "order_number": order_number,
+            "created": corpo.get("created"),
+            "estimated_delivery_date": corpo.get("estimated_delivery_date"),
+            "delivery_method_id": corpo.get("delivery_method_id"),
+            # Pedido enviado com shipped_date nasce despachado
+            "shipment_order_volume_array": [{"shipment_order_volume_number": 1, "shipment_order_volume_state": "SHIPPED" if corpo.get("shipped_date") else "NEW"}],
+        }
+        content = dict(estado.pedidos[order_number])
+    return 200, {"status": "OK", "content": content}
+
+def _consultar_pedido(estado, order_number):
+    with estado.lock:
+        pedido = estado.pedidos.get(order_number)
+        if pedido is None:
+            return 404, {"status": "ERROR", "messages": [{"text": f"Pedido {order_number} não encontrado"}]}
+        deslocamento = timedelta(days=estado.config.deslocamento_dias)
+        volume_state = estado.rng.choice(ESTADOS)
+        content = {
+            **pedido,
+            "created_iso": (datetime.fromisoformat(pedido["created"]) - deslocamento).isoformat(),
+            "estimated_delivery_date_iso": (datetime.fromisoformat(pedido["estimated_delivery_date"]) - deslocamento).isoformat(),
+            "shipment_order_volume_array": [{**pedido["shipment_order_volume_array"][0], "shipment_order_volume_state": volume_state}],
+        }
+    return 200, {"status": "OK", "content": content}
+
+def _adicionar_eventos(estado, corpo):
+    if not corpo.get("order_number") or not corpo.get("events"):
+        return 400, {"status": "ERROR", "messages": [{"text": "order_number e events são obrigatórios"}]}
+    return 200, {"status": "OK"}
+
+def _consultar_cep(estado, cep):
+    cep = cep.replace('-', '')
+    if len(cep) != 8 or not cep.isdigit() or estado.sortear(estado.config.taxa_cep_inexistente):
+        return 404, {"name": "CepPromiseError", "message": "Todos os serviços de CEP retornaram erro."}
+    # CEPs gerais (terminados em 000) vêm sem rua e bairro, como na BrasilAPI
+    geral = cep.endswith('000')
+    return 200, {"cep": cep, "state": "SP", "city": "Cidade Simulada", "neighborhood": "" if geral else "Centro",
+                 "street": "" if geral else f"Rua Simulada {cep[-3:]}", "service": "simulador"}
+
+# ==============================================================================
+# --- SERVIDOR HTTP ---
+# ==============================================================================
+class ManipuladorSimulador(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, como nas APIs reais
+    estado = None  # definido por criar_servidor
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _responder(self, status, corpo, cabecalhos=None):
+        dados = json.dumps(corpo).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(dados)))
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _ler_corpo(self):
+        tamanho = int(self.headers.get('Content-Length') or 0)
+        dados = self.rfile.read(tamanho) if tamanho else b''
+        try:
+            return json.loads(dados) if dados else {}
+        except ValueError:
+            return None
+
+    def _rotear(self, metodo):
+        caminho = self.path.split('?', 1)[0]
+        if caminho.startswith('/api/cep/v1/') and metodo == 'GET':
+            return 'cep', lambda: _consultar_cep(self.estado, caminho.rsplit('/', 1)[1]), False
+        if caminho == '/api/v1/quote_by_product' and metodo == 'POST':
+            return 'quote_by_product', lambda: _cotacao(self.estado, self._corpo), False
+        if caminho == '/api/v1/shipment_order' and metodo == 'POST':
+            return 'shipment_order_post', lambda: _criar_pedido(self.estado, self._corpo), True
+        if caminho.startswith('/api/v1/shipment_order/') and metodo == 'GET':
+            return 'shipment_order_get', lambda: _consultar_pedido(self.estado, caminho.rsplit('/', 1)[1]), False
+        if caminho == '/api/v1/tracking/add/events' and metodo == 'POST':
+            return 'tracking_events', lambda: _adicionar_eventos(self.estado, self._corpo), False
+        return None, None, False
+
+    def _atender(self, metodo):
+        inicio = time.perf_counter()
+        self._corpo = self._ler_corpo() if metodo == 'POST' else {}
+        caminho = self.path.split('?', 1)[0]
+        if caminho == '/__estatisticas':
+            return self._responder(200, self.estado.estatisticas())
+        if caminho == '/__zerar':
+            self.estado.zerar()
+            return self._responder(200, {"status": "OK"})
+
+        endpoint, tratar, grava_antes_do_erro = self._rotear(metodo)
+        if endpoint is None:
+            return self._responder(404, {"status": "ERROR", "messages": [{"text": "endpoint desconhecido"}]})
+        if self._corpo is None:
+            self.estado.registrar(endpoint, 400, time.perf_counter() - inicio)
+            return self._responder(400, {"status": "ERROR", "messages": [{"text": "JSON inválido"}]})
+
+        time.sleep(self.estado.config.sortear_latencia(self.estado.rng))
+        chave = self.headers.get('api-key') or self.headers.get('logistic-provider-api-key') or endpoint
+        cabecalhos, eventos = None, 0
+        if (espera := self.estado.consumir_limite(chave)) or self.estado.sortear(self.estado.config.taxa_429):
+            status, corpo = 429, {"status": "ERROR", "messages": [{"text": "Too Many Requests"}]}
+            cabecalhos = {'Retry-After': str(max(1, math.ceil(espera)))}
+        elif self.estado.sortear(self.estado.config.taxa_erro):
+            if grava_antes_do_erro and self.estado.sortear(self.estado.config.taxa_erro_apos_gravar):
+                tratar()
+            status, corpo = 503, {"status": "ERROR", "messages": [{"text": "Service Unavailable"}]}
+        else:
+            status, corpo = tratar()
+            if endpoint == 'tracking_events' and status == 200:
+                eventos = len(self._corpo.get("events", []))
+        self.estado.registrar(endpoint, status, time.perf_counter() - inicio, eventos)
+        self._responder(status, corpo, cabecalhos)
+
+    def do_GET(self):
+        self._atender('GET')
+
+    def do_POST(self):
+        self._atender('POST')
+
+def criar_servidor(config=None, host='127.0.0.1', porta=None, semente=None):
+    """Cria o servidor (porta 0 = porta livre; None = SIMULADOR_PORTA); o estado fica em servidor.estado."""
+    porta = simulador_porta() if porta is None else porta
+    estado = EstadoSimulador(config or ConfiguracaoSimulador(), semente)
+    manipulador = type('Manipulador', (ManipuladorSimulador,), {"estado": estado})
+    servidor = ThreadingHTTPServer((host, porta), manipulador)
+    servidor.daemon_threads = True
+    servidor.estado = estado
+    return servidor
+
+def iniciar_em_thread(config=None, host='127.0.0.1', porta=0, semente=None):
+    """Sobe o servidor numa thread daemon e o retorna junto com suas URLs base."""
+    servidor = criar_servidor(config, host, porta, semente)
+    threading.Thread(target=servidor.serve_forever, name="servidor-simulado", daemon=True).start()
+    base = f"http://{host}:{servidor.server_address[1]}"
+    return servidor, {"INTELIPOST_API_URL": f"{base}/api/v1", "BRASILAPI_URL": f"{base}/api"}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor local que simula as APIs da Intelipost e da BrasilAPI.")
+    parser.add_argument("--porta", type=int, default=simulador_porta())
+    parser.add_argument("--latencia-ms", type=float, help="Latência média (mediana na lognormal) em ms.")
+    parser.add_argument("--distribuicao", choices=DISTRIBUICOES)
+    parser.add_argument("--taxa-erro", type=float, help="Fração de respostas 503.")
+    parser.add_argument("--taxa-429", type=float, help="Fração de respostas 429 aleatórias.")
+    parser.add_argument("--limite-rps", type=float, help="Requisições por segundo por api-key antes de responder 429.")
+    parser.add_argument("--deslocamento-dias", type=int, help="Dias subtraídos das datas dos pedidos na consulta.")
+    parser.add_argument("--semente", type=int)
+    args = parser.parse_args()
+
+    config = ConfiguracaoSimulador(latencia_ms=args.latencia_ms, distribuicao=args.distribuicao, taxa_erro=args.taxa_erro,
+                                   taxa_429=args.taxa_429, limite_rps=args.limite_rps, deslocamento_dias=args.deslocamento_dias)
+    servidor = criar_servidor(config, porta=args.porta, semente=args.semente)
+    print(f"INFO: Servidor simulado em http://127.0.0.1:{args.porta} (latência {config.distribuicao} de {config.latencia_ms:g} ms, "
+          f"erro {config.taxa_erro:.1%}, 429 {config.taxa_429:.1%}, limite {config.limite_rps:g} req/s).")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print("\nINFO: Servidor simulado encerrado.")
+    finally:
+        servidor.server_close()
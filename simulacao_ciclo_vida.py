@@ -0,0 +1,139 @@
+# simulacao_ciclo_vida.py
+
+import os
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import io
+from datetime import date, datetime, time as horario
+import relogio
+import servidor_simulado
+import criar_pedidos_db
+import gerenciar_status_pedidos_db
+import limpeza_base
+import metricas
+from cliente_http import fechar_sessoes
+from benchmark_pipeline import preparar_ambiente, tamanho_banco
+
+# Simulação acelerada do ciclo de vida dos pedidos: com um relógio virtual (relogio.py)
+# e o servidor_simulado no lugar das APIs, cada "dia" cria um lote de pedidos, executa
+# as três etapas de status e a limpeza e avança o relógio um dia. Meses de operação
+# (SHIPPED -> IN_TRANSIT -> TO_BE_DELIVERED -> DELIVERED -> limpeza) rodam em minutos,
+# e o relatório mostra, por dia simulado, a vazão e a distribuição de estados.
+
+# ==============================================================================
+# --- CONFIGURAÇÕES GERAIS E CONSTANTES ---
+# ==============================================================================
+ESTADOS_RELATORIO = ["CRIADO", "SHIPPED", "IN_TRANSIT", "TO_BE_DELIVERED", "COMPLETO"]
+
+# Estado de cada pedido no relatório: o do volume enquanto CONSULTADO, senão o do processo
+SQL_DISTRIBUICAO = """
+    SELECT CASE WHEN status_processo = 'CONSULTADO' THEN latest_volume_state ELSE status_processo END, count(*)
+    FROM pedidos GROUP BY 1
+"""
+
+# ==============================================================================
+# --- SIMULAÇÃO ---
+# ==============================================================================
+def executar_simulacao(dias, pedidos_por_dia, data_inicial, config, max_workers=None, arquivar=False, verboso=False):
+    servidor, urls = servidor_simulado.iniciar_em_thread(config, semente=42)
+    dir_temporario = tempfile.TemporaryDirectory(prefix="simulacao_ciclo_vida_")
+    db_file = os.path.join(dir_temporario.name, "pedidos.db")
+    # O que se mede aqui é o ciclo de vida, não a vazão contra os limites das APIs
+    preparar_ambiente(urls, db_file, planejamento_inline=True, limite_taxa_rps=0)
+
+    relogio_simulado = relogio.RelogioSimulado(inicio=datetime.combine(data_inicial, horario(8), relogio.tz_brasilia))
+    relogio.definir_relogio(relogio_simulado)
+
+    def contador(etapa, resultado="sucesso"):
+        return metricas.ETAPA_PEDIDOS.valor(etapa=etapa, resultado=resultado)
+
+    criar_pedidos_db.setup_database()
+    criar_pedidos_db.dados_sinteticos.carregar()
+    conn = criar_pedidos_db.conectar_db()
+    resultados = []
+    try:
+        for dia in range(1, dias + 1):
+            criados_antes, removidos_antes = contador("criacao"), contador("limpeza")
+            servidor.estado.zerar()
+            saida = contextlib.nullcontext() if verboso else contextlib.redirect_stdout(io.StringIO())
+            inicio = time.perf_counter()
+            with saida:
+                criar_pedidos_db.criar_novos_pedidos(conn, numero_de_pedidos=pedidos_por_dia, max_workers=max_workers)
+                gerenciar_status_pedidos_db.consultar_pedidos_criados(conn, max_workers=max_workers)
+                gerenciar_status_pedidos_db.marcar_pedidos_para_atraso(conn)
+                gerenciar_status_pedidos_db.enviar_atualizacoes_de_status(conn)
+                limpeza_base.limpar_pedidos_antigos(arquivar=arquivar, conn=conn)
+            duracao = time.perf_counter() - inicio
+            eventos = servidor.estado.estatisticas()["eventos"]
+            resultados.append({
+                "dia": dia,
+                "data": relogio.agora().date().isoformat(),
+                "duracao_s": round(duracao, 3),
+                "criados": contador("criacao") - criados_antes,
+                "eventos": eventos,
+                "eventos_por_s": round(eventos / duracao, 1) if duracao > 0 else 0.0,
+                "removidos": contador("limpeza") - removidos_antes,
+                "estados": dict(conn.execute(SQL_DISTRIBUICAO).fetchall()),
+            })
+            relogio_simulado.avancar(days=1)
+    finally:
+        conn.close()
+        fechar_sessoes()
+        servidor.shutdown()
+        servidor.server_close()
+
+    relatorio = {
+        "dias": dias,
+        "pedidos_por_dia": pedidos_por_dia,
+        "data_inicial": data_inicial.isoformat(),
+        "simulador": vars(config),
+        "banco_bytes": tamanho_banco(db_file),
+        "resultados": resultados,
+    }
+    dir_temporario.cleanup()
+    return relatorio
+
+# ==============================================================================
+# --- RELATÓRIO ---
+# ==============================================================================
+def imprimir_relatorio(relatorio):
+    cabecalho_estados = ' '.join(f"{estado[:11]:>11}" for estado in ESTADOS_RELATORIO)
+    print(f"\n{'dia':>4} {'data':<10} {'dur. s':>7} {'criados':>7} {'eventos':>7} {'ev/s':>7} {'removidos':>9}  {cabecalho_estados}")
+    for r in relatorio["resultados"]:
+        estados = ' '.join(f"{r['estados'].get(estado, 0):>11}" for estado in ESTADOS_RELATORIO)
+        print(f"{r['dia']:>4} {r['data']:<10} {r['duracao_s']:>7.2f} {r['criados']:>7} {r['eventos']:>7} {r['eventos_por_s']:>7.1f} {r['removidos']:>9}  {estados}")
+
+    total_s = sum(r["duracao_s"] for r in relatorio["resultados"])
+    total_eventos = sum(r["eventos"] for r in relatorio["resultados"])
+    print(f"\nINFO: {relatorio['dias']} dia(s) simulado(s) em {total_s:.1f}s; {total_eventos} eventos de tracking enviados. "
+          f"Tamanho final do banco: {relatorio['banco_bytes'] / 1024:.0f} KiB.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simula dias de operação do pipeline com relógio virtual e APIs simuladas.")
+    parser.add_argument("--dias", type=int, default=30, help="Dias simulados (padrão: 30).")
+    parser.add_argument("--pedidos-por-dia", type=int, default=50, help="Pedidos criados por dia (padrão: 50).")
+    parser.add_argument("--data-inicial", type=date.fromisoformat, default=date.today(), help="Primeiro dia simulado, AAAA-MM-DD (padrão: hoje).")
+    parser.add_argument("--max-workers", type=int, help="Workers da criação e da consulta (padrão: configuração dos scripts).")
+    parser.add_argument("--latencia-ms", type=float, default=2)
+    parser.add_argument("--taxa-erro", type=float, default=0.0)
+    parser.add_argument("--arquivar", action="store_true", help="Arquiva os pedidos removidos pela limpeza (padrão: só remove).")
+    parser.add_argument("--saida", help="Grava o relatório em JSON neste arquivo.")
+    parser.add_argument("--verboso", action="store_true", help="Mostra a saída dos scripts a cada dia.")
+    args = parser.parse_args()
+
+    config = servidor_simulado.ConfiguracaoSimulador(latencia_ms=args.latencia_ms, distribuicao="fixa", taxa_erro=args.taxa_erro, deslocamento_dias=0)
+
+    print("======================================================================")
+    print("====== SIMULAÇÃO DO CICLO DE VIDA DOS PEDIDOS (RELÓGIO VIRTUAL) ======")
+    print("======================================================================")
+    relatorio = executar_simulacao(args.dias, args.pedidos_por_dia, args.data_inicial, config,
+                                   max_workers=args.max_workers, arquivar=args.arquivar, verboso=args.verboso)
+    imprimir_relatorio(relatorio)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+        print(f"INFO: Relatório gravado em '{args.saida}'.")
+    print("\n==================== EXECUÇÃO CONCLUÍDA ====================")